@@ -6,11 +6,12 @@ from keras.layers import Dense, Dropout, Flatten
 from keras.optimizers import Adam
 from keras import backend as K
 from keras import metrics
+from keras.utils import Sequence
 from theano.tensor import arctan, and_, or_
-from numba import jit
 import numpy as np
 from sklearn.model_selection import train_test_split
 import pandas as pd
+from training_data import load_arrays, get_mirror_index, home_away_stack
 import matplotlib.pyplot as plt
 
 
@@ -81,27 +82,73 @@ def create_model(input_dim,clip=False):
     model.compile(optimizer=adam, loss='mse', metrics=[rmse, maape, metrics.mae, spread_acc])
     return model
 """
-Reading in the features, predictors, and baseline values.
-"""
-def read_training(player_memory=None,team_memory=10,playoffs=True):
-   if player_memory is None:
-       player_memory = 'All'
-   data = pd.read_excel('Training/Player-%s,Team-%s,Playoffs-%s.xlsx'%(player_memory,team_memory,playoffs)) 
-   data = data.fillna(0)
-   Y = data['Score Differential']
-   baseline = data['Vegas Baseline']
-   X = data.drop('Score Differential',axis=1)
-   X = X.drop('Vegas Baseline', axis=1)
-   return X,Y,baseline
-"""
-Converting to np arrays so we can pass them into the model.
-"""
-def to_arrays(X,Y,baseline):
-    Y = np.array(Y)
-    X_names = list(X.columns)
-    X = np.array(X)
-    baseline = np.array(baseline)
-    return X,Y,X_names, baseline
+This streams the games to the network a batch at a time, straight from the
+memory mapped training data, instead of building the whole augmented array up
+front. Each batch is half games and half their mirrors, so a batch of 40 is 20
+games both ways round, and the mirroring gets done on the fly for just those
+games. Only the batch ever gets read into memory, no matter how big X gets.
+
+rows - the rows of X that are in this set, i.e. the training rows
+buffer_size - the games get shuffled in buffers of this many rows in a row of
+              X, and the order of the buffers gets shuffled, so each batch is
+              read from one part of the file instead of all over it. The
+              buffers start at a random offset each epoch so they don't always
+              hold the same games.
+"""
+class GameSequence(Sequence):
+    def __init__(self,X,Y,X_names,rows,batch_size=40,mirror=True,shuffle=True,buffer_size=4096,seed=42):
+        self.X = X
+        self.Y = Y
+        self.X_names = X_names
+        self.rows = np.sort(rows)
+        self.mirror = mirror
+        self.mirror_index = get_mirror_index(X_names)
+        self.games_per_batch = max(1,batch_size//2) if mirror else batch_size
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.rng = np.random.default_rng(seed)
+        self.order = self.rows
+        self.on_epoch_end()
+
+    def __len__(self):
+        return int(np.ceil(len(self.rows)/self.games_per_batch))
+
+    def get_rows(self,i):
+        return self.order[i*self.games_per_batch:(i + 1)*self.games_per_batch]
+
+    """
+    The score differentials of a batch, the mirrored games have the
+    differential negated.
+    """
+    def get_targets(self,rows):
+        Y = np.asarray(self.Y[rows],dtype=np.float32)
+        if self.mirror:
+            return np.concatenate((Y,-Y))
+        return Y
+
+    def __getitem__(self,i):
+        rows = self.get_rows(i)
+        X = np.asarray(self.X[rows],dtype=np.float32)
+        if self.mirror:
+            batch_X = np.empty((2*len(rows),X.shape[1]),dtype=np.float32)
+            batch_X[:len(rows)] = X
+            np.take(X,self.mirror_index,axis=1,out=batch_X[len(rows):])
+            X = batch_X
+        return home_away_stack(X,self.X_names), self.get_targets(rows)
+
+    """
+    Every score differential in the order the batches give them, for scoring
+    predictions on a set that isn't shuffled.
+    """
+    def targets(self):
+        return np.concatenate([self.get_targets(self.get_rows(i)) for i in range(len(self))])
+
+    def on_epoch_end(self):
+        if not self.shuffle:
+            return
+        rows = np.roll(self.rows,-int(self.rng.integers(self.buffer_size)))
+        buffers = [rows[start:start + self.buffer_size] for start in range(0,len(rows),self.buffer_size)]
+        self.order = np.concatenate([self.rng.permutation(buffers[b]) for b in self.rng.permutation(len(buffers))])
 
 """
 Splits the training and test data.
@@ -110,45 +157,6 @@ def training_and_test(X,Y,test_size=0.2):
     X_train, X_test, Y_train, Y_test = train_test_split(X,Y,test_size=test_size)
     return X_train, X_test, Y_train, Y_test
 """
-Here we're augmenting our data by flipping the home and away teams, and negating
-the differential to essentially double the size of our training set.
-"""
-@jit
-def augment(X,Y):
-    augmented_X = None
-    augmented_Y = np.array([])
-    mid = int(X.shape[1]/2)
-    for i in range(X.shape[0]):
-        aug_row = []
-        for j in range(X.shape[1]):
-            if j < mid:
-                aug_row.append(X[i][mid+j])
-            else:
-                aug_row.append(X[i][j-mid])
-        if augmented_X is None:
-            augmented_X = np.array(aug_row)
-        else:
-            augmented_X = np.vstack((augmented_X,np.array(aug_row)))
-        augmented_Y = np.append(augmented_Y,-Y[i])
-    X = np.vstack((X,augmented_X))
-    Y = np.append(Y,augmented_Y)
-    return X,Y
-"""
-Here we're changing the 1D shape that we were using for other models into a 
-2D shape that pairs up the home and away values.
-"""
-@jit
-def flat_to_2d(X):
-    X2d = []
-    offset = int(X.shape[1]/2)
-    for i in range(X.shape[0]):
-        row = []
-        for j in range(int(X.shape[1]/2)):
-            row.append([X[i][j],X[i][j+offset]])
-        X2d.append(row)
-    return np.asarray(X2d)
-
-"""
 Calculating our metrics to get the baseline errors.
 """
 
@@ -207,24 +215,26 @@ def make_plot(history,plot,epochs,baseline):
 This acts as our main
 """
 def evaluate_model(batch_size= 40, epochs = 250,player_memory=None,team_memory=10,playoffs=True):
-    X,Y,baseline = read_training(8,4)
-    X,Y,names,baseline = to_arrays(X,Y,baseline)
+    X,Y,names,baseline = load_arrays(8,4)
     baseline_rmse = get_rmse(Y,baseline)
     baseline_maape = get_maape(Y,baseline)
     baseline_mae = get_mae(Y,baseline)
     baseline_accuracy = spread_accuracy(Y,baseline)
-    X,Y_aug = augment(X,Y)
     #Y = np.clip(Y, -15,15)
-    X = flat_to_2d(X)
-    model = create_model(X.shape[1])
-    X_train, X_test, Y_train, Y_test = training_and_test(X,Y_aug,.35)
+    #We split the games, not the mirrored games, so a game and its mirror
+    #always end up on the same side
+    train_rows, test_rows = train_test_split(np.arange(X.shape[0]),test_size=.35)
+    train = GameSequence(X,Y,names,train_rows,batch_size)
+    test = GameSequence(X,Y,names,test_rows,batch_size,shuffle=False)
+    model = create_model(train[0][0].shape[1])
     model.summary()
-    history = model.fit(X_train,Y_train, batch_size, epochs, validation_data=(X_test,Y_test))
+    history = model.fit_generator(train,epochs=epochs,validation_data=test,shuffle=False)
     make_plot(history,'mean_absolute_error',epochs,baseline_mae)
     make_plot(history,'rmse',epochs,baseline_rmse)
     make_plot(history,'maape',epochs,baseline_maape)
     make_plot(history,'spread_acc',epochs,baseline_accuracy)
-    preds = model.predict(X_test)
+    preds = model.predict_generator(test)
+    Y_test = test.targets()
     print (baseline_accuracy)
     print (spread_accuracy(Y_test,preds))
 
@@ -7,114 +7,12 @@ from sklearn.ensemble import RandomForestRegressor
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from numba import jit
+from training_data import load_arrays, augment, data_fingerprint
 import pickle
-
-"""
-Here's we're going to read the X,Y, and baseline data.
-"""
-def read_training(player_memory=None,team_memory=10,playoffs=True):
-   if player_memory is None:
-       player_memory = 'All'
-   data = pd.read_excel('Training/Player-%s,Team-%s,Playoffs-%s.xlsx'%(player_memory,team_memory,playoffs)) 
-   data = data.fillna(0)
-   Y = data['Score Differential']
-   baseline = data['Vegas Baseline']
-   X = data.drop('Score Differential',axis=1)
-   X = X.drop('Vegas Baseline', axis=1)
-   return X,Y,baseline
-"""
-We'll convert those from pandas objects to numpy arrays. We don't have to with
-statsmodels, since it's based on R's use of dataframes, but numpy does perform
-much better than pandas. We'll save the names of the featuers in a list, so 
-we can reference what is what.
-"""
-
-def to_arrays(X,Y,baseline):
-    Y = np.array(Y)
-    X_names = list(X.columns)
-    X = np.array(X)
-    baseline = np.array(baseline)
-    return X,Y,X_names, baseline
-
-"""
-Here will be our error metrics for comparing our predictions to the baseline 
-prediction performance.
-"""
-
-"""
-Root Mean Square Error
-"""
-def get_rmse(Y,baseline):
-    return np.sqrt(np.mean((Y-baseline)**2))
-
-
-"""
-Mean Absolute Error
-"""
-def get_mae(Y,baseline):
-    return np.mean(np.abs(Y-baseline))
-
-
-"""
-Spread accuracy ends up being a slightly convoluted computation because of the 
-a spread is always defined on the favored team. In our case we had converted those
-spread lines to work against the home team no matter what, but that also means
-we had to negate some of them. So positive spreads imply the away team as a
-favorite, while negative spreads imply the home team. So if the spread was right
-and favored the home team, the spread will be negative and the the scoring
-differential will have to be "less than that negative spread. So that if the home team
-is favored, the home team has to score more points. While if the spread is positive
-the scoring differential has to greater than the positive spread. And here we're
-going to get the total number that meet either of those two requirements.
-"""
-
-def spread_accuracy(act,pred):
-    try:
-        pred = pred.flatten()
-    except:
-        pass
-    A = np.greater(pred,np.zeros_like(pred))
-    B = np.greater_equal(act,pred)
-    C = np.less(pred,np.zeros_like(pred))
-    D = np.less_equal(act, pred)
-    return np.mean(np.logical_or(np.logical_and(A,B) , 
-                                 np.logical_and(C,D)))
-
-"""
-Data Augmentation is a useful technique that allows us to get more meaningful
-data from what we already have.
-
-An example I'm used to working with is performing Affine Transformations on
-limited amounts of image data to get tons of more results.
-
-Here what we're going to do is essntially mirror the game results around the 
-teams. I.e. swap the home and away colums and negate the differnetial,
-essentially doubling the size of our data.
-
-We're jitting it here, just for that nice C speed array performance.
-"""
-@jit
-def augment(X,Y):
-    augmented_X = None
-    augmented_Y = np.array([])
-    mid = int(X.shape[1]/2)
-    for i in range(X.shape[0]):
-        aug_row = []
-        for j in range(X.shape[1]):
-            if j < mid:
-                aug_row.append(X[i][mid+j])
-            else:
-                aug_row.append(X[i][j-mid])
-        if augmented_X is None:
-            augmented_X = np.array(aug_row)
-        else:
-            augmented_X = np.vstack((augmented_X,np.array(aug_row)))
-        augmented_Y = np.append(augmented_Y,-Y[i])
-    X = np.vstack((X,augmented_X))
-    Y = np.append(Y,augmented_Y)
-    return X,Y
-
+import os
+from metrics import get_rmse, get_mae, spread_accuracy
+from importances import permutation_importances
+from model_registry import save_model
 
 """
 Here we're plotting our model
@@ -155,87 +53,128 @@ def compare_errors(preds,baseline,Y,Y_test):
 """
 This shuffles each feature and observes how much each feautre being shuffled
 affects the spread accuracy. This effect on the spread accuracy will be used
-as our feature importances.
+as our feature importances. The shuffling is done in parallel over the 
+features by permutation_importances.
 """
-def shuffle_importances(X_test,Y_test,model,names,acc):
-    importances = {}
-    for i in range(X_test.shape[1]):
-        new_X = X_test.copy()
-        np.random.shuffle(new_X[:,i])
-        shuffled_preds = model.predict(new_X)
-        shuffled_acc = spread_accuracy(Y_test,shuffled_preds)
-        importances[names[i]] = abs(acc - shuffled_acc)/acc
-    return importances
+def shuffle_importances(X_test,Y_test,model,names,repeats=1):
+    importances = permutation_importances(model,X_test,Y_test,names,'spread_accuracy',repeats)
+    return importances['importance'].abs().to_dict()
+
 
+"""
+Rather than fitting a set number of trees every time, we grow the forest a 
+step at a time with warm_start, and stop once adding trees doesn't change the
+out of bag score anymore, or we hit the cap on trees.
+"""
+def grow_forest(X_train,Y_train,max_trees=1500,step=100,tol=0.001):
+    model = RandomForestRegressor(n_estimators=min(step,max_trees),warm_start=True,oob_score=True,random_state=42,n_jobs=-1)
+    model.fit(X_train,Y_train)
+    last_oob = model.oob_score_
+    while model.n_estimators < max_trees:
+        model.n_estimators = min(model.n_estimators + step,max_trees)
+        model.fit(X_train,Y_train)
+        if abs(model.oob_score_ - last_oob) < tol:
+            break
+        last_oob = model.oob_score_
+    return model
+
+"""
+We're saving our best model to the model registry so we can later access it
+within our ipython notebook to access our SHAP plots along with the
+corresponding data, or score games with it.
+"""
+def save_best(model,train_data,feature_names,errors,training=None,n_features=None):
+    if n_features is None:
+        n_features = ''
+    (X_train,X_test),(Y_train,Y_test) = train_data
+    save_model(model,'rf%s'%n_features,feature_names=feature_names,training=training,metrics=errors,
+               data=(X_train,X_test,Y_train,Y_test))
 
 """
 This acts as our main for recursively finding the right features to fit our
-Random Forest against.
-"""
-def generate_model(X_train,Y_train,X_test,Y_test,Y,baseline):
-    base = RandomForestRegressor(n_estimators=1500,random_state=42,n_jobs=-1)
-    base.fit(X_train,Y_train)
-    
-    preds=base.predict(X_test)
-    errors = compare_errors(preds,baseline,Y,Y_test)
-    print ("All Features, n=%s:"%X_train.shape[1])
-    for name,error in errors.items():
-        print ('...',name,error)
-    
-    best_acc = errors['spread_accuracy']
-    #We're saving our best model here so we can later access it within our 
-    #ipython notebook to access our SHAP plots along with the corresponding 
-    #data 
-    with open('Model Results/RF/rf.pkl', 'wb') as pkl_file:
-        pickle.dump(base,pkl_file)
-    train_data = ((X_train,X_test), (Y_train, Y_test))
-    with open('Model Results/RF/data.pkl','wb') as data_pkl:
-        pickle.dump(train_data,data_pkl)
-    
-
-    final_number_of_features = 45
-    """
-    Here we're getting the feature importances, and dropping the features which
-    don't contribute up to the cumulatishve cutoff importance value for the features
-    """
-    important_train = X_train
-    important_test = X_test
-    while important_train.shape[1] > final_number_of_features:
-        shuf_importances = shuffle_importances(important_test,Y_test,base,names,errors['spread_accuracy'])
-        feature_importances = [(feature,importance) for feature, importance in shuf_importances.items()]
-        feature_importances = sorted(feature_importances, key = lambda x: x[1], reverse=True)
-        sorted_importances = [importance[1] for importance in feature_importances]
-        cum_importances = np.cumsum(sorted_importances)
-        max_val = cum_importances[-1]
-        
-        cutoff = np.where(cum_importances/max_val > 0.9)[0][0] + 1
-        important_names = [feature[0] for feature in feature_importances[:cutoff]]
-        important_indicies = [names.index(feature) for feature in important_names]
-            
-        important_train = important_train[:,important_indicies]
-        important_test = important_test[:,important_indicies]
-            
-        base.fit(important_train,Y_train)
-        preds = base.predict(important_test)
-        errors = compare_errors(preds,baseline,Y,Y_test)
-        print ("Dropped Features, n=%s:"%important_train.shape[1])
+Random Forest against. The first round fits all of the features with the full
+number of trees, and every round after that gets the feature importances, 
+keeps the features which contribute up to the cumulative cutoff importance 
+value, and refits with at most round_trees trees. 
+
+selected always holds the columns of the original X that are still in, so the
+names always line up with the columns. We stop once we're down to the final
+number of features, or the spread accuracy hasn't improved in patience rounds.
+
+The rounds get cached under a fingerprint of the training and test data, so if
+a selection gets interrupted we can pick back up from the last round we 
+finished, and we never load a round from different data.
+
+training - the memory parameters of the training data, kept with the saved models
+
+Returns the names of the features of the best model.
+"""
+def generate_model(X_train,Y_train,X_test,Y_test,Y,baseline,names,final_number_of_features=45,full_trees=1500,round_trees=300,patience=2,cutoff_importance=0.9,cache_dir='Model Results/RF/RFE',training=None):
+    os.makedirs(cache_dir,exist_ok=True)
+    fingerprint = data_fingerprint(X_train,Y_train,X_test,Y_test)
+    selected = np.arange(X_train.shape[1])
+    best_acc = None
+    best_selected = selected
+    rounds_without_improvement = 0
+    round_number = 0
+    get_cache = lambda round_number: os.path.join(cache_dir,'%s-round-%s.pkl'%(fingerprint,round_number))
+    while True:
+        cache = get_cache(round_number)
+        if os.path.exists(cache):
+            with open(cache,'rb') as cache_file:
+                cached = pickle.load(cache_file)
+            selected, model, errors = cached['selected'], cached['model'], cached['errors']
+            print ("Loaded round %s from cache"%round_number)
+        else:
+            max_trees = full_trees if round_number == 0 else round_trees
+            model = grow_forest(X_train[:,selected],Y_train,max_trees)
+            preds = model.predict(X_test[:,selected])
+            errors = compare_errors(preds,baseline,Y,Y_test)
+            with open(cache,'wb') as cache_file:
+                pickle.dump({'selected':selected,'model':model,'errors':errors},cache_file)
+        if round_number == 0:
+            print ("All Features, n=%s:"%len(selected))
+        else:
+            print ("Dropped Features, n=%s:"%len(selected))
         for name,error in errors.items():
             print ('...',name,error)
-        if errors['spread_accuracy'] > best_acc:
-            #We're saving our best model here so we can later access it within our 
-            #ipython notebook to access our SHAP plots along with the corresponding 
-            #data
-            best_acc = errors['spread_accuracy']
-            with open('Model Results/RF/rf%s.pkl'%important_train.shape[1], 'wb') as pkl_file:
-                pickle.dump(base,pkl_file)
-            train_data = ((important_train,important_test),(Y_train,Y_test))
-            with open('Model Results/RF/data%s.pkl'%X_train.shape[1],'wb') as data_pkl:
-                pickle.dump(train_data,data_pkl)
-
-
 
-X,Y,baseline = read_training(8,4)
-X,Y,names,baseline = to_arrays(X,Y,baseline)
-X,Y_aug = augment(X,Y) 
-X_train, X_test, Y_train, Y_test = training_and_test(X,Y_aug,0.25)
-generate_model(X_train,Y_train,X_test,Y_test,Y,baseline)
+        if best_acc is None or errors['spread_accuracy'] > best_acc:
+            best_acc = errors['spread_accuracy']
+            best_selected = selected
+            rounds_without_improvement = 0
+            train_data = ((X_train[:,selected],X_test[:,selected]),(Y_train,Y_test))
+            save_best(model,train_data,[names[i] for i in selected],errors,training,None if round_number == 0 else len(selected))
+        else:
+            rounds_without_improvement += 1
+        if rounds_without_improvement >= patience or len(selected) <= final_number_of_features:
+            break
+
+        #If the next round is already cached it has the features we'd pick, so
+        #there's no need to shuffle them all again
+        if os.path.exists(get_cache(round_number + 1)):
+            round_number += 1
+            continue
+        selected_names = [names[i] for i in selected]
+        shuf_importances = shuffle_importances(X_test[:,selected],Y_test,model,selected_names)
+        importances = np.array([shuf_importances[name] for name in selected_names])
+        order = np.argsort(-importances,kind='mergesort')
+        cum_importances = np.cumsum(importances[order])
+        if cum_importances[-1] == 0:
+            break
+        cutoff = np.where(cum_importances/cum_importances[-1] > cutoff_importance)[0][0] + 1
+        if cutoff == len(selected):
+            break
+        selected = selected[order[:cutoff]]
+        round_number += 1
+    return [names[i] for i in best_selected]
+
+
+
+#The guard is here so the importance worker processes don't rerun all of this
+#if they have to import this file
+if __name__ == '__main__':
+    X,Y,names,baseline = load_arrays(8,4)
+    X,Y_aug = augment(X,Y,names)
+    X_train, X_test, Y_train, Y_test = training_and_test(X,Y_aug,0.25)
+    generate_model(X_train,Y_train,X_test,Y_test,Y,baseline,names,training={'player_memory':8,'team_memory':4,'playoffs':True})
@@ -0,0 +1,159 @@
+"""
+Walk forward backtesting.
+
+The model scripts all use a random train_test_split, which means we're
+training on games that happened after the games we're testing on, and the
+accuracy we get from that isn't one we could actually get betting on games
+before they happen.
+
+Here we train on every game before a given week, predict that week, and then
+roll forward a week at a time, so every prediction only ever uses games that
+already happened. We can also roll forward a season at a time, which is a lot
+faster and close to how we'd actually retrain.
+
+The training data is written in order of year and week by make_training, so
+the games before any week are just the first rows of X, and each fold's
+training set is a slice of the memory mapped X instead of a copy. Each worker
+maps the training data once when it starts, so the folds only send indexes
+back and forth. The predictions for each fold are cached, so rerunning a
+backtest, or one that got interrupted, only fits the folds it hasn't done yet.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool, cpu_count, freeze_support
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+from training_data import load_arrays, read_keys, get_training_path, augment, data_fingerprint
+from metrics import get_rmse, get_mae, spread_accuracy
+
+"""
+The models we can backtest, these get the parameters passed to them.
+"""
+MODELS = {'rf': RandomForestRegressor,
+          'ols': LinearRegression}
+
+"""
+This gets the folds as (year, week, first row, last row) of the games in that
+week, or season if we're folding by season. Games before start_year are only
+ever trained on.
+"""
+def get_folds(keys,start_year,fold_by='week'):
+    if fold_by == 'week':
+        periods = list(zip(keys['Year'],keys['Week']))
+    else:
+        periods = [(year,0) for year in keys['Year']]
+    folds = []
+    first = 0
+    for i in range(1,len(periods) + 1):
+        if i == len(periods) or periods[i] != periods[first]:
+            year, week = periods[first]
+            if year >= start_year and first > 0:
+                folds.append((year,week,first,i))
+            first = i
+    return folds
+
+"""
+Each worker maps the training data in once when it starts.
+"""
+def init_worker(player_memory,team_memory,playoffs,training_dir):
+    global worker
+    X,Y,X_names,baseline = load_arrays(player_memory,team_memory,playoffs,training_dir=training_dir)
+    worker = {'X':X,'Y':Y,'X_names':X_names}
+
+"""
+This fits the model on every game before the fold and predicts the fold, or
+loads the predictions if we've already done this fold.
+"""
+def run_fold(task):
+    year, week, first, last, model_name, params, mirror, cache = task
+    if os.path.exists(cache):
+        return first, last, np.load(cache)
+    X_train, Y_train = worker['X'][:first], worker['Y'][:first]
+    if mirror:
+        X_train, Y_train = augment(X_train,Y_train,worker['X_names'])
+    model = MODELS[model_name](**params)
+    if hasattr(model,'n_jobs'):
+        model.n_jobs = 1
+    model.fit(X_train,Y_train)
+    preds = model.predict(worker['X'][first:last]).astype(np.float32)
+    np.save(cache,preds)
+    return first, last, preds
+
+"""
+The fold caches are named by a hash of everything that goes into a fold's
+predictions, so changing the model, its parameters, or the training data
+never reuses stale predictions. The training data goes in by its contents, 
+along with the weeks that make up the folds, so regenerating it with the same
+number of games doesn't reuse the old folds either.
+"""
+def get_config_hash(model_name,params,mirror,X,Y,X_names,keys):
+    config = json.dumps({'model':model_name,'params':params,'mirror':mirror,'features':list(X_names),
+                         'data':data_fingerprint(X,Y,keys[['Year','Week']].values)},sort_keys=True)
+    return hashlib.sha1(config.encode()).hexdigest()[:12]
+
+"""
+This gets the spread accuracy, MAE, and RMSE for each season for both our
+predictions and the Vegas line.
+"""
+def season_metrics(keys,Y,baseline,preds,tested):
+    results = []
+    for year in sorted(keys.loc[tested,'Year'].unique()):
+        games = tested & (keys['Year'] == year).values
+        results.append({'Year':year,
+                        'games':int(games.sum()),
+                        'spread_accuracy':spread_accuracy(Y[games],preds[games]),
+                        'mae':get_mae(preds[games],Y[games]),
+                        'rmse':get_rmse(preds[games],Y[games]),
+                        'baseline_spread_accuracy':spread_accuracy(Y[games],baseline[games]),
+                        'baseline_mae':get_mae(baseline[games],Y[games]),
+                        'baseline_rmse':get_rmse(baseline[games],Y[games])})
+    return pd.DataFrame(results)
+
+"""
+This runs the whole backtest over a process pool and returns the predictions
+for every game we tested on along with the per season metrics.
+
+model_name - a key of MODELS
+params - the parameters for the model
+fold_by - 'week' or 'season'
+mirror - whether to train on the mirrored games as well
+"""
+def backtest(model_name='rf',params=None,player_memory=8,team_memory=4,playoffs=True,start_year=2004,fold_by='week',mirror=True,
+             gofast=True,training_dir='Training',cache_dir='Model Results/Backtest'):
+    if params is None:
+        params = {}
+    path = get_training_path(player_memory,team_memory,playoffs,training_dir)
+    keys = read_keys(path)
+    X,Y,X_names,baseline = load_arrays(player_memory,team_memory,playoffs,training_dir=training_dir)
+    order = np.lexsort((keys['Week'].values,keys['Year'].values))
+    if not np.array_equal(order,np.arange(len(order))):
+        raise ValueError('%s is not in order of year and week, rerun make_training.py'%path)
+    config_hash = get_config_hash(model_name,params,mirror,X,Y,X_names,keys)
+    fold_dir = os.path.join(cache_dir,'%s-%s'%(model_name,config_hash))
+    os.makedirs(fold_dir,exist_ok=True)
+    folds = get_folds(keys,start_year,fold_by)
+    tasks = [(year,week,first,last,model_name,params,mirror,os.path.join(fold_dir,'%s-%s.npy'%(year,week)))
+             for year, week, first, last in folds]
+    preds = np.full(len(Y),np.nan,dtype=np.float32)
+    if not gofast:
+        cores = int(cpu_count()*.75)
+    else:
+        cores = int(cpu_count()*0.9)
+    cores = max(1,cores)
+    print ("Backtesting %s folds using %s cores:"%(len(tasks),cores))
+    with Pool(cores,initializer=init_worker,initargs=(player_memory,team_memory,playoffs,training_dir)) as pool:
+        #The later folds have the most games to train on, so we start those first
+        for first, last, fold_preds in pool.imap_unordered(run_fold,tasks[::-1]):
+            preds[first:last] = fold_preds
+    tested = ~np.isnan(preds)
+    results = season_metrics(keys,np.asarray(Y),np.asarray(baseline),preds,tested)
+    results.to_csv(os.path.join(fold_dir,'seasons.csv'),index=False)
+    return preds, results
+
+if __name__ == '__main__':
+    freeze_support()
+    preds, results = backtest('rf',{'n_estimators':300,'random_state':42})
+    print (results.to_string(index=False))
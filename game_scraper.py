@@ -30,11 +30,13 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
 from selenium.common.exceptions import TimeoutException
 from multiprocessing import Pool, cpu_count, freeze_support
+from schemas import apply_schema
 
 """
 We're going to initialze a game and table object, with each table being in a list
 belonging to each individual game. Since there are 20+ tables per game, this makes
-keeping track of the tables easier.
+keeping track of the tables easier. When a table's dataframe gets created the
+schema for that table gets applied, so every column goes out with its type.
 """
 class Game(object):
     def __init__(self,date,away,home,year,week):
@@ -53,7 +55,7 @@ class Table(object):
         self.rows = []
         
     def create_df(self):
-        self.df = pd.DataFrame(self.rows)
+        self.df = apply_schema(pd.DataFrame(self.rows),self.main_title)
         self.rows = []
         
 """
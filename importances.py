@@ -0,0 +1,91 @@
+"""
+Permutation importances for any fitted model with a predict method.
+
+The idea is the same as before, shuffle a feature in the test set and see how
+much worse the model does, but instead of copying all of X_test for every
+feature and predicting one feature at a time, the features are split up across
+worker processes. Each worker gets the model and the test set once when it
+starts, along with a single scratch copy of X_test that it shuffles one column
+of at a time and puts back when it's done, so nothing gets copied per feature.
+
+Each feature can be shuffled a number of times, so we get a mean importance
+with a confidence interval instead of the luck of a single shuffle.
+"""
+import numpy as np
+import pandas as pd
+from scipy import stats
+from multiprocessing import Pool, cpu_count
+from metrics import SCORERS
+
+"""
+This sets up each worker process. The model runs single threaded inside the
+workers, since the workers are already using all of the cores.
+"""
+def init_worker(model,X_test,Y_test,scorer):
+    global worker
+    if hasattr(model,'n_jobs'):
+        model.n_jobs = 1
+    worker = {'model':model,
+              'X':X_test,
+              'Y':Y_test,
+              'scratch':np.array(X_test),
+              'scorer':SCORERS[scorer][0]}
+
+"""
+This shuffles a single feature in the scratch copy a number of times, scoring
+the model each time, and then puts the column back the way it was.
+"""
+def permute_feature(task):
+    i, seed, repeats = task
+    rng = np.random.default_rng(seed)
+    X, scratch = worker['X'], worker['scratch']
+    scores = []
+    for _ in range(repeats):
+        scratch[:,i] = X[rng.permutation(X.shape[0]),i]
+        preds = worker['model'].predict(scratch)
+        scores.append(worker['scorer'](worker['Y'],preds))
+    scratch[:,i] = X[:,i]
+    return i, scores
+
+"""
+This gets the importance of every feature as how much shuffling it hurts the
+score, relative to the unshuffled score. So for spread accuracy an importance
+of .05 means the accuracy dropped 5% when that feature was shuffled. It's the
+same direction for the errors, where it means the error went up 5%.
+
+scorer - 'spread_accuracy', 'mae', or 'rmse'
+repeats - how many times each feature gets shuffled
+confidence - the confidence level of the interval around the mean importance
+
+Returns a dataframe indexed by the feature names with the mean importance, its
+standard deviation, and the confidence interval.
+"""
+def permutation_importances(model,X_test,Y_test,names,scorer='spread_accuracy',repeats=5,confidence=0.95,gofast=True,seed=42):
+    score_func, higher_is_better = SCORERS[scorer]
+    base_score = score_func(Y_test,model.predict(X_test))
+    if not gofast:
+        cores = int(cpu_count()*.75)
+    else:
+        cores = int(cpu_count()*0.9)
+    cores = max(1,min(cores,X_test.shape[1]))
+    seeds = np.random.SeedSequence(seed).generate_state(X_test.shape[1])
+    tasks = [(i,int(seeds[i]),repeats) for i in range(X_test.shape[1])]
+    scores = np.empty((X_test.shape[1],repeats))
+    with Pool(cores,initializer=init_worker,initargs=(model,X_test,Y_test,scorer)) as pool:
+        for i, feature_scores in pool.imap_unordered(permute_feature,tasks):
+            scores[i] = feature_scores
+    if higher_is_better:
+        drops = (base_score - scores)/base_score
+    else:
+        drops = (scores - base_score)/base_score
+    importance = drops.mean(axis=1)
+    if repeats > 1:
+        std = drops.std(axis=1,ddof=1)
+        half_width = stats.t.ppf((1 + confidence)/2,repeats - 1)*std/np.sqrt(repeats)
+    else:
+        std = np.zeros(len(importance))
+        half_width = np.zeros(len(importance))
+    return pd.DataFrame({'importance':importance,
+                         'std':std,
+                         'ci_low':importance - half_width,
+                         'ci_high':importance + half_width},index=list(names))
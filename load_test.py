@@ -0,0 +1,53 @@
+"""
+Load testing server.py. This sends the same matchups to the server from a
+bunch of threads at once, and reports the throughput and the latency
+percentiles, so we know how quickly we can rescore games when the lines move.
+
+Start the server first, then i.e.
+python load_test.py Jets Patriots 2019-09-08
+"""
+import sys
+import json
+import threading
+import numpy as np
+from time import time
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+"""
+Each thread sends its requests one after another and records how long each
+one took.
+"""
+def send_requests(url,requests,latencies):
+    for _ in range(requests):
+        start = time()
+        with urlopen(url) as response:
+            json.loads(response.read())
+        latencies.append(time() - start)
+
+def load_test(away,home,date,model='rf',threads=8,requests=200,host='127.0.0.1',port=8000):
+    url = 'http://%s:%s/predict?%s'%(host,port,urlencode({'away':away,'home':home,'date':date,'model':model}))
+    #One request up front so we don't time building features for an old date
+    with urlopen(url) as response:
+        print (json.loads(response.read()))
+    latencies = []
+    workers = [threading.Thread(target=send_requests,args=(url,requests,latencies)) for _ in range(threads)]
+    start = time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time() - start
+    latencies = np.array(latencies)*1000
+    results = {'requests':len(latencies),
+               'requests_per_second':len(latencies)/elapsed,
+               'p50_ms':np.percentile(latencies,50),
+               'p95_ms':np.percentile(latencies,95),
+               'p99_ms':np.percentile(latencies,99),
+               'max_ms':latencies.max()}
+    for name, val in results.items():
+        print ('...',name,val)
+    return results
+
+if __name__ == '__main__':
+    load_test(*sys.argv[1:4])
@@ -9,18 +9,12 @@ The main goal is to condense the information scraped from 20+ sheets per game
 into a single row per game, based off of combined performance totals.
 """
 import pandas as pd
-from glob import iglob
+from glob import glob, iglob
 import os
+import shutil
+import pickle
 from multiprocessing import Pool, cpu_count, freeze_support
-"""
-A class that just initiates to a single dictionary representation isn't a good
-use case for a class structure. The chose to represent this as an object only
-since I would normally be making this dictionary a global variable to deal 
-with the multiprocessing workflow.
-"""
-class Teams(object):
-    def __init__(self):
-        self.dict = {}
+from schemas import read_sheets
 """
 Here we're going through each game file path and extracting the home team,
 the away team, and the date. 
@@ -71,238 +65,177 @@ def get_team_dict():
     return team_dict
 
 """
-The following get_team funcitons get the sums of the desired_stats for each and deffensive sheet.
+Each of the per team sheets is a filter on one of the game sheets, by the
+players that had any volume in that part of the game, along with the stats we
+want to keep from that sheet. The filters are done once over the whole game 
+sheet, for both teams at the same time, and then split out by Tm.
+
+sheet name: (game sheet, volume columns, desired stats)
 """
-def get_team_passing(offense_sheet,team,fumbles=False,desired_stats=['Player','Pass Att','Pass Cmp','Pass Int','Pass Sk','Pass Yds', 'Pass Sk Yds', 'Pass TD']):
-    offense_sheet.fillna(0)
-    passers = offense_sheet.loc[(offense_sheet['Tm'] == team) & (offense_sheet['Pass Att'] > 0)]
-    try:
-        return passers[desired_stats]
-    except KeyError:
-        for key in desired_stats:
-            if 'Fumble' in key:
-                desired_stats.remove(key)
-        return passers[desired_stats]
-    
-def get_team_rushing(offense_sheet,team,fumbles=False,desired_stats=['Player','Rush Att', 'Rush TD', 'Rush Yds']):
-    offense_sheet.fillna(0)
-    rushers = offense_sheet.loc[(offense_sheet['Tm'] == team) & (offense_sheet['Rush Att'] > 0)]
-    try:
-        return rushers[desired_stats]
-    except KeyError:
-        for key in desired_stats:
-            if 'Fumble' in key:
-                desired_stats.remove(key)
-        return rushers[desired_stats]
-    
-def get_team_receiving(offense_sheet,team,fumbles=False,desired_stats=['Player','Receive Rec', 'Receive Tgt', 'Receive Yds', 'Receive TD']):
-    offense_sheet.fillna(0)
-    receivers = offense_sheet.loc[(offense_sheet['Tm'] == team) & (offense_sheet['Receive Tgt'] > 0)]
-    try:
-        return receivers[desired_stats]
-    except KeyError:
-        for key in desired_stats:
-            if 'Fumble' in key:
-                desired_stats.remove(key)
-        return receivers[desired_stats]
-
-def get_team_kicking(kicking_sheet,team,desired_stats=['Player','Scoring FGA', 'Scoring FGM','Scoring XPA', 'Scoring XPM']):
-    kicking_sheet.fillna(0)
-    kickers = kicking_sheet.loc[(kicking_sheet['Tm'] == team) & ((kicking_sheet['Scoring FGA'] > 0) | (kicking_sheet['Scoring XPA'] > 0))]
-    return kickers[desired_stats]
-   
-def get_team_punting(kicking_sheet,team,desired_stats=['Player','Scoring Pnt', 'Scoring Yds']):
-    kicking_sheet.fillna(0)
-    punters = kicking_sheet.loc[(kicking_sheet['Tm'] == team) & (kicking_sheet['Scoring Pnt'] > 0)]
-    return punters[desired_stats]
-
-def get_team_punt_returns(return_sheet,team,desired_stats=['Player','PR Ret', 'PR Yds', 'PR TD']):
-    return_sheet.fillna(0)
-    punt_return = return_sheet.loc[(return_sheet['Tm'] == team) & (return_sheet['PR Ret'] > 0)]
-    return punt_return[desired_stats]
-
-def get_team_kick_returns(return_sheet,team,desired_stats=['Player', 'KR Rt', 'KR Yds', 'KR TD']):
-    return_sheet.fillna(0)
-    kick_return = return_sheet.loc[(return_sheet['Tm'] == team) & (return_sheet['KR Rt'] > 0)]
-    return kick_return[desired_stats]
-
-def get_offensive_game_stats(sheets,team):
-    stats = sheets['Team Stats - %s'%team]
-    score = sheets['Scoring'][team].values[-1]
-    fourth_downs = stats['Fourth Down Conv.']
-    fourth_hyph = fourth_downs[0].find('-')
-    fourth_down_cvt = fourth_downs[0][:fourth_hyph]
-    fourth_down_atts = fourth_downs[0][fourth_hyph+1:]
-    fumble_tots = stats['Fumbles-Lost']
-    fumble_hyph = fumble_tots[0].find('-')
-    fumbles = fumble_tots[0][:fumble_hyph]
-    fumbles_lost = fumble_tots[0][fumble_hyph+1:]
-    third_downs = stats['Third Down Conv.']
-    third_hyph = third_downs[0].find('-')
-    third_down_cvt = third_downs[0][:third_hyph]
-    third_down_atts = third_downs[0][third_hyph+1:]
-    offensive_stats = {}
-    offensive_stats['First Downs'] = stats['First Downs'][0]
-    offensive_stats['Third Down Att'] = third_down_atts
-    offensive_stats['Third Down Cvt'] = third_down_cvt
-    offensive_stats['Fourth Down Att'] = fourth_down_atts
-    offensive_stats['Fourth Down Cvt'] = fourth_down_cvt 
-    offensive_stats['Fumbles'] = fumbles
-    offensive_stats['Fumbles Lost'] = fumbles_lost
-    offensive_stats['Total Points'] = score
-    return offensive_stats
-
-
-def get_team_defensive_totals(defense_sheet,team,desired_stats=['DefInt Int', 'DefInt TD', 'Fumble TD', 'Sck&Ttl Sk']):
-    defense_sheet.fillna(0)
-    defense_sheet = defense_sheet.loc[defense_sheet['Tm'] == team]
-    defense_tots = defense_sheet[desired_stats].sum(axis=0)
-    defense_df = {}
-    for key,val in defense_tots.items():
-        defense_df[key] = val
-    return defense_df
+STAT_SPLITS = {'Passing': ('Offense', ['Pass Att'], ['Player','Pass Att','Pass Cmp','Pass Int','Pass Sk','Pass Yds', 'Pass Sk Yds', 'Pass TD']),
+               'Rushing': ('Offense', ['Rush Att'], ['Player','Rush Att', 'Rush TD', 'Rush Yds']),
+               'Rec': ('Offense', ['Receive Tgt'], ['Player','Receive Rec', 'Receive Tgt', 'Receive Yds', 'Receive TD']),
+               'Kicking': ('Kicking', ['Scoring FGA', 'Scoring XPA'], ['Player','Scoring FGA', 'Scoring FGM','Scoring XPA', 'Scoring XPM']),
+               'Punting': ('Kicking', ['Scoring Pnt'], ['Player','Scoring Pnt', 'Scoring Yds']),
+               'Kick Return': ('Kick Return', ['KR Rt'], ['Player', 'KR Rt', 'KR Yds', 'KR TD']),
+               'Punt Return': ('Kick Return', ['PR Ret'], ['Player','PR Ret', 'PR Yds', 'PR TD'])}
+
+DEFENSE_STATS = ['DefInt Int', 'DefInt TD', 'Fumble TD', 'Sck&Ttl Sk']
+
 """
 These defensive compliments are what I would best describe as the 'Allowed' stats.
 These are determined more by the performance of the opposing offense than
 directly measured stats from the defense.
+
+Since there are only two teams in a game, what a team allowed is just the game
+total minus what that team did itself, so we can get them from the sums of the
+same splits we make for the team sheets.
+
+team sheet: [(defense stat, team sheet column)]
 """
-def get_defensive_compliment_stats(offense,defense):
-    passing,rushing,rec,punt_return,kick_return,game_stats, kicking, punting = offense
-    total_pass_attempts = passing['Pass Att'].sum()
-    total_pass_yards = passing['Pass Yds'].sum() - passing['Pass Sk Yds'].sum()
-    passing_tds_allowed = passing['Pass TD'].sum()
-    total_rush_attempts = rushing['Rush Att'].sum()
-    total_rush_yards = rushing['Rush Yds'].sum()
-    rushing_tds_allowed = rushing['Rush TD'].sum()
-    punt_returns_defended = punt_return['PR Ret'].sum()
-    punt_return_yards_allowed = punt_return['PR Yds'].sum()
-    punt_return_tds = punt_return['PR TD'].sum()
-    kick_returns_defended = kick_return['KR Rt'].sum()
-    kick_return_yards = kick_return['KR Yds'].sum()
-    kick_return_tds = kick_return['KR TD'].sum()
-    punts_defended = punting['Scoring Pnt'].sum()
-    defense['Punts Defended'] = punts_defended
-    defense['Pass Attempts Defended'] = total_pass_attempts
-    defense['Pass Yards Allowed'] = total_pass_yards
-    defense['Pass TDs Allowed'] = passing_tds_allowed
-    defense['Rush Attempts Defended'] = total_rush_attempts
-    defense['Rush Yards Allowed'] = total_rush_yards
-    defense['Rush TDs Allowed'] = rushing_tds_allowed
-    defense['Punt Returns Defended'] = punt_returns_defended
-    defense['Punt Return Yards Allowed'] = punt_return_yards_allowed
-    defense['Punt Return TDs Allowed'] = punt_return_tds
-    defense['Kick Returns Defended'] = kick_returns_defended
-    defense['Kick Return Yards Allowed'] = kick_return_yards
-    defense['Kick Return TDs Allowed'] = kick_return_tds
-    defense['Fumble FF'] = game_stats['Fumbles']
-    defense['Fumble FR'] = game_stats['Fumbles Lost']
-    defense['First Downs Allowed'] = game_stats['First Downs']
-    defense['Third Downs Defended'] = game_stats['Third Down Att']
-    defense['Third Downs Stopped'] = int(game_stats['Third Down Att']) - int(game_stats['Third Down Cvt'])
-    defense['Fourth Downs Defended'] = game_stats['Fourth Down Att']
-    defense['Fourth Downs Stopped'] = int(game_stats['Fourth Down Att']) - int(game_stats['Fourth Down Cvt'])
-    defense['Field Goals Allowed'] = kicking['Scoring FGM'].sum()
-    defense['Field Goals Defended'] = kicking['Scoring FGA'].sum()
-    defense['Points Allowed'] = game_stats['Total Points']
-    return defense
-"""
-This wraps all of the get functions into a single process.
-"""
-def get_stat_sheets(sheets,team):
-    sheet_dict = {}
-    sheet_dict['Passing'] = get_team_passing(sheets['Offense'],team)
-    sheet_dict['Rushing'] = get_team_rushing(sheets['Offense'],team)
-    sheet_dict['Rec'] = get_team_receiving(sheets['Offense'],team)
-    sheet_dict['Kicking'] = get_team_kicking(sheets['Kicking'],team)
-    sheet_dict['Punting'] = get_team_punting(sheets['Kicking'],team)
-    sheet_dict['Kick Return'] = get_team_kick_returns(sheets['Kick Return'],team)
-    sheet_dict['Punt Return'] = get_team_punt_returns(sheets['Kick Return'],team)
-    sheet_dict['Game Stats'] = get_offensive_game_stats(sheets,team)
-    sheet_dict['Defense'] = get_team_defensive_totals(sheets['Defense'],team)
-    return sheet_dict
-"""
-The converts all of the sheets to dicts, since appending to pandas is a
-performance nightmare, but converting a list of dicts to a new dataframe
-isn't an issue. 
-"""
-def to_dictionary_fix(sheets):
-    sheets['Passing'] = sheets['Passing'].to_dict('records')
-    sheets['Rushing'] = sheets['Rushing'].to_dict('records')
-    sheets['Rec'] = sheets['Rec'].to_dict('records')
-    sheets['Kicking'] = sheets['Kicking'].to_dict('records')
-    sheets['Kick Return'] = sheets['Kick Return'].to_dict('records')
-    sheets['Punting'] = sheets['Punting'].to_dict('records')
-    sheets['Punt Return'] = sheets['Punt Return'].to_dict('records')
-    sheets['Game Stats'] = [sheets['Game Stats']]
-    sheets['Defense'] = [sheets['Defense']]
-    return sheets
-
-"""
-This wraps the getting defensive complements for both teams, based on the 
-oppents offensive stats.
-"""
-def update_defensive_sheets(away_sheets,home_sheets):
-    away_offense = (away_sheets['Passing'], away_sheets['Rushing'], away_sheets['Rec'],
-                    away_sheets['Punt Return'], away_sheets['Kick Return'], away_sheets['Game Stats'], away_sheets['Kicking'], away_sheets['Punting'])
-    home_sheets['Defense'] = get_defensive_compliment_stats(away_offense,home_sheets['Defense'])
-    home_offense = (home_sheets['Passing'], home_sheets['Rushing'], home_sheets['Rec'],
-                    home_sheets['Punt Return'], home_sheets['Kick Return'], home_sheets['Game Stats'], home_sheets['Kicking'], home_sheets['Punting'])
-    away_sheets['Defense'] = get_defensive_compliment_stats(home_offense,away_sheets['Defense'])
-    return away_sheets, home_sheets
-"""
-We add in the week, year, and date to all of the sheets so we can easily
-index and identify each row.
-"""
-def add_index(sheets,year,week,date):
-    for sheetname, sheet in sheets.items():
-        sheet['Week'] = week
-        sheet['Year'] = year
-        sheet['Date'] = date
-
-"""
-This is the callback wrapper for the multiprocessing return. It uses the Teams
-global object to the dictionary into a list of dictionary sheets.
-
-TODO: Update this to use a defualtdict(list) from collections
-"""
-def update_sheets(callback_tuple):
-    away,away_sheets,home,home_sheets = callback_tuple
-    if away not in teams.dict:
-        teams.dict[away] = {}
-        for sn, sheet in away_sheets.items():
-            teams.dict[away][sn] = sheet
-    else:
-        for sn , sheet in away_sheets.items():
-            teams.dict[away][sn].extend(sheet)
-    if home not in teams.dict:
-        teams.dict[home] = {}
-        for sn, sheet in home_sheets.items():
-            teams.dict[home][sn] = sheet
-    else:
-        for sn, sheet in home_sheets.items():
-            teams.dict[home][sn].extend(sheet)
+ALLOWED_STATS = {'Punting': [('Punts Defended', 'Scoring Pnt')],
+                 'Passing': [('Pass Attempts Defended', 'Pass Att'),
+                             ('Pass Yards Allowed', 'Pass Yds'),
+                             ('Pass Sack Yards Allowed', 'Pass Sk Yds'),
+                             ('Pass TDs Allowed', 'Pass TD')],
+                 'Rushing': [('Rush Attempts Defended', 'Rush Att'),
+                             ('Rush Yards Allowed', 'Rush Yds'),
+                             ('Rush TDs Allowed', 'Rush TD')],
+                 'Punt Return': [('Punt Returns Defended', 'PR Ret'),
+                                 ('Punt Return Yards Allowed', 'PR Yds'),
+                                 ('Punt Return TDs Allowed', 'PR TD')],
+                 'Kick Return': [('Kick Returns Defended', 'KR Rt'),
+                                 ('Kick Return Yards Allowed', 'KR Yds'),
+                                 ('Kick Return TDs Allowed', 'KR TD')],
+                 'Kicking': [('Field Goals Allowed', 'Scoring FGM'),
+                             ('Field Goals Defended', 'Scoring FGA')]}
+
+"""
+This does the filtering for every one of the STAT_SPLITS on whatever game
+sheets it's given. The keys are any extra columns that we want to carry 
+through, like the game keys when this is a whole season of games at once.
+"""
+def split_team_sheets(sheets,keys=[]):
+    splits = {}
+    for sn, (game_sheet, volume, desired_stats) in STAT_SPLITS.items():
+        sheet = sheets[game_sheet]
+        has_volume = (sheet[volume].fillna(0) > 0).any(axis=1)
+        splits[sn] = sheet.loc[has_volume, ['Tm'] + keys + desired_stats]
+    return splits
+
+"""
+This gets the allowed stats for every team in the splits at once. The sums are
+grouped by the keys and Tm, and the opponent's totals are what's left over 
+from the game totals. If there are no keys, the splits are for a single game,
+so the game totals are just the sums over every team. Teams that don't show up
+in one of the splits still get the allowed stats from it.
+"""
+def get_allowed_stats(splits,teams=None,keys=[]):
+    if teams is None:
+        teams = pd.concat([splits[sn][keys + ['Tm']] for sn in ALLOWED_STATS]).drop_duplicates()
+        if keys:
+            teams = pd.MultiIndex.from_frame(teams)
+        else:
+            teams = pd.Index(teams['Tm'])
+    allowed = []
+    for sn, stats in ALLOWED_STATS.items():
+        columns = [col for _, col in stats]
+        split = splits[sn][keys + ['Tm'] + columns].fillna({col:0 for col in columns})
+        totals = split.groupby(keys + ['Tm'],observed=True)[columns].sum().reindex(teams,fill_value=0)
+        if keys:
+            game_totals = totals.groupby(level=keys).transform('sum')
+        else:
+            game_totals = totals.sum()
+        opp_totals = game_totals - totals
+        opp_totals.columns = [name for name, _ in stats]
+        allowed.append(opp_totals)
+    allowed = pd.concat(allowed,axis=1)
+    allowed['Pass Yards Allowed'] = allowed['Pass Yards Allowed'] - allowed.pop('Pass Sack Yards Allowed')
+    return allowed
 
 """
-Here we're writing the sheets at the end in their entirety.
+The Team Stats sheets keep a lot of stats as compound strings, i.e. a Third 
+Down Conv. of 5-12 is 5 conversions on 12 attempts. These are the ones we know
+how to split, and what each of their parts are called.
 """
-def write_sheets(teams_obj):
-    for team, sheets, in teams_obj.dict.items():
-        writer = pd.ExcelWriter('Teams/%s.xlsx'%team, engine='xlsxwriter')
-        for sn, sheet in sheets.items():
-            sheet = pd.DataFrame(sheet)
-            sheet.to_excel(writer,sn,index=False)
-        writer.close()
+COMPOUND_STATS = {'Third Down Conv.': ['Third Down Cvt', 'Third Down Att'],
+                  'Fourth Down Conv.': ['Fourth Down Cvt', 'Fourth Down Att'],
+                  'Fumbles-Lost': ['Fumbles', 'Fumbles Lost'],
+                  'Sacked-Yards': ['Sacked', 'Sacked Yards'],
+                  'Penalties-Yards': ['Penalties', 'Penalty Yards'],
+                  'Rush-Yds-TDs': ['Rush Att', 'Rush Yds', 'Rush TDs'],
+                  'Cmp-Att-Yd-TD-INT': ['Pass Cmp', 'Pass Att', 'Pass Yds', 'Pass TDs', 'Pass Int']}
 
+GAME_STATS = ['First Downs', 'Third Down Att', 'Third Down Cvt', 'Fourth Down Att',
+              'Fourth Down Cvt', 'Fumbles', 'Fumbles Lost']
+
+"""
+This splits a whole column of compound strings at once. The parts can be 
+negative, i.e. 3--5 for -5 net yards, so we match the numbers with a regex
+instead of splitting on every hyphen. Anything that doesn't match ends up as
+a missing value instead of breaking the whole column.
+"""
+def split_compound_column(column,names):
+    pattern = '^' + '-'.join([r'(-?\d+)']*len(names)) + '$'
+    parts = column.astype(str).str.strip().str.extract(pattern)
+    parts.columns = names
+    for name in names:
+        parts[name] = pd.to_numeric(parts[name]).astype('Int64')
+    return parts
+
+"""
+This parses any number of Team Stats rows at once, whether that's a single
+team's sheet from one game or every team's sheet from an entire archive of
+games. Every compound stat is split into integer columns, and any other
+columns like the game keys are kept, so the result is ready to be joined back
+on to whatever it came from.
 """
-This is the multiprocessing process, that parses each game sheet into a single
-row for each team.
+def parse_team_stats(stats):
+    parsed = [stats.drop([col for col in COMPOUND_STATS if col in stats],axis=1)]
+    for col, names in COMPOUND_STATS.items():
+        if col in stats:
+            parsed.append(split_compound_column(stats[col],names))
+    parsed = pd.concat(parsed,axis=1)
+    parsed['First Downs'] = pd.to_numeric(parsed['First Downs'],errors='coerce').astype('Int64')
+    return parsed
+
+"""
+This pulls the Team Stats sheets out of a game's sheets into a single table,
+with the team abbreviation each sheet belongs to and the game, so a whole 
+season of them can be stacked up and parsed at once.
+"""
+def read_team_stats(game,sheets):
+    team_stats = []
+    for sn, stats in sheets.items():
+        if sn.startswith('Team Stats - '):
+            stats['Tm'] = sn[len('Team Stats - '):]
+            stats['Game'] = game
+            team_stats.append(stats)
+    return pd.concat(team_stats,ignore_index=True)
+
 """
-def proc(game,team_dict):
-    away, home, date = get_teams(game)
-    year, week = get_year_week(game)
-    print ('...%s Week %s, %s vs %s'%(year,week,away,home))
-    sheets = pd.read_excel(game,sheet_name = None)
-    scoring = sheets['Scoring']
+Here we're getting the team wide offensive stats for every team in a batch of
+games, by parsing all of their Team Stats sheets at once. Anything that 
+couldn't be parsed stays missing, along with the downs the team was stopped on
+that need it.
+
+Returns the game stats and the downs stopped, each keyed by the game and the 
+team abbreviation.
+"""
+def get_season_game_stats(team_stats,season_games):
+    points = pd.Series({(game['Game'],game[side + ' Abb']):game[side + ' Points']
+                        for game in season_games for side in ('Away','Home')})
+    stats = parse_team_stats(team_stats).set_index(['Game','Tm'])[GAME_STATS].reindex(points.index)
+    stats['Total Points'] = points
+    stopped = pd.DataFrame({'Third Downs Stopped':stats['Third Down Att'] - stats['Third Down Cvt'],
+                            'Fourth Downs Stopped':stats['Fourth Down Att'] - stats['Fourth Down Cvt']})
+    return stats.to_dict('index'), stopped.to_dict('index')
+
+"""
+pro-football-reference's abbreviation for each team in the game, from the
+columns of the Scoring sheet, which has one for each team.
+"""
+def get_abbreviations(scoring,team_dict,away,home):
     col_titles = list(scoring)
     for abb in team_dict[away]:
         if abb in col_titles:
@@ -310,34 +243,248 @@ def proc(game,team_dict):
     for abb in team_dict[home]:
         if abb in col_titles:
             home_abb = abb
-    home_sheets = get_stat_sheets(sheets,home_abb)
-    away_sheets = get_stat_sheets(sheets,away_abb)
-    add_index(home_sheets,year,week,date)
-    add_index(away_sheets,year,week,date)
-    away_sheets,home_sheets = update_defensive_sheets(away_sheets,home_sheets)
-    away_sheets, home_sheets = to_dictionary_fix(away_sheets), to_dictionary_fix(home_sheets)
-    return (away,away_sheets,home,home_sheets)
-
-"""
-This is the multiprocessing wrapper. The return will callback to the global
-callback wrapper that updates each individual sheet, and then the teams will
-all write sequentially.
-"""
-def make_team_game_sheets(game_dir='Games',gofast=True):
-    global teams
-    teams = Teams()
+    return away_abb, home_abb
+
+"""
+This is the batch version of the team splits. Given an entire season of game
+sheets concatenated together, with the game keys added as columns, we can 
+split out every team's rows for every game, and every team's allowed stats for
+every game, all in one go.
+"""
+def get_season_stat_sheets(season_sheets,keys=['Year','Week','Date','Game']):
+    splits = split_team_sheets(season_sheets,keys)
+    allowed = get_allowed_stats(splits,keys=keys)
+    return splits, allowed.reset_index()
+
+"""
+This reads in the sheets for a batch of games, usually a season, and 
+concatenates them together with the game keys so we can use the batch mode 
+above, along with every game's Team Stats sheets. Every game file is only read
+once. Along with the sheets we get a list of the games, with each team's 
+abbreviation and their points.
+"""
+def read_season_sheets(games,team_dict,sheet_names=['Offense','Kicking','Kick Return','Defense']):
+    season_sheets = {sn:[] for sn in sheet_names}
+    team_stats = []
+    season_games = []
+    for game in games:
+        away, home, date = get_teams(game)
+        year, week = get_year_week(game)
+        print ('...%s Week %s, %s vs %s'%(year,week,away,home))
+        try:
+            sheets = read_sheets(game)
+            away_abb, home_abb = get_abbreviations(sheets['Scoring'],team_dict,away,home)
+            team_stats.append(read_team_stats(game,sheets))
+        except Exception as e:
+            raise ValueError('Could not read %s: %r'%(game,e))
+        for sn in sheet_names:
+            sheet = sheets[sn]
+            sheet['Year'] = year
+            sheet['Week'] = week
+            sheet['Date'] = date
+            sheet['Game'] = game
+            season_sheets[sn].append(sheet)
+        season_games.append({'Game':game,'Year':year,'Week':week,'Date':date,
+                             'Away':away,'Away Abb':away_abb,'Away Points':sheets['Scoring'][away_abb].values[-1],
+                             'Home':home,'Home Abb':home_abb,'Home Points':sheets['Scoring'][home_abb].values[-1]})
+    season_sheets = {sn:pd.concat(sheets,ignore_index=True) for sn, sheets in season_sheets.items()}
+    season_sheets['Team Stats'] = pd.concat(team_stats,ignore_index=True)
+    return season_sheets, season_games
+
+"""
+This turns a batch of games into the rows for each team's sheets. The player
+sheets and the allowed stats come from the batch splits, the game stats come
+from parsing every Team Stats sheet at once, the defensive totals are a single
+groupby over every game's Defense sheet, and the rest of the defense sheet 
+comes from the opposing team's game stats. If the opposing team's downs 
+couldn't be parsed, the downs they were stopped on are missing too.
+
+game_teams - which teams to make rows for in each game, both if a game isn't
+             in it
+
+Returns the lists of dictionary rows for each sheet for each team, with the
+games in the same order as season_games.
+"""
+def get_season_team_sheets(season_sheets,season_games,game_teams={}):
+    splits, allowed = get_season_stat_sheets(season_sheets)
+    index = pd.MultiIndex.from_tuples([(game['Game'],game[side + ' Abb']) for game in season_games for side in ('Away','Home')],
+                                      names=['Game','Tm'])
+    defense = season_sheets['Defense'][['Game','Tm'] + DEFENSE_STATS].fillna({col:0 for col in DEFENSE_STATS})
+    defense = defense.groupby(['Game','Tm'],observed=True)[DEFENSE_STATS].sum().reindex(index,fill_value=0)
+    allowed = allowed.drop(['Year','Week','Date'],axis=1).set_index(['Game','Tm']).reindex(index,fill_value=0)
+    defense = pd.concat([defense,allowed],axis=1)
+    defense = defense.to_dict('index')
+    game_stats, downs_stopped = get_season_game_stats(season_sheets['Team Stats'],season_games)
+    split_index = {sn:split.groupby(['Game','Tm'],observed=True).indices for sn, split in splits.items()}
+    team_sheets = {}
+    for game in season_games:
+        game_index = {'Week':game['Week'],'Year':game['Year'],'Date':game['Date']}
+        for side, opp in (('Away','Home'),('Home','Away')):
+            team, abb = game[side], game[side + ' Abb']
+            if team not in game_teams.get(game['Game'],[team]):
+                continue
+            sheets = team_sheets.setdefault(team,{})
+            for sn, (_, _, desired_stats) in STAT_SPLITS.items():
+                rows = splits[sn].iloc[split_index[sn].get((game['Game'],abb),[])][desired_stats]
+                sheets.setdefault(sn,[]).extend(rows.assign(**game_index).to_dict('records'))
+            sheets.setdefault('Game Stats',[]).append(dict(game_stats[(game['Game'],abb)],**game_index))
+            team_defense = dict(defense[(game['Game'],abb)])
+            opp_stats = game_stats[(game['Game'],game[opp + ' Abb'])]
+            opp_stopped = downs_stopped[(game['Game'],game[opp + ' Abb'])]
+            team_defense['Fumble FF'] = opp_stats['Fumbles']
+            team_defense['Fumble FR'] = opp_stats['Fumbles Lost']
+            team_defense['First Downs Allowed'] = opp_stats['First Downs']
+            team_defense['Third Downs Defended'] = opp_stats['Third Down Att']
+            team_defense['Third Downs Stopped'] = opp_stopped['Third Downs Stopped']
+            team_defense['Fourth Downs Defended'] = opp_stats['Fourth Down Att']
+            team_defense['Fourth Downs Stopped'] = opp_stopped['Fourth Downs Stopped']
+            team_defense['Points Allowed'] = opp_stats['Total Points']
+            sheets.setdefault('Defense',[]).append(dict(team_defense,**game_index))
+    return team_sheets
+
+"""
+Instead of calling back to a global object with every game, each worker writes
+its teams' rows for a batch of games into their own shard file under the shard
+directory. The shard name is the batch's season, so the shards sort in the
+order the games were played, and the parent only ever gets back the team names.
+"""
+def write_shard(shard_dir,team,sheets,shard_name):
+    team_shards = os.path.join(shard_dir,team)
+    os.makedirs(team_shards,exist_ok=True)
+    shard = os.path.join(team_shards,'%s.pckl'%shard_name)
+    with open(shard,'wb') as shard_file:
+        pickle.dump(sheets,shard_file)
+
+"""
+This is the reducer. It takes every shard a single team has, merges the lists
+of dictionary rows for each sheet, and writes that team's sheets in their 
+entirety. Only one team's history is ever held by a reducer at a time, and 
+since each team is its own task the writes happen in parallel. The shards
+are cleaned up once the team's sheets are written.
+
+If we're appending, the team's current sheets are read back in and the new
+rows from the shards go on the end of each of them.
+"""
+def merge_team_shards(team,shard_dir,team_dir,append=False):
+    team_shards = os.path.join(shard_dir,team)
+    team_path = os.path.join(team_dir,'%s.xlsx'%team)
+    shards = sorted(glob(os.path.join(team_shards,'*.pckl')))
+    sheets = {}
+    for shard in shards:
+        with open(shard,'rb') as shard_file:
+            game_sheets = pickle.load(shard_file)
+        for sn, sheet in game_sheets.items():
+            sheets.setdefault(sn,[]).extend(sheet)
+    if append and os.path.exists(team_path):
+        existing = read_sheets(team_path,team_sheet=True)
+    else:
+        existing = {}
+    writer = pd.ExcelWriter(team_path, engine='xlsxwriter')
+    for sn, sheet in sheets.items():
+        sheet = pd.DataFrame(sheet)
+        if sn in existing:
+            sheet = pd.concat([existing[sn],sheet],ignore_index=True,sort=False)
+        sheet.to_excel(writer,sheet_name=sn,index=False)
+    writer.close()
+    for shard in shards:
+        os.remove(shard)
+    os.rmdir(team_shards)
+    return team
+
+"""
+This is the map side of the process. It parses a season of games at once, in
+the order they were played, and writes each team's rows straight to their 
+shards, so the only thing sent back to the parent is which teams need to be 
+reduced.
+"""
+def season_proc(year,games,team_dict,shard_dir,game_teams={}):
+    #The dates in the file names are spelled out, i.e. September 10, 2017, so
+    #they have to be parsed to sort in the order the games were played
+    games = sorted(games,key=lambda game: (pd.to_datetime(get_teams(game)[2]),) + get_teams(game)[1::-1])
+    season_sheets, season_games = read_season_sheets(games,team_dict)
+    team_sheets = get_season_team_sheets(season_sheets,season_games,game_teams)
+    for team, sheets in team_sheets.items():
+        write_shard(shard_dir,team,sheets,year)
+    return list(team_sheets)
+
+"""
+For the incremental mode we need to know which games are already reflected in
+the team sheets. Every game a team played has a single row in its Game Stats
+sheet, so the team and date of those rows tell us what's already there.
+"""
+def get_processed_games(team_dir):
+    processed = set()
+    for team_path in iglob(os.path.join(team_dir,'*.xlsx')):
+        team = os.path.basename(team_path)[:-len('.xlsx')]
+        game_stats = pd.read_excel(team_path,sheet_name='Game Stats',usecols=['Date'])
+        for date in game_stats['Date'].values:
+            processed.add((team,str(date)))
+    return processed
+
+"""
+The pools only tell us something went wrong through their error callbacks, so
+we collect the errors from every task and raise once the pool is done with
+everything that failed.
+"""
+def check_errors(errors,step):
+    if not errors:
+        return
+    for name, e in errors:
+        print ('...error %s %s: %r'%(step,name,e))
+    raise RuntimeError('%s errors %s, see above'%(len(errors),step))
+
+"""
+This is the multiprocessing wrapper. The first pool maps every season of games
+into per team shards, and the second pool reduces those shards into each team's
+sheets, with every team being written in parallel.
+
+The shard directory gets cleared before we start, so shards left over from a
+run that crashed never get merged in twice. If any game or team fails, we say
+which ones and stop, instead of writing team sheets that are missing games.
+
+With incremental set, only games that aren't already in both teams' sheets are
+parsed, and their rows get appended to the existing team sheets instead of
+rewriting every team from the entire game archive. The rows only go to the
+teams that don't have the game yet, and only those teams are rewritten.
+"""
+def make_team_game_sheets(game_dir='Games',team_dir='Teams',gofast=True,incremental=False):
     if gofast == False:
         cores = int(cpu_count()*.8)
     else:
         cores = cpu_count()
+    shard_dir = os.path.join(team_dir,'Shards')
+    shutil.rmtree(shard_dir,ignore_errors=True)
+    os.makedirs(shard_dir)
     print ('Generating Training Data Using %s cores:'%cores)
+    teams = set()
+    errors = []
     pool = Pool(cores)
     team_dict = get_team_dict()
+    if incremental:
+        processed = get_processed_games(team_dir)
+    seasons = {}
+    game_teams = {}
     for game in iglob(game_dir + '/**/*.xlsx', recursive = True):
-        pool.apply_async(proc,args = (game,team_dict),callback=update_sheets)
+        if incremental:
+            away, home, date = get_teams(game)
+            game_teams[game] = [team for team in (away,home) if (team,date) not in processed]
+            if not game_teams[game]:
+                continue
+        seasons.setdefault(get_year_week(game)[0],[]).append(game)
+    for year, games in seasons.items():
+        pool.apply_async(season_proc,args = (year,games,team_dict,shard_dir,{game:game_teams[game] for game in games if game in game_teams}),
+                         callback=teams.update,error_callback=lambda e, year=year: errors.append((year,e)))
+    pool.close()
+    pool.join()
+    check_errors(errors,'parsing games')
+    print ('Writing %s Team Sheets:'%len(teams))
+    pool = Pool(cores)
+    for team in teams:
+        pool.apply_async(merge_team_shards,args = (team,shard_dir,team_dir,incremental),
+                         error_callback=lambda e, team=team: errors.append((team,e)))
     pool.close()
     pool.join()
-    write_sheets(teams)
+    check_errors(errors,'writing team sheets')
 
 if __name__ == '__main__':
     freeze_support()
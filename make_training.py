@@ -28,11 +28,15 @@ for trades and new players to the core, and their overall stats are what determi
 the players abilitly to the team.
 """
 import pandas as pd
+import numpy as np
 from glob import glob, iglob
 import os
-import pickle
+from bisect import bisect_left
+from collections import defaultdict
 from name_scraper import get_single_link, player_proc
 from multiprocessing import Pool, cpu_count, freeze_support
+from schemas import read_sheets, GAME_STATS
+from training_data import write_training, get_training_path
 
 """
 Again this tells us which PFR abbreviations correspond to what NFL team.
@@ -98,13 +102,13 @@ def get_back_ngames(player,date,player_memory,is_playoffs):
         sheet_name = 'Regular Season Table'
     if player_memory is None:
         try:
-            fp = pd.read_excel(player, sheet_name = sheet_name)
+            fp = read_sheets(player, sheet_name = sheet_name)
             player_history = fp.loc[(pd.to_datetime(fp['Date']) < pd.to_datetime(date))]
         except:
             return pd.DataFrame()
     else:
         try:
-            fp = pd.read_excel(player, sheet_name = sheet_name)
+            fp = read_sheets(player, sheet_name = sheet_name)
         except:
             return pd.DataFrame()
         player_history = fp.loc[(pd.to_datetime(fp['Date']) < pd.to_datetime(date))]
@@ -151,7 +155,7 @@ def get_player_history(player,team,date,playoffs,player_memory,player_dir,team_d
             #The try statements are here to catch if the player doens't have
             #a regular season sheet or if they don't have a playoff sheet.
             try:
-                season_player_history = pd.read_excel(player_file, 'Regular Season Table')
+                season_player_history = read_sheets(player_file, 'Regular Season Table')
                 check_player = season_player_history.loc[(pd.to_datetime(season_player_history['Date']).isin(pd.to_datetime(team_dates))) & (season_player_history['Tm'].isin(team_abb))]
             except:
                 check_player = pd.DataFrame()
@@ -161,7 +165,7 @@ def get_player_history(player,team,date,playoffs,player_memory,player_dir,team_d
                 break
             if playoffs:
                 try:
-                    playoff_player_history = pd.read_excel(player_file, 'Playoffs Table')
+                    playoff_player_history = read_sheets(player_file, 'Playoffs Table')
                     check_player = playoff_player_history.loc[(pd.to_datetime(playoff_player_history['Date']).isin(pd.to_datetime(team_dates))) & (playoff_player_history['Tm'].isin(team_abb))]
                 except:
                     pass
@@ -229,7 +233,7 @@ TODO: Change that while loop a sorted by dates and then just select the last
 player memory
 """
 def get_team_history(team,date,playoffs,team_memory,team_dir):
-    sheets = pd.read_excel(os.path.join(team_dir,'%s.xlsx'%team),sheet_name=None)
+    sheets = read_sheets(os.path.join(team_dir,'%s.xlsx'%team),team_sheet=True)
     current_game = sheets['Game Stats'].loc[(pd.to_datetime(sheets['Game Stats']['Date']) == pd.to_datetime(date))]
     current_year, current_week = current_game['Year'].values[0], current_game['Week'].values[0]
     history_sheets = {}
@@ -261,579 +265,105 @@ def get_team_history(team,date,playoffs,team_memory,team_dir):
     return history_sheets
 
 """
-There's a pattern here. These features functions are also a mess that's going
-to need some refactoring. I'm handling all of the edge cases with try, excepts
-intsead of using maybe a bunch of if/elifs, or maybe even functions.
-
-You'll see this problem holds true for the rest of the player average features
-that I catch the edge cases with a try except.
-
-TODO: Refactor into elifs/functions
-"""
-def passing_features(passing_sheet,player_memory,team,date,player_dir,playoffs):
-    passing_sheet = passing_sheet.fillna(0)
-    players = passing_sheet['Player'].unique()
-    sacks = passing_sheet['Pass Sk'].sum()
-    team_dates = passing_sheet['Date'].unique()
-    pass_completion = 0
-    int_per_att = 0
-    td_per_att = 0
-    total_atts = 0
-    pass_atts = {}
-    pass_cmp = {}
-    pass_ints = {}
-    pass_tds = {}
-    for player in players:
-        #Here we get the passing stats for that indivdual player
-        player_passing = passing_sheet.loc[passing_sheet['Player'] == player]
-        #Here we figure out how many attempts that the player made for the
-        #team in the team history
-        pass_atts[player] = player_passing['Pass Att'].sum()
-        #This is where it gets messy, and should probably be fixed into
-        #some cleaner elifs
-        if playoffs:
-            reg, playoff = get_player_history(player,team,date,playoffs,player_memory,player_dir,team_dates)
-            if playoff is not None:
-                #We're first gonna try to see if they have a regular season
-                #and a playoff history
-                try:
-                    player_atts = reg['Passing Att'].sum() + playoff['Passing Att'].sum()
-                    #if they don't have any attempts these are going to be zero
-                    #since we're normalizing for attempts
-                    if player_atts == 0:
-                        pass_cmp[player] = 0
-                        pass_ints[player] = 0
-                        pass_tds[player] = 0
-                    #if they do, let's get the values we want to calculate and 
-                    #normalize them with respect to their total atts
-                    else:
-                        pass_cmp[player] = (reg['Passing Cmp'].sum() + playoff['Passing Cmp'].sum())/(player_atts)
-                        pass_ints[player] = (reg['Passing Int'].sum() + playoff['Passing Int'].sum())/(player_atts)
-                        pass_tds[player] = (reg['Passing TD'].sum() + playoff['Passing TD'].sum())/(player_atts)            
-                #If we get an error
-                except KeyError:
-                    #Is it because of the playoffs?
-                    #if so basically do the same thing as above
-                    try:
-                        player_atts = reg['Passing Att'].sum()
-                        if player_atts == 0:
-                            pass_cmp[player] = 0
-                            pass_ints[player] = 0
-                            pass_tds[player] = 0
-                        else:
-                            pass_cmp[player] = reg['Passing Cmp'].sum()/(player_atts)
-                            pass_ints[player] = reg['Passing Int'].sum()/(player_atts)
-                            pass_tds[player] = reg['Passing TD'].sum()/(player_atts)
-                    #maybe they've only played in the playoffs
-                    except KeyError:
-                        #if they did only play in the playoffs, again do 
-                        #basically the same thing
-                        try:
-                            player_atts = playoff['Passing Att'].sum()
-                            if player_atts == 0:
-                                pass_cmp[player] = 0
-                                pass_ints[player] = 0
-                                pass_tds[player] = 0
-                            else:
-                                pass_cmp[player] = playoff['Passing Cmp'].sum()/(player_atts)
-                                pass_ints[player] = playoff['Passing Int'].sum()/(player_atts)
-                                pass_tds[player] = playoff['Passing TD'].sum()/(player_atts)
-                        #if they didn't, they more than likely have a single
-                        #attempt that went awry, so their stats are gonna 
-                        #be zero
-                        except KeyError:
-                            pass_cmp[player] = 0
-                            pass_ints[player] = 0
-                            pass_tds[player] = 0
-            #If they don't have any playoff history again basically do the same
-            #thing for the regular season
-            else:
-                player_atts = reg['Passing Att'].sum()
-                if player_atts == 0:
-                    pass_cmp[player] = 0
-                    pass_ints[player] = 0
-                    pass_tds[player] = 0
-                else:
-                    pass_cmp[player] = reg['Passing Cmp'].sum()/(player_atts)
-                    pass_ints[player] = reg['Passing Int'].sum()/(player_atts)
-                    pass_tds[player] = reg['Passing TD'].sum()/(player_atts)
-        #if we don't want playoffs just only do the regular season
-        else:
-            reg = get_player_history(player,team,date,playoffs,player_memory,player_dir,team_dates)
-            player_atts = reg['Passing Att'].sum()
-            if player_atts == 0:
-                    pass_cmp[player] = 0
-                    pass_ints[player] = 0
-                    pass_tds[player] = 0
-            else:
-                pass_cmp[player] = reg['Passing Cmp'].sum()/(player_atts)
-                pass_ints[player] = reg['Passing Int'].sum()/(player_atts)
-                pass_tds[player] = reg['Passing TD'].sum()/(player_atts)
-    #this is going to be the team total of attempts
-    for player, atts in pass_atts.items():
-        total_atts += atts
-    #this is going to calculate how much the players own career performance in
-    #theory affected the team in the past (team_memory) games. I.e. the 
-    #starting QB threw 80% of the passes so their influence over the team would
-    #have been .8 times their own stats
-    for player, cmp in pass_cmp.items():
-        if total_atts == 0:
-            break
-        pass_completion += cmp*(pass_atts[player]/total_atts)
-        int_per_att += pass_ints[player]*(pass_atts[player]/total_atts)
-        td_per_att += pass_tds[player]*(pass_atts[player]/total_atts)
-    return {'Passing Completion':pass_completion,
-            'Interceptions Per Passing Attempt':int_per_att,
-            'Touchdowns Per Passing Attempts':td_per_att}, total_atts, sacks
-
-"""
-This is probably the worst way to document the rest of these functions 
-but the pattern follows exactly like the passing pattern does above.
-The try, excepts are all for the same cases. And the attempt player weights
-is the same process for how the final values are calculated.
-
-I hate to say refer to the passing_features to undertand how this works,
-but refer to passing_features to see what the hell all of these nested
-try/excepts, and if/elses are catching.
-
-TODO: Refactor into elifs/functions
-"""
-def rushing_features(rushing_sheet,player_memory,team,date,player_dir,playoffs):
-    rushing_sheet = rushing_sheet.fillna(0)
-    players = rushing_sheet['Player'].unique()
-    team_dates = rushing_sheet['Date'].unique()
-    yds_per_att = 0
-    tds_per_att = 0
-    total_atts = 0
-    rush_atts = {}
-    rush_yds = {}
-    rush_tds = {}
-    for player in players:
-        player_rushing = rushing_sheet.loc[rushing_sheet['Player'] == player]
-        rush_atts[player] = player_rushing['Rush Att'].sum()
-        if playoffs:
-            reg, playoff = get_player_history(player,team,date,playoffs,player_memory,player_dir,team_dates)
-            if playoff is not None:
-                try:
-                    player_atts = reg['Rushing Att'].sum() + playoff['Rushing Att'].sum()
-                    if player_atts == 0:
-                        rush_yds[player] = 0
-                        rush_tds[player] = 0
-                    else:
-                        rush_yds[player] = (reg['Rushing Yds'].sum() + playoff['Rushing Yds'].sum())/(player_atts)
-                        rush_tds[player] = (reg['Rushing TD'].sum() + playoff['Rushing TD'].sum())/(player_atts)
-                except KeyError:
-                    try:
-                        player_atts = reg['Rushing Att'].sum()
-                        if player_atts == 0:
-                            rush_yds[player] = 0
-                            rush_tds[player] = 0
-                        else:
-                            rush_yds[player] = reg['Rushing Att'].sum()/player_atts
-                            rush_tds[player] = reg['Rushing TD'].sum()/player_atts   
-                    except KeyError:
-                        try:
-                            player_atts = playoff['Rushing Att'].sum()
-                            if player_atts == 0:
-                                rush_yds[player] = 0
-                                rush_tds[player] = 0
-                            else:
-                                rush_yds[player] = playoff['Rushing Att'].sum()/player_atts
-                                rush_tds[player] = playoff['Rushing TD'].sum()/player_atts 
-                        except KeyError:
-                            rush_yds[player] = 0
-                            rush_tds[player] = 0
-            else:
-                player_atts = reg['Rushing Att'].sum()
-                if player_atts == 0:
-                    rush_yds[player] = 0
-                    rush_tds[player] = 0
-                else:
-                    rush_yds[player] = reg['Rushing Att'].sum()/player_atts
-                    rush_tds[player] = reg['Rushing TD'].sum()/player_atts
-        else:
-            reg = get_player_history(player,team,date,playoffs,player_memory,player_dir,team_dates)
-            player_atts = reg['Rushing Att'].sum()
-            if player_atts == 0:
-                rush_yds[player] = 0
-                rush_tds[player] = 0
-            else:
-                rush_yds[player] = reg['Rushing Att'].sum()/player_atts
-                rush_tds[player] = reg['Rushing TD'].sum()/player_atts
-    for player, atts in rush_atts.items():
-        total_atts += atts
-    for player, yds in rush_yds.items():
-        if total_atts == 0:
-            break
-        yds_per_att += yds*(rush_atts[player]/total_atts)
-        tds_per_att += rush_tds[player]*(rush_atts[player]/total_atts)
-    return {'Yards Per Rushing Attempt':yds_per_att, 
-            'Touchdowns Per Rushing Attempt':tds_per_att}, total_atts
-"""
-I hate to say refer to the passing_features to undertand how this works,
-but refer to passing_features to see what the hell all of these nested
-try/excepts, and if/elses are catching.
-
-TODO: Refactor into elifs/functions
-"""
-def receiving_features(receiving_sheet,player_memory,team,date,player_dir,playoffs):
-    receiving_sheet = receiving_sheet.fillna(0)
-    players = receiving_sheet['Player'].unique()
-    team_dates = receiving_sheet['Date'].unique()
-    catch_percent = 0
-    yds_per_catch = 0
-    tds_per_catch = 0
-    total_tgts = 0
-    rec_tgts = {}
-    rec_catch = {}
-    rec_yds = {}
-    rec_tds = {}
-    for player in players:
-        player_rec = receiving_sheet.loc[receiving_sheet['Player'] == player]
-        rec_tgts[player] = player_rec['Receive Tgt'].sum()
-        if playoffs:
-            reg, playoff = get_player_history(player,team,date,playoffs,player_memory,player_dir,team_dates)
-            if playoff is not None:
-                try:
-                    player_catches = reg['Receiving Rec'].sum() + playoff['Receiving Rec'].sum()
-                    if player_catches == 0:
-                        rec_catch[player] = 0
-                        rec_yds[player] = 0
-                        rec_tds[player] = 0
-                    else:
-                        rec_catch[player] = player_catches/(reg['Receiving Tgt'].sum() + playoff['Receiving Tgt'].sum())
-                        rec_yds[player] = (reg['Receiving Yds'].sum() + playoff['Receiving Yds'].sum())/player_catches
-                        rec_tds[player] = (reg['Receiving TD'].sum() + playoff['Receiving TD'].sum())/player_catches
-                except KeyError:
-                     try:
-                         player_catches = reg['Receiving Rec'].sum()
-                         if player_catches == 0:
-                            rec_catch[player] = 0
-                            rec_yds[player] = 0
-                            rec_tds[player] = 0
-                         else:
-                            rec_catch[player] = player_catches/reg['Receiving Tgt'].sum()
-                            rec_yds[player] = reg['Receiving Yds'].sum()/player_catches
-                            rec_tds[player] = reg['Receiving TD'].sum()/player_catches
-                     except KeyError:
-                         try:
-                             player_catches = playoff['Receiving Rec'].sum()
-                             if player_catches == 0:
-                                rec_catch[player] = 0
-                                rec_yds[player] = 0
-                                rec_tds[player] = 0
-                             else:
-                                rec_catch[player] = player_catches/playoff['Receiving Tgt'].sum()
-                                rec_yds[player] = playoff['Receiving Yds'].sum()/player_catches
-                                rec_tds[player] = playoff['Receiving TD'].sum()/player_catches
-                         except KeyError:
-                            rec_catch[player] = 0
-                            rec_yds[player] = 0
-                            rec_tds[player] = 0
-            else:
-                try:
-                    player_catches = reg['Receiving Rec'].sum()
-                    if player_catches == 0:
-                        rec_catch[player] = 0
-                        rec_yds[player] = 0
-                        rec_tds[player] = 0
-                    else:
-                        rec_catch[player] = player_catches/reg['Receiving Tgt'].sum()
-                        rec_yds[player] = reg['Receiving Yds'].sum()/player_catches
-                        rec_tds[player] = reg['Receiving TD'].sum()/player_catches
-                except KeyError:
-                    rec_catch[player] = 0
-                    rec_yds[player] = 0
-                    rec_tds[player] = 0
-        else:
-            reg = get_player_history(player,team,date,playoffs,player_memory,player_dir,team_dates)
-            player_catches = reg['Receiving Rec'].sum()
-            if player_catches == 0:
-                    rec_catch[player] = 0
-                    rec_yds[player] = 0
-                    rec_tds[player] = 0
-            else:
-                rec_catch[player] = player_catches/reg['Receiving Tgt'].sum()
-                rec_yds[player] = reg['Receiving Yds'].sum()/player_catches
-                rec_tds[player] = reg['Receiving TD'].sum()/player_catches
-    for player, tgts in rec_tgts.items():
-        total_tgts += tgts
-    for player, catches in rec_catch.items():
-        if total_tgts == 0:
-            break
-        catch_percent += catches*(rec_tgts[player]/total_tgts)
-        yds_per_catch += rec_yds[player]*(rec_tgts[player]/total_tgts)
-        tds_per_catch += rec_tds[player]*(rec_tgts[player]/total_tgts)
-    return {'Catch Percent':catch_percent, 
-            'Yards Per Catch':yds_per_catch, 
-            'Touchdowns Per Catch':tds_per_catch}
-"""
-I hate to say refer to the passing_features to undertand how this works,
-but refer to passing_features to see what the hell all of these nested
-try/excepts, and if/elses are catching.
-
-This one is a little different though in the sense we're doing these try/except
-and if/else catches for two independent stats instead of just one.
-
-TODO: Refactor into elifs/functions
-"""
-def kicking_features(kicking_sheet,player_memory,team,date,player_dir,playoffs):
-    kicking_sheet = kicking_sheet.fillna(0)
-    players = kicking_sheet['Player'].unique()
-    team_dates = kicking_sheet['Date'].unique()
-    fgm = 0
-    xpm = 0
-    total_fga = 0
-    total_xpa = 0
-    team_fga = {}
-    team_xpa = {}
-    kick_fgm = {}
-    kick_xpm = {}
+Every one of the player weighted features follows the same pattern. For each
+player on the team sheet, we get their career rates over the player memory, 
+i.e. touchdowns per rushing attempt, and then weight each player's rates by how
+much of the team's volume they had over the team memory, i.e. how many of the
+team's rushing attempts they took. So if the starting QB threw 80% of the 
+passes their influence over the team would be .8 times their own stats.
+
+So instead of a function for each of these, each family is just a spec of the
+team sheet it comes from, the volume column on that sheet the players are 
+weighted by, and the rates that come from the player's career sheets.
+
+family: {sheet, volume, rates: [(feature, career numerator, career denominator)]}
+"""
+STAT_FAMILIES = {'Passing': {'sheet': 'Passing', 'volume': 'Pass Att',
+                             'rates': [('Passing Completion', 'Passing Cmp', 'Passing Att'),
+                                       ('Interceptions Per Passing Attempt', 'Passing Int', 'Passing Att'),
+                                       ('Touchdowns Per Passing Attempts', 'Passing TD', 'Passing Att')]},
+                 'Rushing': {'sheet': 'Rushing', 'volume': 'Rush Att',
+                             'rates': [('Yards Per Rushing Attempt', 'Rushing Yds', 'Rushing Att'),
+                                       ('Touchdowns Per Rushing Attempt', 'Rushing TD', 'Rushing Att')]},
+                 'Receiving': {'sheet': 'Rec', 'volume': 'Receive Tgt',
+                               'rates': [('Catch Percent', 'Receiving Rec', 'Receiving Tgt'),
+                                         ('Yards Per Catch', 'Receiving Yds', 'Receiving Rec'),
+                                         ('Touchdowns Per Catch', 'Receiving TD', 'Receiving Rec')]},
+                 'Field Goals': {'sheet': 'Kicking', 'volume': 'Scoring FGA',
+                                 'rates': [('FGM Percentage', 'Scoring FGM', 'Scoring FGA')]},
+                 'Extra Points': {'sheet': 'Kicking', 'volume': 'Scoring XPA',
+                                  'rates': [('XPM Percentage', 'Scoring XPM', 'Scoring XPA')]},
+                 'Kick Returns': {'sheet': 'Kick Return', 'volume': 'KR Rt',
+                                  'rates': [('Yards Per Kick Return', 'Kick Returns Yds', 'Kick Returns Rt'),
+                                            ('Touchdowns Per Kick Return', 'Kick Returns TD', 'Kick Returns Rt')]},
+                 'Punt Returns': {'sheet': 'Punt Return', 'volume': 'PR Ret',
+                                  'rates': [('Yards Per Punt Return', 'Punt Returns Yds', 'Punt Returns Ret'),
+                                            ('Touchdowns Per Punt Return', 'Punt Returns TD', 'Punt Returns Ret')]}}
+
+"""
+This gets the career totals for every player on a team sheet at once. Whatever
+mix of regular season and playoff history a player has just gets stacked 
+together, and any stat a player has never recorded, i.e. a kicker without a
+rushing column, is a zero instead of a KeyError that we have to catch.
+"""
+def get_career_totals(players,columns,team,date,player_memory,player_dir,playoffs,team_dates):
+    careers = []
     for player in players:
-        player_kick = kicking_sheet.loc[kicking_sheet['Player'] == player]
-        team_fga[player] = player_kick['Scoring FGA'].sum()
-        team_xpa[player] = player_kick['Scoring XPA'].sum()
-        if playoffs:
-            reg, playoff = get_player_history(player,team,date,playoffs,player_memory,player_dir,team_dates)
-            if playoff is not None:
-                try:
-                    fgas = reg['Scoring FGA'].sum() + playoff['Scoring FGA'].sum()
-                    if fgas == 0:
-                        kick_fgm[player] = 0
-                    else:
-                        kick_fgm[player] = (reg['Scoring FGM'].sum() + playoff['Scoring FGM'].sum())/fgas
-                except KeyError:
-                    try:
-                        fgas = reg['Scoring FGA'].sum()
-                        if fgas == 0:
-                            kick_fgm[player] = 0
-                        else:
-                            kick_fgm[player] = reg['Scoring FGM'].sum()/fgas
-                    except KeyError:
-                        try:
-                            fgas = playoff['Scoring FGA'].sum()
-                            if fgas == 0:
-                                kick_fgm[player] = 0
-                            else:
-                                kick_fgm[player] = playoff['Scoring FGM'].sum()/fgas
-                        except KeyError:
-                            kick_fgm[player] = 0
-                try:
-                    xpas = reg['Scoring XPA'].sum() + playoff['Scoring XPA'].sum()
-                    if xpas == 0:
-                        kick_xpm[player] = 0
-                    else:
-                        kick_xpm[player] = (reg['Scoring XPM'].sum() + playoff['Scoring XPM'].sum())/xpas
-                except KeyError:
-                    try:
-                        xpas = reg['Scoring XPA'].sum()
-                        if xpas == 0:
-                            kick_xpm[player] = 0
-                        else:
-                            kick_xpm[player] = reg['Scoring XPM'].sum()/xpas
-                    except KeyError:
-                        try:
-                            xpas = playoff['Scoring XPA'].sum()
-                            if xpas == 0:
-                                kick_xpm[player] = 0
-                            else:
-                                kick_xpm[player] = playoff['Scoring XPM'].sum()/xpas
-                        except KeyError:
-                            kick_xpm[player] = 0
-            else:
-                fgas = reg['Scoring FGA'].sum()
-                xpas = reg['Scoring XPA'].sum()
-                if fgas == 0:
-                    kick_fgm[player] = 0
-                else:
-                    kick_fgm[player] = reg['Scoring FGM'].sum()/fgas
-                if xpas == 0:
-                    kick_xpm[player] = 0
-                else:
-                    kick_xpm[player] = reg['Scoring XPM'].sum()/xpas
-        else:
-            reg = get_player_history(player,team,date,playoffs,player_memory,player_dir,team_dates)
-            fgas = reg['Scoring FGA'].sum()
-            xpas = reg['Scoring XPA'].sum()
-            if fgas == 0:
-                kick_fgm[player] = 0
-            else:
-                kick_fgm[player] = reg['Scoring FGM'].sum()/fgas
-            if xpas == 0:
-                kick_xpm[player] = 0
-            else:
-                kick_xpm[player] = reg['Scoring XPM'].sum()/xpas
-    for player, fga in team_fga.items():
-        total_fga += fga
-        total_xpa += team_xpa[player]
-    for player, kickfgm in kick_fgm.items():
-        if total_fga != 0:
-            try:
-                fgm += kickfgm*(team_fga[player]/total_fga)
-            except KeyError:
-                pass
-        if total_xpa != 0:
-            try:
-                xpm += kick_xpm[player]*(team_xpa[player]/total_xpa)
-            except KeyError:
-                pass
-    return {'FGM Percentage':fgm, 
-            'XPM Percentage':xpm}, total_fga
-"""
-I hate to say refer to the passing_features to undertand how this works,
-but refer to passing_features to see what the hell all of these nested
-try/excepts, and if/elses are catching.
-
-TODO: Refactor into elifs/functions
-"""
-def kr_features(kr_sheet,player_memory,team,date,player_dir,playoffs):
-    kr_sheet = kr_sheet.fillna(0)
-    players = kr_sheet['Player'].unique()
-    team_dates = kr_sheet['Date'].unique()
-    total_atts = 0
-    yds_per_kr = 0
-    tds_per_kr = 0
-    kr_atts = {}
-    kr_yds = {}
-    kr_tds = {}
-    for player in players:
-        player_kr = kr_sheet.loc[kr_sheet['Player'] == player]
-        kr_atts[player] = player_kr['KR Rt'].sum()
-        if playoffs:
-            reg, playoff = get_player_history(player,team,date,playoffs,player_memory,player_dir,team_dates)
-            if playoff is not None:
-                try:
-                    player_atts = reg['Kick Returns Rt'].sum() + playoff['Kick Returns Rt'].sum()
-                    if player_atts == 0:
-                        kr_yds[player] = 0
-                        kr_tds[player] = 0
-                    else:
-                        kr_yds[player] = (reg['Kick Returns Yds'].sum() + playoff['Kick Returns Yds'].sum())/player_atts
-                        kr_tds[player] = (reg['Kick Returns TD'].sum() + playoff['Kick Returns TD'].sum())/player_atts
-                except KeyError:
-                    try:
-                        player_atts = reg['Kick Returns Rt'].sum()
-                        if player_atts == 0:
-                            kr_yds[player] = 0
-                            kr_tds[player] = 0
-                        else:
-                            kr_yds[player] = reg['Kick Returns Yds'].sum()/player_atts
-                            kr_tds[player] = reg['Kick Returns TD'].sum()/player_atts
-                    except KeyError:
-                        try:
-                            player_atts = playoff['Kick Returns Rt'].sum()
-                            if player_atts == 0:
-                                kr_yds[player] = 0
-                                kr_tds[player] = 0
-                            else:
-                                kr_yds[player] = playoff['Kick Returns Yds'].sum()/player_atts
-                                kr_tds[player] = playoff['Kick Returns TD'].sum()/player_atts
-                        except KeyError:
-                            kr_yds[player] = 0
-                            kr_tds[player] = 0
-            else:
-                player_atts = reg['Kick Returns Rt'].sum()
-                if player_atts == 0:
-                    kr_yds[player] = 0
-                    kr_tds[player] = 0
-                else:
-                    kr_yds[player] = reg['Kick Returns Yds'].sum()/player_atts
-                    kr_tds[player] = reg['Kick Returns TD'].sum()/player_atts
-        else:
-            reg = get_player_history(player,team,date,playoffs,player_memory,player_dir,team_dates)
-            player_atts = reg['Kick Returns Rt'].sum()
-            if player_atts == 0:
-                kr_yds[player] = 0
-                kr_tds[player] = 0
-            else:
-                kr_yds[player] = reg['Kick Returns Yds'].sum()/player_atts
-                kr_tds[player] = reg['Kick Returns TD'].sum()/player_atts
-    for player, att in kr_atts.items():
-        total_atts += att
-    for player, yds in kr_yds.items():
-        if total_atts == 0:
-            break
-        yds_per_kr += yds*(kr_atts[player]/total_atts)
-    return {'Yards Per Kick Return':yds_per_kr, 
-            'Touchdowns Per Kick Return':tds_per_kr}, total_atts
-"""
-I hate to say refer to the passing_features to undertand how this works,
-but refer to passing_features to see what the hell all of these nested
-try/excepts, and if/elses are catching.
-
-TODO: Refactor into elifs/functions
-"""
-def pr_features(pr_sheet,player_memory,team,date,player_dir,playoffs):
-    pr_sheet = pr_sheet.fillna(0)
-    players = pr_sheet['Player'].unique()
-    team_dates = pr_sheet['Date'].unique()
-    total_atts = 0
-    yds_per_pr = 0
-    tds_per_pr = 0
-    pr_atts = {}
-    pr_yds = {}
-    pr_tds = {}
-    for player in players:
-        player_pr = pr_sheet.loc[pr_sheet['Player'] == player]
-        pr_atts[player] = player_pr['PR Ret'].sum()
-        if playoffs:
-            reg, playoff = get_player_history(player,team,date,playoffs,player_memory,player_dir,team_dates)
-            if playoff is not None:
-                try:
-                    player_atts = reg['Punt Returns Ret'].sum()  + playoff['Punt Returns Ret'].sum()
-                    if player_atts == 0:
-                        pr_yds[player] = 0
-                        pr_tds[player] = 0
-                    else:
-                        pr_yds[player] =(reg['Punt Returns Yds'].sum()  + playoff['Punt Returns Yds'].sum())/player_atts
-                        pr_tds[player] = (reg['Punt Returns TD'].sum()  + playoff['Punt Returns TD'].sum())/player_atts
-                except KeyError:
-                    try:
-                        player_atts = reg['Punt Returns Ret'].sum()
-                        if player_atts == 0:
-                            pr_yds[player] = 0
-                            pr_tds[player] = 0
-                        else:
-                            pr_yds[player] = reg['Punt Returns Yds'].sum()/player_atts
-                            pr_tds[player] = reg['Punt Returns TD'].sum()/player_atts
-                    except KeyError:
-                        try:
-                            player_atts = playoff['Punt Returns Ret'].sum()
-                            if player_atts == 0:
-                                pr_yds[player] = 0
-                                pr_tds[player] = 0
-                            else:
-                                pr_yds[player] = playoff['Punt Returns Yds'].sum()/player_atts
-                                pr_tds[player] = playoff['Punt Returns TD'].sum()/player_atts
-                        except KeyError:
-                            pr_yds[player] = 0
-                            pr_tds[player] = 0
-            else:
-                player_atts = reg['Punt Returns Ret'].sum()
-                if player_atts == 0:
-                    pr_yds[player] = 0
-                    pr_tds[player] = 0
-                else:
-                    pr_yds[player] = reg['Punt Returns Yds'].sum()/player_atts
-                    pr_tds[player] = reg['Punt Returns TD'].sum()/player_atts
-        else:
-            reg = get_player_history(player,team,date,playoffs,player_memory,player_dir,team_dates)
-            player_atts = reg['Punt Returns Ret'].sum()
-            if player_atts == 0:
-                    pr_yds[player] = 0
-                    pr_tds[player] = 0
-            else:
-                pr_yds[player] = reg['Punt Returns Yds'].sum()/player_atts
-                pr_tds[player] = reg['Punt Returns TD'].sum()/player_atts
-    for player, att in pr_atts.items():
-        total_atts += att
-    for player, yds in pr_yds.items():
-        if total_atts == 0:
-            break
-        yds_per_pr += yds*(pr_atts[player]/total_atts)
-        tds_per_pr += pr_tds[player]*(pr_atts[player]/total_atts)
-    return {'Yards Per Punt Return':yds_per_pr, 
-            'Touchdowns Per Punt Return':tds_per_pr}, total_atts
+        history = get_player_history(player,team,date,playoffs,player_memory,player_dir,team_dates)
+        if not playoffs:
+            history = [history]
+        for career in history:
+            if career is not None and not career.empty:
+                careers.append(career.reindex(columns=columns).assign(Player=player))
+    if not careers:
+        return pd.DataFrame(0,index=players,columns=columns)
+    careers = pd.concat(careers,ignore_index=True)
+    totals = careers.groupby('Player')[columns].sum()
+    return totals.reindex(players,fill_value=0).fillna(0)
+
+"""
+Here we're computing a single family for every player at once. The rates are
+each player's career numerators over their career denominators, zero if 
+they've never had any, and the team's rates are those weighted by each 
+player's share of the team's volume.
+"""
+def family_features(family,team_volume,career_totals):
+    features = {}
+    total_volume = team_volume.sum()
+    if total_volume == 0:
+        weights = np.zeros(len(team_volume))
+    else:
+        weights = team_volume.values/total_volume
+    for feature, numerator, denominator in family['rates']:
+        num = career_totals[numerator].values.astype(float)
+        den = career_totals[denominator].values.astype(float)
+        rates = np.divide(num,den,out=np.zeros_like(num),where=den != 0)
+        features[feature] = float(np.dot(weights,rates))
+    return features, total_volume
+
+"""
+This runs every family for a team over its team memory. The career totals are
+gathered once per team sheet, since the kicking families share the same players.
+It returns the player weighted features, and the team's total volume for each
+family, since the team features need those.
+"""
+def player_features(sheets,player_memory,team,date,player_dir,playoffs,families=STAT_FAMILIES):
+    features = {}
+    volumes = {}
+    for sn in dict.fromkeys([family['sheet'] for family in families.values()]):
+        sheet = sheets[sn]
+        sheet_families = {name:family for name, family in families.items() if family['sheet'] == sn}
+        players = list(sheet['Player'].dropna().unique())
+        team_dates = sheet['Date'].unique()
+        columns = []
+        for family in sheet_families.values():
+            for _, numerator, denominator in family['rates']:
+                columns.extend([col for col in (numerator,denominator) if col not in columns])
+        career_totals = get_career_totals(players,columns,team,date,player_memory,player_dir,playoffs,team_dates)
+        for name, family in sheet_families.items():
+            team_volume = sheet.groupby('Player',observed=True)[family['volume']].sum().reindex(players,fill_value=0)
+            features[name], volumes[name] = family_features(family,team_volume,career_totals)
+    return [features[name] for name in families], volumes
 
 """
 Just getting the total number of punts
@@ -842,25 +372,33 @@ def punt_totals(punt_sheet):
     return punt_sheet['Scoring Pnt'].sum()
 
 """
-Here we're getting the offensive stats that would be team influenced.
-We're gonna do a zero check before normalizing, so we don't get divide by zero
-errors for things that never happened in the time frame
-"""
-def offense_features(game_stats,pass_atts,rush_atts,kr_atts,pr_atts,fga,punts,sacks,team_memory):
-    fumbles_per_plays = game_stats['Fumbles'].sum()/(pass_atts+rush_atts+kr_atts+pr_atts+fga+punts)
-    if game_stats['Fumbles'].sum() == 0:
-        fumbles_lost_per_fumble=0
-    else:
-        fumbles_lost_per_fumble = game_stats['Fumbles Lost'].sum()/game_stats['Fumbles'].sum()
-    third_down_cnv = game_stats['Third Down Cvt'].sum()/game_stats['Third Down Att'].sum()
-    if game_stats['Fourth Down Att'].sum() == 0:
-        fourth_down_cnv = 0
-    else:
-        fourth_down_cnv = game_stats['Fourth Down Cvt'].sum()/game_stats['Fourth Down Att'].sum()
-    go_for_it_perc = game_stats['Fourth Down Att'].sum()/(game_stats['Fourth Down Att'].sum() + fga + punts)
-    punt_perc = punts/(game_stats['Fourth Down Att'].sum() + fga + punts)
-    fg_perc = fga/(game_stats['Fourth Down Att'].sum() + fga + punts)
-    first_downs_perc = game_stats['First Downs'].sum()/(pass_atts+rush_atts+fga+punts)
+Dividing with a zero check, so we don't get divide by zero errors for things
+that never happened in the time frame. This works the same whether we're 
+dividing single totals for one game, or whole columns of totals for every game
+at once in batch mode. A missing total gets treated the same as a zero one.
+"""
+def safe_divide(num,den):
+    if np.ndim(den) == 0:
+        if pd.isna(num) or pd.isna(den) or den == 0:
+            return 0
+        return num/den
+    return (num/den.where(den.notna() & (den != 0))).fillna(0)
+
+"""
+Here we're getting the offensive stats that would be team influenced, from the
+team's game stat totals over the team memory. Game stats we couldn't parse are
+left out of the totals, so if none of the games have the downs the conversion
+rates come out as 0.
+"""
+def offense_features(game_totals,pass_atts,rush_atts,kr_atts,pr_atts,fga,punts,sacks,team_memory):
+    fumbles_per_plays = game_totals['Fumbles']/(pass_atts+rush_atts+kr_atts+pr_atts+fga+punts)
+    fumbles_lost_per_fumble = safe_divide(game_totals['Fumbles Lost'],game_totals['Fumbles'])
+    third_down_cnv = safe_divide(game_totals['Third Down Cvt'],game_totals['Third Down Att'])
+    fourth_down_cnv = safe_divide(game_totals['Fourth Down Cvt'],game_totals['Fourth Down Att'])
+    go_for_it_perc = game_totals['Fourth Down Att']/(game_totals['Fourth Down Att'] + fga + punts)
+    punt_perc = punts/(game_totals['Fourth Down Att'] + fga + punts)
+    fg_perc = fga/(game_totals['Fourth Down Att'] + fga + punts)
+    first_downs_perc = game_totals['First Downs']/(pass_atts+rush_atts+fga+punts)
     sacks_per_pass = sacks/pass_atts
     pass_atts = pass_atts/team_memory
     rush_atts = rush_atts/team_memory
@@ -881,54 +419,38 @@ def offense_features(game_stats,pass_atts,rush_atts,kr_atts,pr_atts,fga,punts,sa
             'Sacks Per Passing Attempt':sacks_per_pass}
 
 """
-Here we're getting the defenseive features from the team sheets, defensive
-features are all going to be team influenced, since PFR does such a poor job
-of recording defensive stats, and they didn't start recording snap counts until
-I think it's 2014ish. So we can't really measure what influence these players
-really have per game.
-"""
-def defensive_features(defense):
-    opp_pass_atts = defense['Pass Attempts Defended'].sum()
-    opp_rush_atts = defense['Rush Attempts Defended'].sum()
-    opp_krs = defense['Kick Returns Defended'].sum()
-    opp_prs = defense['Punt Returns Defended'].sum()
-    opp_fga = defense['Field Goals Defended'].sum()
-    opp_punts = defense['Punts Defended'].sum()
+Here we're getting the defenseive features from the team's defense totals over
+the team memory. Defensive features are all going to be team influenced, since
+PFR does such a poor job of recording defensive stats, and they didn't start 
+recording snap counts until I think it's 2014ish. So we can't really measure
+what influence these players really have per game.
+"""
+def defensive_features(defense_totals):
+    opp_pass_atts = defense_totals['Pass Attempts Defended']
+    opp_rush_atts = defense_totals['Rush Attempts Defended']
+    opp_krs = defense_totals['Kick Returns Defended']
+    opp_prs = defense_totals['Punt Returns Defended']
+    opp_fga = defense_totals['Field Goals Defended']
+    opp_punts = defense_totals['Punts Defended']
     
-    pass_yds_per_att = defense['Pass Yards Allowed'].sum()/opp_pass_atts
-    pass_tds_per_att = defense['Pass TDs Allowed'].sum()/opp_pass_atts
-    ints_per_pass_att = defense['DefInt Int'].sum()/opp_pass_atts
-    sacks_per_pass_att = defense['Sck&Ttl Sk'].sum()/opp_pass_atts
-    if defense['DefInt Int'].sum() == 0:
-        tds_per_int = 0
-    else:
-        tds_per_int = defense['DefInt TD'].sum()/defense['DefInt Int'].sum()
-    rush_yds_per_att = defense['Rush Yards Allowed'].sum()/opp_rush_atts
-    rush_tds_per_att = defense['Rush TDs Allowed'].sum()/opp_rush_atts
-    fumbles_per_att = defense['Fumble FF'].sum()/float(opp_pass_atts + opp_rush_atts + opp_krs + opp_prs)
-    if defense['Fumble FF'].sum() == 0:
-        fumbles_recovered = 0
-    else:
-        fumbles_recovered = defense['Fumble FR'].sum()/defense['Fumble FF'].sum()
-    if defense['Fumble FR'].sum() == 0:
-        tds_per_fr = 0
-    else:
-        tds_per_fr = defense['Fumble TD'].sum()/defense['Fumble FR'].sum()
-    third_down_stopped = defense['Third Downs Stopped'].sum()/defense['Third Downs Defended'].sum()
-    if defense['Fourth Downs Defended'].sum() == 0:
-        fourth_down_stopped = 0
-    else:
-        fourth_down_stopped = defense['Fourth Downs Stopped'].sum()/defense['Fourth Downs Defended'].sum()
-    fga_per_fourth = opp_fga/(opp_fga + defense['Fourth Downs Defended'].sum() + opp_punts)
-    punts_per_fourth = opp_punts/(opp_fga + defense['Fourth Downs Defended'].sum() + opp_punts)
-    yds_per_kr = defense['Kick Return Yards Allowed'].sum()/opp_krs
-    tds_per_kr = defense['Kick Return TDs Allowed'].sum()/opp_krs
-    if opp_prs == 0:
-        yds_per_pr = 0
-        tds_per_pr = 0
-    else:
-        yds_per_pr = defense['Punt Return Yards Allowed'].sum()/opp_prs
-        tds_per_pr = defense['Punt Return TDs Allowed'].sum()/opp_prs
+    pass_yds_per_att = defense_totals['Pass Yards Allowed']/opp_pass_atts
+    pass_tds_per_att = defense_totals['Pass TDs Allowed']/opp_pass_atts
+    ints_per_pass_att = defense_totals['DefInt Int']/opp_pass_atts
+    sacks_per_pass_att = defense_totals['Sck&Ttl Sk']/opp_pass_atts
+    tds_per_int = safe_divide(defense_totals['DefInt TD'],defense_totals['DefInt Int'])
+    rush_yds_per_att = defense_totals['Rush Yards Allowed']/opp_rush_atts
+    rush_tds_per_att = defense_totals['Rush TDs Allowed']/opp_rush_atts
+    fumbles_per_att = defense_totals['Fumble FF']/(opp_pass_atts + opp_rush_atts + opp_krs + opp_prs)
+    fumbles_recovered = safe_divide(defense_totals['Fumble FR'],defense_totals['Fumble FF'])
+    tds_per_fr = safe_divide(defense_totals['Fumble TD'],defense_totals['Fumble FR'])
+    third_down_stopped = safe_divide(defense_totals['Third Downs Stopped'],defense_totals['Third Downs Defended'])
+    fourth_down_stopped = safe_divide(defense_totals['Fourth Downs Stopped'],defense_totals['Fourth Downs Defended'])
+    fga_per_fourth = opp_fga/(opp_fga + defense_totals['Fourth Downs Defended'] + opp_punts)
+    punts_per_fourth = opp_punts/(opp_fga + defense_totals['Fourth Downs Defended'] + opp_punts)
+    yds_per_kr = defense_totals['Kick Return Yards Allowed']/opp_krs
+    tds_per_kr = defense_totals['Kick Return TDs Allowed']/opp_krs
+    yds_per_pr = safe_divide(defense_totals['Punt Return Yards Allowed'],opp_prs)
+    tds_per_pr = safe_divide(defense_totals['Punt Return TDs Allowed'],opp_prs)
     return [{'Pass Yards Allowed Per Opp Pass Att':pass_yds_per_att, 
             'Pass TDS Allowed Per Opp Pass Att':pass_tds_per_att,
             'Interceptions Per Opp Pass Att':ints_per_pass_att, 
@@ -948,27 +470,33 @@ def defensive_features(defense):
             'PR Yards Allowed Per Opp PR Att':yds_per_pr, 
             'Touchdowns Allowed Per Opp PR':tds_per_pr}]
 
+"""
+This is the fixed column order of the training data, the home team's features
+followed by the away team's, in the same order get_xy builds them. The team 
+feature names come straight from the feature functions, by running them on 
+totals that are all ones, so these can't get out of sync with them.
+"""
+def get_feature_names(families=STAT_FAMILIES):
+    ones = defaultdict(lambda: 1.0)
+    names = [feature for family in families.values() for feature, _, _ in family['rates']]
+    names.extend(offense_features(ones,1.0,1.0,1.0,1.0,1.0,1.0,1.0,1))
+    names.extend(defensive_features(ones)[0])
+    return ['Home ' + name for name in names] + ['Away ' + name for name in names]
+
+FEATURE_NAMES = get_feature_names()
+
 """
 Here we're wrapping all of the offesive features into a nice clean funciton.
 """
 def get_offensive_features(sheets,player_memory,date,team,player_dir,playoffs,team_memory):
-    dict_list = []
-    #print ('.... Passing')
-    passing,pass_atts,sacks = passing_features(sheets['Passing'],player_memory,team,date,player_dir,playoffs)
-    #print ('.... Rushing')
-    rushing, rush_atts = rushing_features(sheets['Rushing'],player_memory,team,date,player_dir,playoffs) 
-    #print ('.... Rec')
-    receiving = receiving_features(sheets['Rec'],player_memory,team,date,player_dir,playoffs)
-    #print ('.... Kicking')
-    kicking, fga = kicking_features(sheets['Kicking'],player_memory,team,date,player_dir,playoffs)
-    #print ('.... Kr')
-    kr, kr_atts = kr_features(sheets['Kick Return'],player_memory,team,date,player_dir,playoffs)
-    #print ('.... Pr')
-    pr, pr_atts = pr_features(sheets['Punt Return'],player_memory,team,date,player_dir,playoffs)
+    dict_list, volumes = player_features(sheets,player_memory,team,date,player_dir,playoffs)
+    sacks = sheets['Passing']['Pass Sk'].sum()
     punts = punt_totals(sheets['Punting'])
-    #print ('Supplemental')
-    other_offense = offense_features(sheets['Game Stats'],pass_atts,rush_atts,kr_atts,pr_atts,fga,punts,sacks,team_memory)
-    dict_list.extend([passing,rushing,receiving,kicking,kr,pr,other_offense])
+    game_totals = sheets['Game Stats'].sum(numeric_only=True,skipna=True)
+    other_offense = offense_features(game_totals,volumes['Passing'],volumes['Rushing'],
+                                     volumes['Kick Returns'],volumes['Punt Returns'],
+                                     volumes['Field Goals'],punts,sacks,team_memory)
+    dict_list.append(other_offense)
     return dict_list
 """
 Here we're getting our predictor variable from the game sheet.
@@ -1002,8 +530,8 @@ def get_xy(game,player_memory,team_memory,playoffs,team_dir,player_dir):
     home_history = get_team_history(home,date,playoffs,team_memory,team_dir)    
     home_features = get_offensive_features(home_history,player_memory,date,home,player_dir,playoffs,team_memory)
     away_features = get_offensive_features(away_history,player_memory,date,away,player_dir,playoffs,team_memory)
-    home_features.extend(defensive_features(home_history['Defense']))
-    away_features.extend(defensive_features(away_history['Defense']))
+    home_features.extend(defensive_features(home_history['Defense'].sum(numeric_only=True,skipna=True)))
+    away_features.extend(defensive_features(away_history['Defense'].sum(numeric_only=True,skipna=True)))
     y = get_score_difference(game,away,home)
     home_features = [{'Home ' + key : val for key, val in feature.items()} for feature in home_features]
     away_features = [{'Away '+  key : val for key, val in feature.items()} for feature in away_features]
@@ -1015,77 +543,352 @@ def get_xy(game,player_memory,team_memory,playoffs,team_dir,player_dir):
     return x,y,z
 
 """
-This is wrapping the callback to append to each of the global handlers.
+These are the keys that tie each row of the training data back to the game it
+came from.
 """
-def xy_callback(xyz):
-    x,y,z = xyz
-    x_data.append(x)
-    y_data.append(y)
-    z_data.append(z)
-    
+def get_game_keys(game):
+    away, home, date = get_teams(game)
+    year, week = get_year_week(game)
+    return {'Game':game,'Date':date,'Home':home,'Away':away,'Year':int(year),'Week':int(week)}
+
+"""
+This gets every game we're making training data for, in order of year, week,
+then file name, so the training data always comes out in the same order and 
+can be diffed or updated. We skip the first weeks of the first year since the
+teams don't have a full team memory yet.
+"""
+def get_training_games(game_dir,team_memory,start_year):
+    games = []
+    for game in iglob(game_dir + '/**/*.xlsx', recursive = True):
+        year, week = get_year_week(game)
+        if int(year) == start_year and int(week) < team_memory + 2:
+            continue
+        games.append((int(year),int(week),game))
+    return [game for _, _, game in sorted(games)]
+
 """
-This is going to tell us any errors that happen in our worker processes. Since
-by default multiprocessing won't raise them. We'll also append them to a file
-so we don't have to watch the callback for thousands of players.
+This is going to tell us any errors that happen in our worker processes, and
+which game they happened on. We'll also append them to a file so we don't 
+have to watch the output for thousands of games.
 """
-def error_handler(e):
-    print('error')
-    print(dir(e), "\n")
-    print("-->{}<--".format(e.__cause__))
+def error_handler(e,game=None):
+    print('error',game)
+    print("-->{}<--".format(e))
     with open('error_log.txt', 'a') as log:
-        log.write("-->{}<--".format(e.__cause__))
+        log.write("%s -->%s<--\n"%(game,e))
+
 """
-This makes the calls to the multiprocessing calls to the worker processes.
+This is the worker for the ordered map. It's wrapping get_xy so one bad game
+gets logged and skipped, instead of taking the whole map down with it. Rather
+than sending back a dict of ~100 feature names for every game, the features go
+back as a float32 array in the FEATURE_NAMES order.
+"""
+def xy_worker(task):
+    game, player_memory, team_memory, playoffs, team_dir, player_dir = task
+    try:
+        x,y,z = get_xy(game,player_memory,team_memory,playoffs,team_dir,player_dir)
+    except Exception as e:
+        error_handler(e,game)
+        return None
+    x = np.array([x[name] for name in FEATURE_NAMES],dtype=np.float32)
+    return x, float(y), float(z)
+
+"""
+This makes the calls to the worker processes. We use an ordered imap, so the 
+rows come back in the same order as the games no matter which worker finishes
+first, and the games are handed out in chunks to cut down on the back and 
+forth between the processes. The rows get written straight into arrays that 
+are allocated up front, so the parent's memory doesn't grow with a list of 
+dicts. It returns the game keys, X in the FEATURE_NAMES order, Y, and Z.
 """
 def make_initial_training(player_memory=None,team_memory=10,playoffs=True,gofast=True,game_dir='Games',player_dir='Players',team_dir='Teams',start_year=2003):
     if not gofast:
         cores = int(cpu_count()*.75)
     else:
         cores = int(cpu_count()*0.9)
-    pool = Pool(cores)
     print ("Generating training data using %s cores:"%cores)
-    for game in iglob(game_dir + '/**/*.xlsx', recursive = True):
-        year, week = get_year_week(game)
-        skip_game = False
-        if int(year) == start_year:
-            if int(week) < team_memory + 2:
-                skip_game = True
-        if skip_game == True:
+    games = get_training_games(game_dir,team_memory,start_year)
+    tasks = [(game,player_memory,team_memory,playoffs,team_dir,player_dir) for game in games]
+    chunksize = max(1,len(tasks)//(cores*4))
+    X = np.empty((len(games),len(FEATURE_NAMES)),dtype=np.float32)
+    Y = np.empty(len(games),dtype=np.float32)
+    Z = np.empty(len(games),dtype=np.float32)
+    made = np.zeros(len(games),dtype=bool)
+    with Pool(cores) as pool:
+        for i, result in enumerate(pool.imap(xy_worker,tasks,chunksize=chunksize)):
+            if result is None:
+                continue
+            X[i], Y[i], Z[i] = result
+            made[i] = True
+    keys = [get_game_keys(game) for game, keep in zip(games,made) if keep]
+    return keys, X[made], Y[made], Z[made]
+
+"""
+Batch mode. Instead of building each game's features one at a time, where
+every game rereads the same team sheets and player careers that the games 
+around it just read, we read everything once into long tables and compute the
+features for every game at the same time.
+
+Every team sheet gets stacked into one table per sheet with the team added as
+a column, so the Passing table is every (team, date, player, stat) row for
+every team.
+"""
+def read_team_tables(team_dir):
+    tables = {}
+    for team_path in sorted(iglob(os.path.join(team_dir,'*.xlsx'))):
+        team = os.path.basename(team_path)[:-len('.xlsx')]
+        for sn, sheet in read_sheets(team_path,team_sheet=True).items():
+            sheet['Team'] = team
+            tables.setdefault(sn,[]).append(sheet)
+    tables = {sn:pd.concat(sheets,ignore_index=True) for sn, sheets in tables.items()}
+    for sheet in tables.values():
+        sheet['Date'] = pd.to_datetime(sheet['Date'])
+        if 'Player' in sheet.columns:
+            sheet['Player'] = sheet['Player'].astype(object)
+    return tables
+
+"""
+This numbers each team's games in order, so the team memory is just the 
+previous N game numbers instead of walking back through the weeks.
+"""
+def number_team_games(game_stats):
+    games = game_stats[['Team','Date']].drop_duplicates().sort_values(['Team','Date'])
+    games['Game Number'] = games.groupby('Team').cumcount()
+    return games.reset_index(drop=True)
+
+"""
+Here we're copying each row of a team table forward to each of the next 
+(team_memory) games that team plays, so grouping by the target game gives the
+totals over that game's team memory.
+"""
+def window_rows(sheet,games,team_memory):
+    sheet = sheet.merge(games,on=['Team','Date'])
+    windows = [sheet.assign(Target=sheet['Game Number'] + offset) for offset in range(1,team_memory + 1)]
+    return pd.concat(windows,ignore_index=True)
+
+"""
+Same as the glob in get_player_history, but for every player at once. The 
+player files are sorted, so every file that starts with a player's name is 
+right next to each other.
+"""
+def match_player_files(players,player_dir):
+    files = sorted(glob(os.path.join(player_dir,'*.xlsx')))
+    matches = {}
+    for player in players:
+        prefix = os.path.join(player_dir,player)
+        i = bisect_left(files,prefix)
+        while i < len(files) and files[i].startswith(prefix):
+            matches.setdefault(player,[]).append(files[i])
+            i += 1
+    return matches
+
+"""
+This reads the regular season, and playoff history if we're using it, from a
+single player file with just the columns we need.
+"""
+def read_career(player_file,columns,playoffs):
+    sheet_names = ['Regular Season Table']
+    if playoffs:
+        sheet_names.append('Playoffs Table')
+    careers = []
+    for sn in sheet_names:
+        #Not every player has a playoff sheet
+        try:
+            career = read_sheets(player_file,sn)
+        except ValueError:
             continue
-        #xy_callback(get_xy(game,player_memory,team_memory,playoffs,team_dir,player_dir))
-        pool.apply_async(get_xy,args=(game,player_memory,team_memory,playoffs,team_dir,player_dir),callback=xy_callback,error_callback=error_handler)
-    pool.close()
-    pool.join()
+        careers.append(career.reindex(columns=['Date','Tm'] + columns))
+    if not careers:
+        return pd.DataFrame(columns=['File','Date','Tm'] + columns)
+    career = pd.concat(careers,ignore_index=True)
+    career['Tm'] = career['Tm'].astype(object)
+    career['File'] = player_file
+    return career
+
+"""
+This figures out which player file goes with each player on each team. If 
+there's only one file for a name that's the player, otherwise it's the file 
+where the player played for that team on one of the dates they're on the
+team sheet, the same as get_player_history.
+"""
+def resolve_players(rows,careers,matches,team_dict):
+    links = pd.DataFrame([(player,player_file) for player, files in matches.items() for player_file in files],columns=['Player','File'])
+    counts = links.groupby('Player')['File'].transform('count')
+    rosters = rows[['Team','Player']].drop_duplicates()
+    single = rosters.merge(links.loc[counts == 1],on='Player')
+    abb_teams = {abb:team for team, abbs in team_dict.items() for abb in abbs}
+    played = careers[['File','Date']].assign(Team=careers['Tm'].map(abb_teams))
+    multiple = rows.merge(links.loc[counts > 1],on='Player').merge(played,on=['File','Date','Team'])
+    multiple = multiple.drop_duplicates(['Team','Player'])[['Team','Player','File']]
+    return pd.concat([single,multiple],ignore_index=True)
+
+"""
+Here we're getting each player's career totals over the player memory before
+a whole bunch of dates at once. The careers are sorted by player and date, so
+the totals over any run of games is the difference of two cumulative sums, and
+merge_asof finds the last game each player played before each date.
+
+queries: (File, Date)
+"""
+def career_window_totals(careers,queries,columns,player_memory):
+    careers = careers.dropna(subset=['Date']).sort_values(['File','Date'],kind='mergesort').reset_index(drop=True)
+    values = careers[columns].astype(float).fillna(0).values
+    cumulative = np.vstack([np.zeros((1,len(columns))),np.cumsum(values,axis=0)])
+    careers['Row'] = np.arange(len(careers))
+    careers['Start'] = careers.groupby('File')['Row'].transform('min')
+    queries = queries.drop_duplicates().sort_values('Date')
+    last = pd.merge_asof(queries,careers[['File','Date','Row','Start']].sort_values('Date',kind='mergesort'),on='Date',by='File',allow_exact_matches=False)
+    #A player with no games before the date has nothing to add up
+    end = last['Row'].fillna(-1).astype(int).values + 1
+    start = last['Start'].fillna(0).astype(int).values
+    if player_memory is not None:
+        start = np.maximum(start,end - player_memory)
+    totals = pd.DataFrame(cumulative[end] - cumulative[start],columns=columns,index=last.index)
+    return pd.concat([last[['File','Date']],totals],axis=1)
+
+"""
+This is the batch version of player_features. The team's volume for each 
+player comes from the windowed team tables, the rates come from each player's
+career totals before the target game, and the weighted sums are done with a 
+groupby over every team's target games at once.
+"""
+def batch_player_features(windows,career_totals,families=STAT_FAMILIES):
+    features = []
+    volumes = {}
+    keys = ['Team','Target','Target Date']
+    #The kicking sheets use the same column names as the careers
+    careers = career_totals.rename(columns={'Date':'Target Date'}).set_index(['File','Target Date']).add_prefix('Career ').reset_index()
+    for name, family in families.items():
+        sheet = windows[family['sheet']]
+        volume = family['volume']
+        players = sheet.groupby(keys + ['Player','File'],dropna=False)[volume].sum().reset_index()
+        players = players.merge(careers,on=['File','Target Date'],how='left')
+        team_volume = players.groupby(keys)[volume].transform('sum')
+        weights = safe_divide(players[volume],team_volume)
+        family_features = {}
+        for feature, numerator, denominator in family['rates']:
+            rates = safe_divide(players['Career ' + numerator].fillna(0),players['Career ' + denominator].fillna(0))
+            family_features[feature] = (weights*rates).groupby([players[key] for key in keys]).sum()
+        features.append(pd.DataFrame(family_features))
+        volumes[name] = players.groupby(keys)[volume].sum()
+    return features, volumes
+
+"""
+This builds the team features for every team going into every game, indexed by
+(team, date), in the same order get_xy puts them in.
+
+targets - the (Team, Target, Target Date) games to build features for, where 
+          Target is how many games the team played before the target date. By
+          default it's every game with a full team memory before it, but it
+          can be games that haven't been played yet too.
+"""
+def batch_team_features(tables,games,player_memory,team_memory,playoffs,player_dir,gofast,targets=None):
+    team_dict = get_team_dict()
+    if targets is None:
+        targets = games.loc[games['Game Number'] >= team_memory].rename(columns={'Game Number':'Target','Date':'Target Date'})
+    keys = ['Team','Target','Target Date']
+    windows = {}
+    for sn in dict.fromkeys([family['sheet'] for family in STAT_FAMILIES.values()] + ['Game Stats','Defense','Punting']):
+        windows[sn] = window_rows(tables[sn],games,team_memory).merge(targets,on=['Team','Target'])
+    columns = []
+    for family in STAT_FAMILIES.values():
+        for _, numerator, denominator in family['rates']:
+            columns.extend([col for col in (numerator,denominator) if col not in columns])
+    players = pd.concat([windows[family['sheet']][['Team','Player','Date']] for family in STAT_FAMILIES.values()]).dropna().drop_duplicates()
+    matches = match_player_files(players['Player'].unique(),player_dir)
+    player_files = sorted({player_file for files in matches.values() for player_file in files})
+    if not gofast:
+        cores = int(cpu_count()*.75)
+    else:
+        cores = int(cpu_count()*0.9)
+    with Pool(cores) as pool:
+        careers = pool.starmap(read_career,[(player_file,columns,playoffs) for player_file in player_files])
+    careers = pd.concat(careers,ignore_index=True) if careers else pd.DataFrame(columns=['File','Date','Tm'] + columns)
+    resolved = resolve_players(players,careers,matches,team_dict)
+    for sn in dict.fromkeys([family['sheet'] for family in STAT_FAMILIES.values()]):
+        windows[sn] = windows[sn].merge(resolved,on=['Team','Player'],how='left')
+    queries = pd.concat([windows[sn][['File','Target Date']] for sn in windows if 'File' in windows[sn].columns]).dropna()
+    career_totals = career_window_totals(careers,queries.rename(columns={'Target Date':'Date'}),columns,player_memory)
+    features, volumes = batch_player_features(windows,career_totals)
+    index = pd.MultiIndex.from_frame(targets[keys])
+    volumes = {name:volume.reindex(index,fill_value=0).astype(float) for name, volume in volumes.items()}
+    #The groupby sums skip the game stats we couldn't parse, the same as the
+    #sums over a single team's history
+    game_totals = windows['Game Stats'].groupby(keys)[list(GAME_STATS)].sum().reindex(index,fill_value=0).astype(float)
+    defense_columns = [col for col in tables['Defense'].columns if col not in ('Team','Year','Week','Date')]
+    defense_totals = windows['Defense'].groupby(keys)[defense_columns].sum().reindex(index,fill_value=0).astype(float)
+    sacks = windows['Passing'].groupby(keys)['Pass Sk'].sum().reindex(index,fill_value=0).astype(float)
+    punts = windows['Punting'].groupby(keys)['Scoring Pnt'].sum().reindex(index,fill_value=0).astype(float)
+    features = [feature.reindex(index,fill_value=0) for feature in features]
+    features.append(pd.DataFrame(offense_features(game_totals,volumes['Passing'],volumes['Rushing'],
+                                                  volumes['Kick Returns'],volumes['Punt Returns'],volumes['Field Goals'],
+                                                  punts,sacks,team_memory)))
+    features.append(pd.DataFrame(defensive_features(defense_totals)[0]))
+    features = pd.concat(features,axis=1)
+    features.index = pd.MultiIndex.from_frame(targets[['Team','Target Date']],names=['Team','Date'])
+    return features
+
+"""
+Same as make_initial_training, except it does every game in a couple of joins
+instead of a pool task per game. The Y comes right from the team Game Stats,
+since that's the final score from the Scoring sheet, and the Vegas lines are
+still read out of each game's Game Info. Batch mode doesn't go back to the 
+scraper for players we don't have sheets for, those players just count as
+zeros, so run name_scraper.py first.
+"""
+def make_batch_training(player_memory=None,team_memory=10,playoffs=True,gofast=True,game_dir='Games',player_dir='Players',team_dir='Teams',start_year=2003):
+    print ("Generating batch training data")
+    tables = read_team_tables(team_dir)
+    games = number_team_games(tables['Game Stats'])
+    features = batch_team_features(tables,games,player_memory,team_memory,playoffs,player_dir,gofast)
+    schedule = pd.DataFrame([get_game_keys(game) for game in get_training_games(game_dir,team_memory,start_year)],
+                            columns=['Game','Date','Home','Away','Year','Week'])
+    keys = schedule.to_dict('records')
+    schedule['Date'] = pd.to_datetime(schedule['Date'])
+    home_features = features.add_prefix('Home ').reindex(pd.MultiIndex.from_frame(schedule[['Home','Date']]))
+    away_features = features.add_prefix('Away ').reindex(pd.MultiIndex.from_frame(schedule[['Away','Date']]))
+    has_history = home_features.notna().all(axis=1).values & away_features.notna().all(axis=1).values
+    schedule = schedule.loc[has_history].reset_index(drop=True)
+    keys = [key for key, keep in zip(keys,has_history) if keep]
+    x = pd.concat([home_features.loc[has_history].reset_index(drop=True),away_features.loc[has_history].reset_index(drop=True)],axis=1)
+    points = tables['Game Stats'].set_index(['Team','Date'])['Total Points'].astype(int)
+    y = points.reindex(pd.MultiIndex.from_frame(schedule[['Away','Date']])).values - points.reindex(pd.MultiIndex.from_frame(schedule[['Home','Date']])).values
+    if not gofast:
+        cores = int(cpu_count()*.75)
+    else:
+        cores = int(cpu_count()*0.9)
+    with Pool(cores) as pool:
+        z = pool.starmap(get_vegas_spread,zip(schedule['Game'],schedule['Away']))
+    return keys, x[FEATURE_NAMES].values.astype(np.float32), y.astype(np.float32), np.array(z,dtype=np.float32)
 """
 For once I have a messy main that should be cleaned up.
-This will declare the global XYZ, initiate the player_memory, team_memory,
+This will initiate the player_memory, team_memory,
 and if we care about playoff performance. It will also write the training 
-data to pickled python object and to an excel file.
+data to the training data directory the models read from, and to an excel file
+if we want to look through it.
 
 TODO: Write an argparser for player_memory, team_memory, and playoffs. Write
 writing functiosn.
 """
 if __name__ == '__main__':
-    global x_data
-    x_data = []
-    global y_data
-    y_data = []
-    global z_data
-    z_data = []
     freeze_support()
     player_memory = 8
     team_memory = 4
     playoffs = True
-    make_initial_training(player_memory,team_memory,playoffs)
-    training_data = (x_data,y_data,z_data)
-    x_data = pd.DataFrame(x_data)
-    x_data['Score Differential'] = y_data
-    x_data['Vegas Baseline'] = z_data
-    if player_memory is None:
-        player_memory = 'All'
-    with open('Training/Player-%s,Team-%s,Playoffs-%s.pckl'%(player_memory,team_memory,playoffs), 'wb') as train:
-        pickle.dump(training_data,train)
-    writer = pd.ExcelWriter('Training/Player-%s,Team-%s,Playoffs-%s.xlsx'%(player_memory,team_memory,playoffs), engine='xlsxwriter')
-    x_data.to_excel(writer,index=None)
-    writer.close()
-    
\ No newline at end of file
+    batch = False
+    write_xlsx = False
+    if batch:
+        keys, x_data, y_data, z_data = make_batch_training(player_memory,team_memory,playoffs)
+    else:
+        keys, x_data, y_data, z_data = make_initial_training(player_memory,team_memory,playoffs)
+    write_training(x_data,y_data,z_data,keys,FEATURE_NAMES,player_memory,team_memory,playoffs)
+    if write_xlsx:
+        x_data = pd.DataFrame(x_data,columns=FEATURE_NAMES)
+        x_data['Score Differential'] = y_data
+        x_data['Vegas Baseline'] = z_data
+        writer = pd.ExcelWriter(get_training_path(player_memory,team_memory,playoffs) + '.xlsx', engine='xlsxwriter')
+        x_data.to_excel(writer,index=None)
+        #The game keys go on their own sheet, so the first sheet is just the
+        #features and targets
+        pd.DataFrame(keys).to_excel(writer,sheet_name='Games',index=None)
+        writer.close()
@@ -0,0 +1,52 @@
+"""
+These are the error metrics we use for comparing our predictions to the
+baseline prediction performance. They're kept in their own module so the 
+worker processes can import them without running a model script.
+"""
+import numpy as np
+
+"""
+Root Mean Square Error
+"""
+def get_rmse(Y,baseline):
+    return np.sqrt(np.mean((Y-baseline)**2))
+
+
+"""
+Mean Absolute Error
+"""
+def get_mae(Y,baseline):
+    return np.mean(np.abs(Y-baseline))
+
+
+"""
+Spread accuracy ends up being a slightly convoluted computation because of the 
+a spread is always defined on the favored team. In our case we had converted those
+spread lines to work against the home team no matter what, but that also means
+we had to negate some of them. So positive spreads imply the away team as a
+favorite, while negative spreads imply the home team. So if the spread was right
+and favored the home team, the spread will be negative and the the scoring
+differential will have to be "less than that negative spread. So that if the home team
+is favored, the home team has to score more points. While if the spread is positive
+the scoring differential has to greater than the positive spread. And here we're
+going to get the total number that meet either of those two requirements.
+"""
+
+def spread_accuracy(act,pred):
+    try:
+        pred = pred.flatten()
+    except:
+        pass
+    A = np.greater(pred,np.zeros_like(pred))
+    B = np.greater_equal(act,pred)
+    C = np.less(pred,np.zeros_like(pred))
+    D = np.less_equal(act, pred)
+    return np.mean(np.logical_or(np.logical_and(A,B) , 
+                                 np.logical_and(C,D)))
+
+"""
+The scorers we can rank features by, and whether a higher score is better.
+"""
+SCORERS = {'spread_accuracy': (spread_accuracy, True),
+           'mae': (get_mae, False),
+           'rmse': (get_rmse, False)}
@@ -0,0 +1,239 @@
+"""
+A place to keep trained models, and load them back quickly.
+
+generate_model used to pickle the whole 1,500 tree forest, plus a separate
+pickle of the train and test arrays, every time it found a better model, and
+those files are huge and slow to load in the SHAP notebook or anything that
+wants to score games.
+
+Each model gets a directory in Model Results/Registry that holds:
+
+meta.json - the feature names, memory parameters, metrics, and how it was saved
+model.joblib - the model, compressed
+nodes.npy, values.npy, trees.npz - the forest's trees, if it's a forest
+X_train.npy, X_test.npy, Y_train.npy, Y_test.npy - the data, if we saved it
+
+For forests, the trees are pulled out of the model and stored as one big
+array of every tree's nodes and one of their values, which get read straight
+from the .npy files instead of being unpickled node by node. The files are 
+memory mapped while we read them, but sklearn's trees copy their nodes and 
+values into their own memory when they're rebuilt, so a loaded forest takes 
+as much memory as one that was unpickled, it just loads a lot faster.
+
+The trees can also be stored compact, with 32 bit thresholds, values, and 
+indexes instead of 64 bit, which halves the size of the files. A threshold 
+sits halfway between two float32 values of a feature, and rounding it to 32 
+bits can round it onto one of them, which sends games with that value down 
+the other branch. So the predictions of a compact model can differ from the
+full model's, not just in the last few digits, and benchmark reports how far
+off they are for a given set of games.
+
+The metadata can be read on its own, so looking through the registry doesn't
+load any models.
+"""
+import os
+import json
+import joblib
+import hashlib
+import pickle
+import numpy as np
+from time import time, strftime
+from sklearn.tree._tree import Tree, NODE_DTYPE
+
+REGISTRY_DIR = 'Model Results/Registry'
+
+"""
+The compact version of the tree nodes, every 64 bit field is 32 bit instead.
+"""
+COMPACT_NODE_DTYPE = np.dtype([(name,{'i':'<i4','f':'<f4'}.get(NODE_DTYPE.fields[name][0].kind,NODE_DTYPE.fields[name][0].str))
+                               for name in NODE_DTYPE.names])
+
+def get_model_path(name,registry_dir=REGISTRY_DIR):
+    return os.path.join(registry_dir,name)
+
+"""
+Checking if the model is a forest of sklearn trees we can pull apart.
+"""
+def is_forest(model):
+    estimators = getattr(model,'estimators_',None)
+    return isinstance(estimators,list) and len(estimators) > 0 and all(hasattr(est,'tree_') for est in estimators)
+
+"""
+This writes every tree of a forest into the shared node and value arrays.
+"""
+def save_trees(model,path,compact):
+    states = [est.tree_.__getstate__() for est in model.estimators_]
+    nodes = np.concatenate([state['nodes'] for state in states])
+    values = np.concatenate([state['values'] for state in states])
+    if compact:
+        nodes = nodes.astype(COMPACT_NODE_DTYPE)
+        values = values.astype(np.float32)
+    np.save(os.path.join(path,'nodes.npy'),nodes)
+    np.save(os.path.join(path,'values.npy'),values)
+    np.savez(os.path.join(path,'trees.npz'),
+             offsets=np.cumsum([0] + [state['node_count'] for state in states]),
+             max_depths=np.array([state['max_depth'] for state in states]))
+
+"""
+This rebuilds each tree of the forest from the node and value arrays. With
+mmap the arrays are only paged in as each tree gets rebuilt, instead of read
+into memory all at once, but each tree still ends up with its own copy.
+"""
+def load_trees(model,path,mmap=True):
+    mmap_mode = 'r' if mmap else None
+    nodes = np.load(os.path.join(path,'nodes.npy'),mmap_mode=mmap_mode)
+    values = np.load(os.path.join(path,'values.npy'),mmap_mode=mmap_mode)
+    trees = np.load(os.path.join(path,'trees.npz'))
+    offsets, max_depths = trees['offsets'], trees['max_depths']
+    for i, est in enumerate(model.estimators_):
+        tree_nodes = nodes[offsets[i]:offsets[i + 1]]
+        tree_values = values[offsets[i]:offsets[i + 1]]
+        #The trees have to have their full size types
+        if tree_nodes.dtype != NODE_DTYPE:
+            tree_nodes = tree_nodes.astype(NODE_DTYPE)
+        if tree_values.dtype != np.float64:
+            tree_values = tree_values.astype(np.float64)
+        tree = Tree(est.n_features_in_,np.ones(est.n_outputs_,dtype=np.intp),est.n_outputs_)
+        tree.__setstate__({'max_depth':int(max_depths[i]),
+                           'node_count':int(offsets[i + 1] - offsets[i]),
+                           'nodes':tree_nodes,
+                           'values':tree_values})
+        est.tree_ = tree
+    return model
+
+"""
+Saving a model to the registry.
+
+feature_names - the names of the features the model was fit on
+training - the memory parameters of the training data, i.e.
+           {'player_memory':8,'team_memory':4,'playoffs':True}
+metrics - the errors from compare_errors
+data - (X_train, X_test, Y_train, Y_test) if we want to keep them with the model
+compact - store the trees with 32 bit numbers
+compress - the joblib compression level of the rest of the model
+"""
+def save_model(model,name,feature_names=None,training=None,metrics=None,data=None,compact=False,compress=3,registry_dir=REGISTRY_DIR):
+    path = get_model_path(name,registry_dir)
+    os.makedirs(path,exist_ok=True)
+    forest = is_forest(model)
+    if forest:
+        save_trees(model,path,compact)
+        #We pickle the forest without its trees, since those are in the arrays
+        trees = [est.tree_ for est in model.estimators_]
+        for est in model.estimators_:
+            del est.tree_
+        try:
+            joblib.dump(model,os.path.join(path,'model.joblib'),compress=compress)
+        finally:
+            for est, tree in zip(model.estimators_,trees):
+                est.tree_ = tree
+    else:
+        joblib.dump(model,os.path.join(path,'model.joblib'),compress=compress)
+    if data is not None:
+        for data_name, array in zip(['X_train','X_test','Y_train','Y_test'],data):
+            np.save(os.path.join(path,'%s.npy'%data_name),np.asarray(array))
+    meta = {'name':name,
+            'model_class':type(model).__name__,
+            'forest':forest,
+            'compact':compact,
+            'feature_names':None if feature_names is None else list(feature_names),
+            'training':training,
+            'metrics':None if metrics is None else {key:float(val) for key, val in metrics.items()},
+            'data':data is not None,
+            'saved':strftime('%Y-%m-%d %H:%M:%S')}
+    with open(os.path.join(path,'meta.json'),'w') as meta_file:
+        json.dump(meta,meta_file,indent=1)
+    return path
+
+"""
+Reading just the metadata of a model.
+"""
+def load_meta(name,registry_dir=REGISTRY_DIR):
+    with open(os.path.join(get_model_path(name,registry_dir),'meta.json'),'r') as meta_file:
+        return json.load(meta_file)
+
+"""
+The metadata of every model in the registry.
+"""
+def list_models(registry_dir=REGISTRY_DIR):
+    if not os.path.isdir(registry_dir):
+        return []
+    return [load_meta(name,registry_dir) for name in sorted(os.listdir(registry_dir))
+            if os.path.exists(os.path.join(registry_dir,name,'meta.json'))]
+
+"""
+Loading a model from the registry.
+"""
+def load_model(name,registry_dir=REGISTRY_DIR,mmap=True):
+    path = get_model_path(name,registry_dir)
+    meta = load_meta(name,registry_dir)
+    model = joblib.load(os.path.join(path,'model.joblib'))
+    if meta['forest']:
+        load_trees(model,path,mmap)
+    return model
+
+"""
+A fingerprint of a saved model, from the files that make up the model, so
+anything we work out from a model can be cached under it and never get mixed
+up with a model that was saved over it later.
+"""
+def model_fingerprint(name,registry_dir=REGISTRY_DIR):
+    path = get_model_path(name,registry_dir)
+    fingerprint = hashlib.sha1()
+    for file_name in ['model.joblib','nodes.npy','values.npy','trees.npz']:
+        if os.path.exists(os.path.join(path,file_name)):
+            with open(os.path.join(path,file_name),'rb') as model_file:
+                for block in iter(lambda: model_file.read(1 << 20),b''):
+                    fingerprint.update(block)
+    return fingerprint.hexdigest()[:12]
+
+"""
+Loading the train and test data saved with a model, memory mapped.
+"""
+def load_data(name,registry_dir=REGISTRY_DIR,mmap=True):
+    path = get_model_path(name,registry_dir)
+    mmap_mode = 'r' if mmap else None
+    return tuple(np.load(os.path.join(path,'%s.npy'%data_name),mmap_mode=mmap_mode)
+                 for data_name in ['X_train','X_test','Y_train','Y_test'])
+
+"""
+Getting the size of everything in a directory.
+"""
+def get_size(path):
+    return sum(os.path.getsize(os.path.join(path,file_name)) for file_name in os.listdir(path))
+
+"""
+This compares saving a model with plain pickle against the registry, with and
+without the compact trees, on how big the files are, how long they take to
+load, and how far off the loaded model's predictions are.
+"""
+def benchmark(model,X,registry_dir=os.path.join(REGISTRY_DIR,'benchmark')):
+    os.makedirs(registry_dir,exist_ok=True)
+    preds = model.predict(X)
+    pickle_path = os.path.join(registry_dir,'model.pkl')
+    with open(pickle_path,'wb') as pkl_file:
+        pickle.dump(model,pkl_file)
+    start = time()
+    with open(pickle_path,'rb') as pkl_file:
+        loaded = pickle.load(pkl_file)
+    results = [{'format':'pickle',
+                'mb':os.path.getsize(pickle_path)/1e6,
+                'load_seconds':time() - start,
+                'max_pred_diff':float(np.max(np.abs(loaded.predict(X) - preds)))}]
+    for compact in (False,True):
+        name = 'compact' if compact else 'full'
+        path = save_model(model,name,compact=compact,registry_dir=registry_dir)
+        start = time()
+        loaded = load_model(name,registry_dir)
+        results.append({'format':'registry %s'%name,
+                        'mb':get_size(path)/1e6,
+                        'load_seconds':time() - start,
+                        'max_pred_diff':float(np.max(np.abs(loaded.predict(X) - preds)))})
+    for result in results:
+        print ('...',result)
+    return results
+
+if __name__ == '__main__':
+    model = load_model('rf')
+    X_train, X_test, Y_train, Y_test = load_data('rf')
+    benchmark(model,X_test)
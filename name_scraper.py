@@ -17,6 +17,7 @@ from time import sleep
 from bs4 import BeautifulSoup
 from collections import defaultdict
 from multiprocessing import Pool, cpu_count, freeze_support
+from schemas import apply_schema
 
 """
 We're initializing these classes just to make sense of the inheritance 
@@ -38,7 +39,7 @@ class Gamelog(object):
         self.rows = []
     
     def create_df(self):
-        self.df = pd.DataFrame(self.rows)
+        self.df = apply_schema(pd.DataFrame(self.rows),self.log_type)
         self.rows = []
 
 
@@ -4,29 +4,21 @@ squares model. You could use the scikit-learn for the OLS, but I like the
 summary that that statsmodels.api gives. It bears a close resemblacne to that
 of R, which I find more informative than the scikit-learn outputs. 
 """
+import os
+import json
+from io import BytesIO
 import pandas as pd
+from training_data import load_training, data_fingerprint
+from model_registry import save_model
 import statsmodels.api as sm
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
 import numpy as np
-from collections import defaultdict
+from multiprocessing import Pool, cpu_count, freeze_support
+from scipy import stats
+from scipy.linalg import qr, cho_factor, cho_solve, LinAlgError
 from sklearn.model_selection import train_test_split
 
-"""
-Here's we're going to read the X,Y, and baseline data.
-"""
-def read_training(player_memory=None,team_memory=10,playoffs=True):
-   if player_memory is None:
-       player_memory = 'All'
-   data = pd.read_excel('Training/Player-%s,Team-%s,Playoffs-%s.xlsx'%(player_memory,team_memory,playoffs)) 
-   data = data.fillna(0)
-   Y = data['Score Differential']
-   baseline = data['Vegas Baseline']
-   X = data.drop('Score Differential',axis=1)
-   X = X.drop('Vegas Baseline', axis=1)
-   return X,Y,baseline
-
-
-
 """
 Here will be our error metrics for comparing our predictions to the baseline 
 prediction performance.
@@ -81,13 +73,86 @@ def spread_accuracy(act,pred):
                                  np.logical_and(C,D)))
 
 """
-Here we'll plot the results.
+This sets up each worker process for plotting. The workers draw with the Agg
+backend, so no windows get opened, and each gets the results once.
+"""
+def init_worker(res):
+    global worker
+    plt.switch_backend('Agg')
+    worker = {'res':res}
+
 """
-def plot_res(res,X):
-    for name in X.columns:
-        fig = plt.figure(figsize=(12,8))
-        fig = sm.graphics.plot_regress_exog(res, name, fig=fig)
-        fig.savefig('Model Results/OLS/%s.png'%name)
+This draws the regression plots of a single feature. If we're saving a png the
+worker saves it, otherwise the png gets sent back so it can go into the pdf,
+since the figures themselves can't be pickled.
+"""
+def plot_feature(task):
+    name, path = task
+    fig = plt.figure(figsize=(12,8))
+    fig = sm.graphics.plot_regress_exog(worker['res'], name, fig=fig)
+    if path is None:
+        png = BytesIO()
+        fig.savefig(png,format='png')
+        plt.close(fig)
+        return name, png.getvalue()
+    fig.savefig(path)
+    plt.close(fig)
+    return name, None
+
+"""
+Here we'll plot the results, a set of regression plots for every feature. The
+features get plotted across a pool of processes, and every figure gets closed
+once it's saved.
+
+pdf_name - put every plot in one pdf in the plot_dir instead of a png for each
+skip_unchanged - don't redraw the plots if they were already drawn from the
+                 same results, which we know from a fingerprint of the results
+"""
+def plot_res(res,X,pdf_name=None,plot_dir='Model Results/OLS',skip_unchanged=True,gofast=True):
+    os.makedirs(plot_dir,exist_ok=True)
+    fingerprint = data_fingerprint(res.params,res.bse,res.model.exog,res.model.endog)
+    fingerprint_path = os.path.join(plot_dir,'plots.json')
+    fingerprints = {}
+    if os.path.exists(fingerprint_path):
+        with open(fingerprint_path,'r') as fingerprint_file:
+            fingerprints = json.load(fingerprint_file)
+    if pdf_name is None:
+        files = {name:'%s.png'%name for name in X.columns}
+    else:
+        files = {name:pdf_name for name in X.columns}
+    if skip_unchanged:
+        names = [name for name in X.columns if fingerprints.get(files[name]) != fingerprint
+                 or not os.path.exists(os.path.join(plot_dir,files[name]))]
+    else:
+        names = list(X.columns)
+    if not names:
+        print ("The plots are already up to date")
+        return
+    if not gofast:
+        cores = int(cpu_count()*.75)
+    else:
+        cores = int(cpu_count()*0.9)
+    cores = max(1,min(cores,len(names)))
+    print ("Plotting %s features using %s cores:"%(len(names),cores))
+    with Pool(cores,initializer=init_worker,initargs=(res,)) as pool:
+        if pdf_name is None:
+            tasks = [(name,os.path.join(plot_dir,files[name])) for name in names]
+            for name, _ in pool.imap_unordered(plot_feature,tasks):
+                fingerprints[files[name]] = fingerprint
+        else:
+            #The pdf gets put together here as the figures come back, in the
+            #same order as the features
+            with PdfPages(os.path.join(plot_dir,pdf_name)) as pdf:
+                for name, png in pool.imap(plot_feature,[(name,None) for name in names]):
+                    fig = plt.figure(figsize=(12,8))
+                    ax = fig.add_axes([0,0,1,1])
+                    ax.imshow(plt.imread(BytesIO(png)))
+                    ax.axis('off')
+                    pdf.savefig(fig)
+                    plt.close(fig)
+            fingerprints[pdf_name] = fingerprint
+    with open(fingerprint_path,'w') as fingerprint_file:
+        json.dump(fingerprints,fingerprint_file,indent=1)
 
 """
 Here we're going to construct an OLS model
@@ -101,91 +166,138 @@ def make_model(X,Y,print_sum=False,title='OLS'):
             results.write(str(res.summary()))
     return res
 """
-Here we're going to check for colinearity. We'll have to filter out any values
-that would blow up a correlation matrix, which generally would be features that
-are passed through that are constant, due to how a Pearson Coefficient is
-calculated. This will filter out constant features, as well as all but a single
-feature that appear to be collinear for each team. The eval_cutoff and evect_cutoff
-defualt to a numpy is close to 0, which I believe has a tolerance of 1e-5. If you want
-to be more forgiving you can specifiy a different tolerance level for each of the 
-checks.
-"""
-def filter_collinear(X,eval_cutoff=None,evect_cutoff=None):
-    name_index = list(X.columns)
-    X = np.array(X)
-    corr = np.corrcoef(X,rowvar=False)
+Here we're going to check for colinearity. Constant features would blow up a
+correlation matrix, due to how a Pearson Coefficient is calculated, so first we
+drop any feature with a variance at or below var_cutoff. Then we filter out all
+but a single feature that appear to be collinear for each team.
+
+method - 'eigh' goes through the eigenvalues of the correlation matrix, and
+         every feature with a weight in the eigenvector of an eigenvalue close
+         to zero is collinear. The eval_cutoff and evect_cutoff defualt to a
+         numpy is close to 0, which has a tolerance of 1e-8. If you want to be
+         more forgiving you can specifiy a different tolerance level for each
+         of the checks. We keep the first collinear feature for each team.
+         'qr' does a pivoted QR of the standardized features instead, and keeps
+         just the features that are linearly independent, whichever team they
+         belong to. Features whose diagonal of R is less than rank_tol times
+         the largest diagonal get dropped.
+"""
+def filter_collinear(X,eval_cutoff=None,evect_cutoff=None,drop_constant=True,var_cutoff=1e-12,method='eigh',rank_tol=None):
+    values = np.asarray(X,dtype=np.float64)
+    keep = np.ones(values.shape[1],dtype=bool)
+    if drop_constant:
+        keep &= values.var(axis=0) > var_cutoff
+    columns = np.flatnonzero(keep)
+    Z = values[:,columns]
+    Z = (Z - Z.mean(axis=0))/Z.std(axis=0)
     
-    #Here we're going to filter out any columns that have nan values throughout
-    #them
-    consts =  np.argwhere(np.isnan(corr))
-    if consts.size != 0:
-        const_dict = defaultdict(int)
-        for index in consts:
-            const_dict[index[0]] += 1
-        constant_cols = []
-        for index, count in const_dict.items():
-            if count == X.shape[1]:
-                constant_cols.append(index)
-        #We'll recalculate the correlation matrix so we don't have any nans,
-        #after we drop those features from our X data.
-        if bool(constant_cols):
-            name_index = [val for i, val in enumerate(name_index) if i not in constant_cols]
-            X = np.delete(X,constant_cols,axis=1)
-            corr = np.corrcoef(X, rowvar=False)
+    if method == 'qr':
+        R, pivots = qr(Z,mode='r',pivoting=True)
+        diag = np.abs(np.diag(R))
+        if rank_tol is None:
+            rank_tol = max(Z.shape)*np.finfo(np.float64).eps
+        rank = np.sum(diag > rank_tol*diag[0])
+        keep[columns[pivots[rank:]]] = False
+        return X.iloc[:,np.flatnonzero(keep)]
     
-    #Here we're going to go through the eigenvalues, and if the eigenvalue
-    #is close to zero, either by numpy's standard or a specified value, 
-    #we'll seperrate the data into two teams, and list each team's indicies
-    w,v = np.linalg.eig(corr)
-    collinear = defaultdict(list)
-    for i,eigval in enumerate(w):
-        if eval_cutoff is None:
-            if np.isclose(eigval,0):
-                for j, val in enumerate(v[:,i]):
-                    if evect_cutoff is None:
-                        if not np.isclose(val,0):
-                            collinear[name_index[j].split(' ')[0]].append(j)
-                    else:
-                        if val > evect_cutoff:
-                            collinear[name_index[j].split(' ')[0]].append(j)
-        else:
-            if eigval < eval_cutoff:
-                for j, val in enumerate(v[:,i]):
-                    if evect_cutoff is None:
-                        if not np.isclose(val,0):
-                            collinear[name_index[j].split(' ')[0]].append(j)
-                    else:
-                        if val > evect_cutoff:
-                            collinear[name_index[j].split(' ')[0]].append(j)
-    col_remove = []
+    #The correlation matrix is symmetric, so eigh gives us real eigenvalues in
+    #one go
+    w,v = np.linalg.eigh(Z.T @ Z/Z.shape[0])
+    if eval_cutoff is None:
+        near_zero = np.isclose(w,0)
+    else:
+        near_zero = w < eval_cutoff
+    if evect_cutoff is None:
+        involved = ~np.isclose(v[:,near_zero],0)
+    else:
+        involved = np.abs(v[:,near_zero]) > evect_cutoff
+    involved = np.flatnonzero(involved.any(axis=1))
     #We'll keep the first collinear element from each teams collinear features
-    for team, indicies in collinear.items():
-        col_remove.extend(indicies[1:])
-    name_index = [val for i, val in enumerate(name_index) if i not in col_remove]
-    X = np.delete(X,col_remove,axis=1)
-    return pd.DataFrame(X,columns=name_index)
+    teams = np.array([name.split(' ')[0] for name in X.columns[columns[involved]]])
+    _, first = np.unique(teams,return_index=True)
+    keep[columns[np.delete(involved,first)]] = False
+    return X.iloc[:,np.flatnonzero(keep)]
 """
-Here we're going to filter out features based on their significance values to 
-the OLS model, by their p values. I.e. a cutoff of 0.05 would only keep 
-features with a pvalue less than five
+Here we're going to filter out features one at a time instead, by backward
+elimination. Every step drops the feature with the highest p value, as long as
+it's over the cutoff, and the coefficients and standard errors of the features
+that are left get updated from the last step instead of refitting.
+
+If G is the inverse of X'X, which we get once from a Cholesky factor, dropping
+feature j leaves
+    G' = G[-j,-j] - G[-j,j]G[j,-j]/G[j,j]
+    b' = b[-j] - G[-j,j]b[j]/G[j,j]
+    RSS' = RSS + b[j]^2/G[j,j]
+so each step is a rank one downdate of what we already have, and the whole path
+down from every feature costs about as much as the first fit.
+
+If X'X can't be factored, because a column is all zeros or a combination of 
+other columns, the columns a pivoted QR finds are dependent get dropped first.
+They don't change the fit, so they go in the path with no p value.
+
+Returns the names of the features that are left, and the path as a dataframe of
+the feature dropped at each step, its p value, and the fit after dropping it.
 """
-def filter_out(res,X,cutoff=0.2):
-    for label,p in res.pvalues.iteritems():
-        if p > cutoff:
-            X = X.drop(label,axis=1)
-    return X
+def backward_eliminate(X,Y,cutoff=0.05,min_features=1):
+    names = np.array(X.columns)
+    A = np.asarray(X,dtype=np.float64)
+    y = np.asarray(Y,dtype=np.float64)
+    n = A.shape[0]
+    left = np.arange(A.shape[1])
+    dependent = []
+    try:
+        factor = cho_factor(A.T @ A)
+    except LinAlgError:
+        #Scaling the columns first means the QR keeps the earlier of two 
+        #columns that only differ by scale
+        norms = np.linalg.norm(A,axis=0)
+        R, pivots = qr(A/np.where(norms > 0,norms,1),mode='r',pivoting=True)
+        diag = np.abs(np.diag(R))
+        rank = np.sum(diag > max(A.shape)*np.finfo(np.float64).eps*diag[0])
+        dependent = pivots[rank:]
+        left = np.sort(pivots[:rank])
+        factor = cho_factor(A[:,left].T @ A[:,left])
+    G = cho_solve(factor,np.eye(len(left)))
+    b = G @ (A[:,left].T @ y)
+    rss = float(np.sum((y - A[:,left] @ b)**2))
+    path = [{'feature':names[j],
+             'p_value':np.nan,
+             'features_left':A.shape[1] - i - 1,
+             'rss':rss,
+             'aic':n*(np.log(2*np.pi*rss/n) + 1) + 2*(A.shape[1] - i - 1)} for i, j in enumerate(dependent)]
+    while len(left) > min_features:
+        df = n - len(left)
+        t_values = b/np.sqrt(rss/df*np.diag(G))
+        pvalues = 2*stats.t.sf(np.abs(t_values),df)
+        j = np.argmax(pvalues)
+        if pvalues[j] <= cutoff:
+            break
+        g = G[:,j]
+        rss += b[j]**2/g[j]
+        b = np.delete(b - g*(b[j]/g[j]),j)
+        G = np.delete(np.delete(G - np.outer(g,g/g[j]),j,axis=0),j,axis=1)
+        path.append({'feature':names[left[j]],
+                     'p_value':pvalues[j],
+                     'features_left':len(left) - 1,
+                     'rss':rss,
+                     'aic':n*(np.log(2*np.pi*rss/n) + 1) + 2*(len(left) - 1)})
+        left = np.delete(left,j)
+    return list(names[left]), pd.DataFrame(path,columns=['feature','p_value','features_left','rss','aic'])
 
 """
-Here we'll make two models, one with all of the features, and one that filters
-out features with a p value less than the cutoff. 
+Here we'll make two models, one with all of the features that aren't 
+collinear, and one that filters out features with a p value over the cutoff, 
+one at a time. 
 """
 def model_filter(filter_val,clip=None):
-    X, Y = read_training()
+    X, Y, baseline = load_training(8,4)
+    X = filter_collinear(X)
     if bool(clip):
         Y = np.clip(Y,-clip,clip)
     res = make_model(X,Y,True,title='Simple OLS Clip')
-    plot_res(res,X,Y,title='Simple OLS Clip',save=True)
-    X = filter_out(res,X,filter_val)
+    plot_res(res,X)
+    features, path = backward_eliminate(X,Y,filter_val)
+    X = X[features]
     res = make_model(X,Y,True,title='Simple OLS Filtered Cutoff Clip')
     return res
 
@@ -205,33 +317,42 @@ def compare_errors(preds,baseline,Y_test,Y):
     errors['baseline_rmse'] = get_rmse(baseline,Y)
     return errors
 
-"""
-Here we'll calculate the first linear model filtering out any collinear features 
-"""
-X,Y, baseline = read_training(8,4)
-X = filter_collinear(X)
-X_train, X_test, Y_train,Y_test = training_and_test(X,Y,0.1)
-res = make_model(X_train,Y_train,False, 'full_OLS')
-preds = res.predict(X_test)
-errors = compare_errors(preds,baseline,Y_test,Y)
-print ('Full OLS:')
-for name,error in errors.items():
-    print ('...',name,error)
+#The guard is here so the plotting worker processes don't rerun all of this
+#if they have to import this file
+if __name__ == '__main__':
+    freeze_support()
+    """
+    Here we'll calculate the first linear model filtering out any collinear features 
+    """
+    X,Y, baseline = load_training(8,4)
+    X = filter_collinear(X)
+    X_train, X_test, Y_train,Y_test = training_and_test(X,Y,0.1)
+    res = make_model(X_train,Y_train,False, 'full_OLS')
+    preds = res.predict(X_test)
+    errors = compare_errors(preds,baseline,Y_test,Y)
+    print ('Full OLS:')
+    for name,error in errors.items():
+        print ('...',name,error)
 
 
-"""
-We'll calculate the second model by filtering out any values below our desired
-significance level
-"""
-X = filter_out(res,X,0.05)
-X_train, X_test, Y_train,Y_test = training_and_test(X,Y,0.1)
-res = make_model(X_train,Y_train,False, 'filtered_OLS')
-plot_res(res)
-preds = res.predict(X_test)
-errors = compare_errors(preds,baseline,Y_test,Y)
-print ('Filtered OLS')
-for name,error in errors.items():
-    print ('...',name,error)
+    """
+    We'll calculate the second model by filtering out any values below our desired
+    significance level
+    """
+    features, path = backward_eliminate(X_train,Y_train,0.05)
+    X = X[features]
+    X_train, X_test, Y_train,Y_test = training_and_test(X,Y,0.1)
+    res = make_model(X_train,Y_train,False, 'filtered_OLS')
+    plot_res(res,X_train)
+    preds = res.predict(X_test)
+    errors = compare_errors(preds,baseline,Y_test,Y)
+    print ('Filtered OLS')
+    for name,error in errors.items():
+        print ('...',name,error)
+    #Saving the filtered model to the model registry so the server can score
+    #games with it, without the training data statsmodels keeps on it
+    res.remove_data()
+    save_model(res,'ols',feature_names=features,training={'player_memory':8,'team_memory':4,'playoffs':True},metrics=errors)
+
 
 
-    
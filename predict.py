@@ -0,0 +1,90 @@
+"""
+Predicting games that haven't been played yet.
+
+make_training only builds features for games that we've already scraped, so
+there wasn't any way to go from a trained model to next Sunday's games. Here we
+take a schedule of matchups, build the same features make_training would have
+for them from each team's last (team_memory) games and each player's career
+before the game date, and score the whole schedule with one predict call.
+
+The features come from the batch mode in make_training, so every team sheet
+and every player's career gets read once for the whole schedule, no matter how
+many games they show up in.
+
+The predictions are the same as the training data's score differential, away
+score minus home score, so they line up with the Vegas line the same way.
+"""
+import numpy as np
+import pandas as pd
+from multiprocessing import freeze_support
+from make_training import read_team_tables, number_team_games, batch_team_features, FEATURE_NAMES
+from model_registry import load_model, load_meta
+
+"""
+This gets the target games for the schedule, for each team the number of
+games they've played before the game date is the game number of the game
+we're predicting. A team needs a full team memory of games before the date.
+"""
+def get_schedule_targets(games,schedule,team_memory):
+    teams = pd.concat([schedule[['Home','Date']].rename(columns={'Home':'Team'}),
+                       schedule[['Away','Date']].rename(columns={'Away':'Team'})]).drop_duplicates()
+    played = teams.merge(games,on='Team',suffixes=('',' Played'))
+    played = played.loc[played['Date Played'] < played['Date']].groupby(['Team','Date']).size()
+    targets = teams.set_index(['Team','Date']).assign(Target=played).fillna({'Target':0}).reset_index()
+    targets['Target'] = targets['Target'].astype(int)
+    short = targets.loc[targets['Target'] < team_memory]
+    if not short.empty:
+        raise ValueError('Not enough games for a team memory of %s: %s'%(team_memory,list(zip(short['Team'],short['Date'].astype(str)))))
+    return targets.rename(columns={'Date':'Target Date'})[['Team','Target','Target Date']]
+
+"""
+This builds the feature matrix for a schedule, a dataframe of Away, Home, and
+Date, in the FEATURE_NAMES order. Missing features are 0, the same as the
+training data.
+
+tables - the team tables from read_team_tables, if we've already read them in
+"""
+def get_schedule_features(schedule,player_memory=8,team_memory=4,playoffs=True,player_dir='Players',team_dir='Teams',gofast=True,tables=None):
+    schedule = schedule.assign(Date=pd.to_datetime(schedule['Date']))
+    if tables is None:
+        tables = read_team_tables(team_dir)
+    games = number_team_games(tables['Game Stats'])
+    targets = get_schedule_targets(games,schedule,team_memory)
+    features = batch_team_features(tables,games,player_memory,team_memory,playoffs,player_dir,gofast,targets)
+    home_features = features.add_prefix('Home ').reindex(pd.MultiIndex.from_frame(schedule[['Home','Date']]))
+    away_features = features.add_prefix('Away ').reindex(pd.MultiIndex.from_frame(schedule[['Away','Date']]))
+    X = pd.concat([home_features.reset_index(drop=True),away_features.reset_index(drop=True)],axis=1)
+    X = X[FEATURE_NAMES].values.astype(np.float32)
+    return np.where(np.isnan(X),0,X).astype(np.float32)
+
+"""
+This predicts every game in the schedule at once.
+
+model - a fitted model, or the name of one in the model registry, i.e. rf
+feature_names - the features the model was fit on, if it wasn't fit on all of
+                them, i.e. one of the models after dropping features. For a
+                model from the registry these come from its metadata.
+"""
+def predict_games(schedule,model,feature_names=None,player_memory=8,team_memory=4,playoffs=True,player_dir='Players',team_dir='Teams',gofast=True,tables=None):
+    if isinstance(model,str):
+        if feature_names is None:
+            feature_names = load_meta(model)['feature_names']
+        model = load_model(model)
+    X = get_schedule_features(schedule,player_memory,team_memory,playoffs,player_dir,team_dir,gofast,tables)
+    if feature_names is not None:
+        positions = {name:i for i, name in enumerate(FEATURE_NAMES)}
+        X = X[:,[positions[name] for name in feature_names]]
+    predictions = schedule.copy()
+    predictions['Predicted Differential'] = np.asarray(model.predict(X)).reshape(-1)
+    return predictions
+
+"""
+The schedule file is a csv with Away, Home, and Date columns, using the same
+team names as the team sheets, i.e. Patriots.
+"""
+if __name__ == '__main__':
+    freeze_support()
+    schedule = pd.read_csv('schedule.csv')
+    predictions = predict_games(schedule,'rf')
+    print (predictions.to_string(index=False))
+    predictions.to_csv('predictions.csv',index=False)
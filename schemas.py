@@ -0,0 +1,171 @@
+"""
+Every parser in game_scraper.py and name_scraper.py pulls each cell out as the
+stripped text of the td, so every table would otherwise be stored as strings,
+and everything downstream would have to rely on read_excel guessing the types
+right on every read.
+
+This keeps a schema for each of the tables we scrape, and the team sheets we
+make from them. Each column maps to a dtype and whether or not it's nullable.
+Counting stats aren't nullable, since a blank cell on pro-football-reference
+just means the player didn't record any, so those get filled with 0 and stored
+as native integer arrays. The team game stats we split out of the Team Stats 
+sheets are the exception, since a value we couldn't parse there means we don't
+know it, not that it was 0, so those stay as nullable integers. Rates can be 
+undefined, so those stay as nullable floats. Teams, players, and positions 
+repeat constantly, so they're stored as categoricals.
+
+Any column we don't have listed falls back on the default for its table,
+which is 'infer' unless otherwise specified. Inferred columns become compact
+numbers if every value in them is a number, and are left alone otherwise.
+"""
+import pandas as pd
+
+COUNT = ('int16', False)
+NULLABLE_COUNT = ('int16', True)
+RATE = ('float32', True)
+CATEGORY = ('category', False)
+TEXT = ('string', True)
+DATE = ('datetime', True)
+INFER = ('infer', True)
+
+"""
+These are categorical in every table they show up in.
+"""
+CATEGORICAL_COLUMNS = ['Tm', 'Opp', 'Player', 'Pos']
+
+OFFENSE = {'Pass Cmp': COUNT, 'Pass Att': COUNT, 'Pass Yds': COUNT, 'Pass TD': COUNT,
+           'Pass Int': COUNT, 'Pass Sk': COUNT, 'Pass Sk Yds': COUNT, 'Pass Lng': COUNT,
+           'Pass Rate': RATE, 'Rush Att': COUNT, 'Rush Yds': COUNT, 'Rush TD': COUNT,
+           'Rush Lng': COUNT, 'Receive Tgt': COUNT, 'Receive Rec': COUNT, 'Receive Yds': COUNT,
+           'Receive TD': COUNT, 'Receive Lng': COUNT, 'Fumble Fmb': COUNT, 'Fumble FL': COUNT}
+
+DEFENSE = {'DefInt Int': COUNT, 'DefInt Yds': COUNT, 'DefInt TD': COUNT, 'DefInt Lng': COUNT,
+           'Sck&Ttl Sk': ('float32', False), 'Fumble FR': COUNT, 'Fumble Yds': COUNT,
+           'Fumble TD': COUNT, 'Fumble FF': COUNT}
+
+RETURNS = {'KR Rt': COUNT, 'KR Yds': COUNT, 'KR Y/Rt': RATE, 'KR TD': COUNT, 'KR Lng': COUNT,
+           'PR Ret': COUNT, 'PR Yds': COUNT, 'PR Y/R': RATE, 'PR TD': COUNT, 'PR Lng': COUNT}
+
+KICKING = {'Scoring XPM': COUNT, 'Scoring XPA': COUNT, 'Scoring FGM': COUNT, 'Scoring FGA': COUNT,
+           'Scoring Pnt': COUNT, 'Scoring Yds': COUNT, 'Punting Y/P': RATE, 'Punting Lng': COUNT}
+
+GAME_STATS = {'First Downs': NULLABLE_COUNT, 'Third Down Att': NULLABLE_COUNT, 'Third Down Cvt': NULLABLE_COUNT,
+              'Fourth Down Att': NULLABLE_COUNT, 'Fourth Down Cvt': NULLABLE_COUNT, 'Fumbles': NULLABLE_COUNT,
+              'Fumbles Lost': NULLABLE_COUNT, 'Total Points': COUNT}
+
+"""
+The parts of a team's defense sheet that come from the other team's game stats.
+"""
+DEFENSE_GAME_STATS = {'Fumble FF': NULLABLE_COUNT, 'Fumble FR': NULLABLE_COUNT, 'First Downs Allowed': NULLABLE_COUNT,
+                      'Third Downs Defended': NULLABLE_COUNT, 'Third Downs Stopped': NULLABLE_COUNT,
+                      'Fourth Downs Defended': NULLABLE_COUNT, 'Fourth Downs Stopped': NULLABLE_COUNT}
+
+GAMELOG = {'Date': DATE, 'Passing Att': COUNT, 'Passing Cmp': COUNT, 'Passing Yds': COUNT,
+           'Passing Int': COUNT, 'Passing TD': COUNT, 'Rushing Att': COUNT, 'Rushing Yds': COUNT,
+           'Rushing TD': COUNT, 'Receiving Tgt': COUNT, 'Receiving Rec': COUNT,
+           'Receiving Yds': COUNT, 'Receiving TD': COUNT, 'Scoring FGA': COUNT, 'Scoring FGM': COUNT,
+           'Scoring XPA': COUNT, 'Scoring XPM': COUNT, 'Kick Returns Rt': COUNT,
+           'Kick Returns Yds': COUNT, 'Kick Returns TD': COUNT, 'Punt Returns Ret': COUNT,
+           'Punt Returns Yds': COUNT, 'Punt Returns TD': COUNT}
+
+"""
+Every row of a team sheet gets the game it came from added to it.
+"""
+TEAM_INDEX = {'Year': COUNT, 'Week': COUNT, 'Date': TEXT}
+
+"""
+table name: {column: (dtype, nullable)}
+"""
+SCHEMAS = {'Scoring': {'Quarter': TEXT, 'Time': TEXT, 'Detail': TEXT},
+           'Game Info': {},
+           'Officials': {},
+           'Team Stats': {'First Downs': COUNT, 'Net Pass Yards': COUNT, 'Total Yards': COUNT, 'Turnovers': COUNT},
+           'Offense': OFFENSE,
+           'Defense': DEFENSE,
+           'Kick Return': RETURNS,
+           'Kicking': KICKING,
+           'Drives': {'Quarter': TEXT, 'Time': TEXT, 'LOS': TEXT, 'Result': TEXT},
+           'Play by Play': {'Quarter': TEXT, 'Time': TEXT, 'Location': TEXT, 'Detail': TEXT},
+           'Regular Season Table': GAMELOG,
+           'Playoffs Table': GAMELOG,
+           'Passing': dict(OFFENSE, **TEAM_INDEX),
+           'Rushing': dict(OFFENSE, **TEAM_INDEX),
+           'Rec': dict(OFFENSE, **TEAM_INDEX),
+           'Kicking Team': dict(KICKING, **TEAM_INDEX),
+           'Punting': dict(KICKING, **TEAM_INDEX),
+           'Kick Return Team': dict(RETURNS, **TEAM_INDEX),
+           'Punt Return': dict(RETURNS, **TEAM_INDEX),
+           'Game Stats': dict(GAME_STATS, **TEAM_INDEX),
+           'Defense Team': dict(DEFENSE, **DEFENSE_GAME_STATS, **TEAM_INDEX)}
+
+"""
+The dtype for any column of the table that isn't in its schema.
+"""
+DEFAULTS = {'Game Info': TEXT,
+            'Officials': TEXT,
+            'Team Stats': TEXT,
+            'Defense Team': ('float32', False)}
+
+"""
+The team sheets reuse a few of the game sheet names, but don't hold the same
+columns, so we look those up under their own names.
+"""
+TEAM_SHEETS = {'Kicking': 'Kicking Team', 'Kick Return': 'Kick Return Team', 'Defense': 'Defense Team'}
+
+"""
+Here we're casting a single column to its dtype. Blank strings are treated as
+missing values, since that's what an empty td comes through as.
+"""
+def cast_column(column,dtype,nullable):
+    if dtype == 'category':
+        return column.astype('category')
+    if dtype == 'string':
+        return column
+    if dtype == 'datetime':
+        return pd.to_datetime(column,errors='coerce')
+    if not pd.api.types.is_numeric_dtype(column):
+        column = column.where(column != '')
+    numbers = pd.to_numeric(column,errors='coerce')
+    if dtype == 'infer':
+        if numbers.notna().sum() != column.notna().sum() or column.isna().all():
+            return column
+        if (numbers.dropna() % 1 == 0).all():
+            return numbers.astype('Int32')
+        return numbers.astype('float32')
+    if not nullable:
+        return numbers.fillna(0).astype(dtype)
+    if dtype.startswith('int'):
+        return numbers.astype(dtype.capitalize())
+    return numbers.astype(dtype)
+
+"""
+This applies the schema for a table to a dataframe at parse time. Sheets that
+have a subtitle, i.e. Team Stats - NWE, use the schema for their main title.
+"""
+def apply_schema(df,table_name,team_sheet=False):
+    table_name = table_name.split(' - ')[0]
+    if team_sheet:
+        table_name = TEAM_SHEETS.get(table_name,table_name)
+    schema = SCHEMAS.get(table_name,{})
+    default = DEFAULTS.get(table_name,INFER)
+    for col in df.columns:
+        if col in schema:
+            dtype, nullable = schema[col]
+        elif col in CATEGORICAL_COLUMNS:
+            dtype, nullable = CATEGORY
+        else:
+            dtype, nullable = default
+        df[col] = cast_column(df[col],dtype,nullable)
+    return df
+
+"""
+Excel doesn't keep any of our dtypes, so anywhere we read the sheets back in
+we go through here to get the schema applied again. This works the same way
+as read_excel, where a single sheet name gives back a single dataframe, and a
+list of them or None gives back a dictionary of them.
+"""
+def read_sheets(path,sheet_name=None,team_sheet=False):
+    sheets = pd.read_excel(path,sheet_name=sheet_name)
+    if isinstance(sheets,dict):
+        return {sn:apply_schema(sheet,sn,team_sheet) for sn, sheet in sheets.items()}
+    return apply_schema(sheets,sheet_name,team_sheet)
@@ -0,0 +1,204 @@
+"""
+Hyperparameter search for the random forest and OLS models.
+
+Up until now the number of trees, the p value cutoff for dropping OLS
+features, and the clip on the score differential were all hard coded, and
+trying something else meant editing the model scripts. This runs a grid,
+random, or successive halving search over those across a process pool, and
+writes every configuration and how it did to a results table.
+
+Every configuration is scored on the same season folds as the walk forward
+backtest, training on every season before the one we're predicting, so the
+scores are ones we could actually get.
+
+The training data, along with its mirrored games, gets put in shared memory
+once by the parent, and every worker attaches to it, so none of the folds get
+copied to the workers. The mirrored version of each game is stored right after
+it, so the training set for any fold is just the first rows of the shared array.
+"""
+import os
+import itertools
+import numpy as np
+import pandas as pd
+import statsmodels.api as sm
+from multiprocessing import Pool, cpu_count, freeze_support
+from multiprocessing.shared_memory import SharedMemory
+from sklearn.ensemble import RandomForestRegressor
+from training_data import load_arrays, read_keys, get_training_path, get_mirror_index
+from metrics import get_rmse, get_mae, spread_accuracy
+from backtest import get_folds
+from ols_model import backward_eliminate
+
+"""
+The parameters we search over if we don't pass any in. The clip is how far we
+clip the score differential we train on, None being no clip.
+"""
+PARAM_GRIDS = {'rf': {'n_estimators': [100, 300, 750, 1500],
+                      'max_features': [1.0, 0.5, 'sqrt'],
+                      'min_samples_leaf': [1, 5, 20],
+                      'clip': [None, 21, 14]},
+               'ols': {'cutoff': [1.0, 0.2, 0.1, 0.05],
+                       'clip': [None, 21, 14]}}
+
+"""
+Here we're fitting a random forest with the configuration, and predicting.
+"""
+def fit_rf(X_train,Y_train,X_test,params):
+    params = {key:val for key, val in params.items() if key != 'clip'}
+    model = RandomForestRegressor(random_state=42,n_jobs=1,**params)
+    model.fit(X_train,Y_train)
+    return model.predict(X_test)
+
+"""
+Same as ols_model, we drop the features with a p value over the cutoff one at
+a time with backward_eliminate, and fit the OLS on what's left.
+"""
+def fit_ols(X_train,Y_train,X_test,params):
+    features, path = backward_eliminate(pd.DataFrame(X_train),Y_train,cutoff=params['cutoff'])
+    res = sm.OLS(Y_train,X_train[:,features]).fit()
+    return res.predict(X_test[:,features])
+
+MODELS = {'rf': fit_rf,
+          'ols': fit_ols}
+
+"""
+This puts an array into shared memory, and gives back the shared memory block
+along with what a worker needs to attach to it.
+"""
+def share_array(array):
+    shared = SharedMemory(create=True,size=max(1,array.nbytes))
+    np.ndarray(array.shape,dtype=array.dtype,buffer=shared.buf)[:] = array
+    return shared, (shared.name,array.shape,array.dtype.str)
+
+"""
+This attaches each worker to the shared training data.
+"""
+def init_worker(shared_arrays):
+    global worker
+    worker = {'shared':[]}
+    for name, (shm_name, shape, dtype) in shared_arrays.items():
+        shared = SharedMemory(name=shm_name)
+        worker['shared'].append(shared)
+        worker[name] = np.ndarray(shape,dtype=dtype,buffer=shared.buf)
+
+"""
+This scores a single configuration on a single fold. Row i of the original
+games is row 2i of the shared arrays, and its mirror is row 2i+1.
+"""
+def evaluate(task):
+    config_id, model_name, params, first, last, mirror = task
+    X, Y = worker['X'], worker['Y']
+    if mirror:
+        X_train, Y_train = X[:2*first], Y[:2*first]
+    else:
+        X_train, Y_train = X[:2*first:2], Y[:2*first:2]
+    if params.get('clip') is not None:
+        Y_train = np.clip(Y_train,-params['clip'],params['clip'])
+    X_test, Y_test = X[2*first:2*last:2], Y[2*first:2*last:2]
+    preds = MODELS[model_name](X_train,Y_train,X_test,params)
+    return config_id, last - first, {'spread_accuracy':spread_accuracy(Y_test,preds),
+                                     'mae':get_mae(preds,Y_test),
+                                     'rmse':get_rmse(preds,Y_test)}
+
+"""
+Every combination of the parameters in the grid.
+"""
+def grid_configs(grid):
+    names = list(grid)
+    return [dict(zip(names,values)) for values in itertools.product(*[grid[name] for name in names])]
+
+"""
+A random sample of the combinations in the grid.
+"""
+def random_configs(grid,n_iter,seed=42):
+    configs = grid_configs(grid)
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(configs),size=min(n_iter,len(configs)),replace=False)
+    return [configs[i] for i in sorted(picks)]
+
+"""
+This runs every configuration on every fold across the pool, and gives back
+each configuration's metrics weighted by the number of games in each fold.
+"""
+def run_configs(pool,model_name,configs,folds,mirror):
+    tasks = [(config_id,model_name,params,first,last,mirror)
+             for config_id, params in configs.items() for _, _, first, last in folds]
+    totals = {config_id:{'games':0,'spread_accuracy':0.0,'mae':0.0,'rmse':0.0} for config_id in configs}
+    for config_id, games, metrics in pool.imap_unordered(evaluate,tasks):
+        totals[config_id]['games'] += games
+        totals[config_id]['spread_accuracy'] += metrics['spread_accuracy']*games
+        totals[config_id]['mae'] += metrics['mae']*games
+        totals[config_id]['rmse'] += (metrics['rmse']**2)*games
+    results = []
+    for config_id, total in totals.items():
+        results.append(dict(configs[config_id],config=config_id,folds=len(folds),games=total['games'],
+                            spread_accuracy=total['spread_accuracy']/total['games'],
+                            mae=total['mae']/total['games'],
+                            rmse=np.sqrt(total['rmse']/total['games'])))
+    return results
+
+"""
+This is our main for the search.
+
+strategy - 'grid', 'random', or 'halving'. Successive halving starts every
+           configuration on the most recent min_folds seasons, and keeps the
+           best 1/eta of them for eta times as many seasons, until the ones
+           left have been run on every season.
+n_iter - how many configurations the random search tries
+"""
+def search(model_name='rf',grid=None,strategy='grid',n_iter=20,eta=3,min_folds=1,player_memory=8,team_memory=4,playoffs=True,
+           start_year=2004,mirror=True,gofast=True,training_dir='Training',results_dir='Model Results/Search'):
+    if grid is None:
+        grid = PARAM_GRIDS[model_name]
+    if strategy == 'random':
+        configs = random_configs(grid,n_iter)
+    else:
+        configs = grid_configs(grid)
+    configs = dict(enumerate(configs))
+    keys = read_keys(get_training_path(player_memory,team_memory,playoffs,training_dir))
+    folds = get_folds(keys,start_year,'season')
+    X,Y,X_names,baseline = load_arrays(player_memory,team_memory,playoffs,training_dir=training_dir)
+    #The mirrored game goes right after the original
+    interleaved_X = np.empty((2*X.shape[0],X.shape[1]),dtype=np.float32)
+    interleaved_X[0::2] = X
+    np.take(X,get_mirror_index(X_names),axis=1,out=interleaved_X[1::2])
+    interleaved_Y = np.empty(2*len(Y),dtype=np.float32)
+    interleaved_Y[0::2] = Y
+    interleaved_Y[1::2] = -np.asarray(Y)
+    shared_X, X_info = share_array(interleaved_X)
+    shared_Y, Y_info = share_array(interleaved_Y)
+    del interleaved_X, interleaved_Y
+    if not gofast:
+        cores = int(cpu_count()*.75)
+    else:
+        cores = int(cpu_count()*0.9)
+    cores = max(1,cores)
+    print ("Searching %s configurations over %s seasons using %s cores:"%(len(configs),len(folds),cores))
+    results = []
+    try:
+        with Pool(cores,initializer=init_worker,initargs=({'X':X_info,'Y':Y_info},)) as pool:
+            if strategy == 'halving':
+                n_folds = min_folds
+                while True:
+                    stage = run_configs(pool,model_name,configs,folds[-n_folds:],mirror)
+                    results.extend(stage)
+                    if n_folds >= len(folds) or len(configs) == 1:
+                        break
+                    stage = sorted(stage,key=lambda result: result['spread_accuracy'],reverse=True)
+                    configs = {result['config']:configs[result['config']] for result in stage[:max(1,len(stage)//eta)]}
+                    n_folds = min(len(folds),n_folds*eta)
+            else:
+                results = run_configs(pool,model_name,configs,folds,mirror)
+    finally:
+        for shared in (shared_X,shared_Y):
+            shared.close()
+            shared.unlink()
+    results = pd.DataFrame(results).sort_values(['folds','spread_accuracy'],ascending=False)
+    os.makedirs(results_dir,exist_ok=True)
+    results.to_csv(os.path.join(results_dir,'%s-%s.csv'%(model_name,strategy)),index=False)
+    return results
+
+if __name__ == '__main__':
+    freeze_support()
+    results = search('rf',strategy='halving')
+    print (results.head(10).to_string(index=False))
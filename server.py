@@ -0,0 +1,216 @@
+"""
+A small local HTTP server for scoring matchups.
+
+For keeping an eye on line movement we want to rescore the same matchups over
+and over during the day, and rebuilding the features with predict.py reads
+every team sheet and player career each time. This loads the models and the
+team sheets once when it starts, and builds every team's features going into
+their next game right away, so a prediction for an upcoming game is just
+looking up two rows and one predict call.
+
+GET /predict?away=Jets&home=Patriots&date=2019-09-08&model=rf
+POST /predict with a json list of {"away", "home", "date", "model"}
+GET /health
+
+Dates after a team's last game in the team sheets use the features that were
+built at start up. Earlier dates get built the first time they're asked for
+and kept after that.
+"""
+import json
+import threading
+import numpy as np
+import pandas as pd
+from time import time
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from multiprocessing import freeze_support
+from make_training import read_team_tables, number_team_games, batch_team_features, FEATURE_NAMES
+from model_registry import load_model, load_meta
+
+"""
+The models we load at start up, the name requests use: the model's name in the
+model registry. The random forest gets saved by RandomForest.py and the OLS
+model by ols_model.py.
+"""
+MODELS = {'rf': 'rf',
+          'ols': 'ols'}
+
+"""
+This holds the team sheets, and every team's features, in memory. The features
+for each team are kept as a float32 array in the same order as the home and
+away blocks of FEATURE_NAMES, so a game's X is the home team's array followed
+by the away team's.
+"""
+class FeatureStore(object):
+    def __init__(self,player_memory=8,team_memory=4,playoffs=True,player_dir='Players',team_dir='Teams',gofast=True):
+        self.player_memory = player_memory
+        self.team_memory = team_memory
+        self.playoffs = playoffs
+        self.player_dir = player_dir
+        self.gofast = gofast
+        self.tables = read_team_tables(team_dir)
+        self.games = number_team_games(self.tables['Game Stats'])
+        self.lock = threading.Lock()
+        self.cache = {}
+        #Every team's next game is the day after their last one as far as the
+        #features are concerned
+        last_games = self.games.groupby('Team').agg(Target=('Game Number','size'),Last=('Date','max')).reset_index()
+        self.last_game = dict(zip(last_games['Team'],last_games['Last']))
+        targets = last_games.assign(**{'Target Date':last_games['Last'] + pd.Timedelta(days=1)})
+        targets = targets.loc[targets['Target'] >= team_memory,['Team','Target','Target Date']]
+        self.next_game = self.build(targets)
+
+    """
+    This builds the feature arrays for a set of target games.
+    """
+    def build(self,targets):
+        features = batch_team_features(self.tables,self.games,self.player_memory,self.team_memory,self.playoffs,
+                                       self.player_dir,self.gofast,targets)
+        features = np.where(features.isna(),0,features.values).astype(np.float32)
+        return {team:row for team, row in zip(targets['Team'],features)}
+
+    """
+    This gets a team's features going into the game on the date. The features
+    are built outside of the lock, since building them starts up a pool, so 
+    one request building features doesn't hold up every other request. If two
+    requests ask for the same new date at once it gets built twice, and the 
+    first one to finish is the one we keep.
+    """
+    def get(self,team,date):
+        if team not in self.last_game:
+            raise KeyError('No team sheet for %s'%team)
+        if date > self.last_game[team]:
+            if team not in self.next_game:
+                raise KeyError('Not enough games for %s'%team)
+            return self.next_game[team]
+        with self.lock:
+            if (team,date) in self.cache:
+                return self.cache[(team,date)]
+        played = self.games.loc[(self.games['Team'] == team) & (self.games['Date'] < date)]
+        if len(played) < self.team_memory:
+            raise KeyError('Not enough games for %s before %s'%(team,date.date()))
+        targets = pd.DataFrame({'Team':[team],'Target':[len(played)],'Target Date':[date]})
+        features = self.build(targets)[team]
+        with self.lock:
+            return self.cache.setdefault((team,date),features)
+
+"""
+Loading the models, they run single threaded since each request is only a game
+or two, and spinning up threads would take longer than the prediction.
+"""
+def load_models(models=MODELS):
+    loaded = {}
+    positions = {name:i for i, name in enumerate(FEATURE_NAMES)}
+    for name, registry_name in models.items():
+        feature_names = load_meta(registry_name)['feature_names']
+        model = load_model(registry_name)
+        if hasattr(model,'n_jobs'):
+            model.n_jobs = 1
+        columns = None if feature_names is None else np.array([positions[feature] for feature in feature_names])
+        loaded[name] = (model,columns)
+    return loaded
+
+"""
+Checking that a request is a list of games, each a dict with at least an away
+team, home team, and date. Returns what's wrong with it, or None if it's fine.
+"""
+def check_games(games):
+    if not isinstance(games,list):
+        return 'body has to be a json list of games'
+    for i, game in enumerate(games):
+        if not isinstance(game,dict):
+            return 'game %s has to be an object with away, home, and date'%i
+        missing = [key for key in ['away','home','date'] if key not in game]
+        if missing:
+            return 'game %s is missing %s'%(i,', '.join(missing))
+        if not all(isinstance(game[key],str) for key in ['away','home','date']):
+            return 'the away, home, and date of game %s have to be strings'%i
+        if not isinstance(game.get('model','rf'),str):
+            return 'the model of game %s has to be a string'%i
+    return None
+
+"""
+This scores a list of games, each a dict of away, home, date, and optionally
+the model.
+"""
+def score_games(store,models,games):
+    X = np.empty((len(games),len(FEATURE_NAMES)),dtype=np.float32)
+    half = len(FEATURE_NAMES)//2
+    for i, game in enumerate(games):
+        date = pd.Timestamp(game['date'])
+        X[i,:half] = store.get(game['home'],date)
+        X[i,half:] = store.get(game['away'],date)
+    results = []
+    for model_name in dict.fromkeys([game.get('model','rf') for game in games]):
+        if model_name not in models:
+            raise KeyError('No model named %s'%model_name)
+        model, columns = models[model_name]
+        rows = [i for i, game in enumerate(games) if game.get('model','rf') == model_name]
+        model_X = X[rows] if columns is None else X[rows][:,columns]
+        for i, pred in zip(rows,np.asarray(model.predict(model_X)).reshape(-1)):
+            results.append((i,dict(games[i],model=model_name,predicted_differential=float(pred))))
+    return [result for _, result in sorted(results,key=lambda result: result[0])]
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    def send_json(self,status,body):
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def score(self,games):
+        start = time()
+        try:
+            predictions = score_games(self.server.store,self.server.models,games)
+        except (KeyError, ValueError) as e:
+            return self.send_json(400,{'error':e.args[0] if e.args else str(e)})
+        self.send_json(200,{'predictions':predictions,'ms':(time() - start)*1000})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/health':
+            return self.send_json(200,{'models':list(self.server.models),'teams':len(self.server.store.next_game)})
+        if url.path != '/predict':
+            return self.send_json(404,{'error':'not found'})
+        query = {key:val[0] for key, val in parse_qs(url.query).items()}
+        if not {'away','home','date'} <= set(query):
+            return self.send_json(400,{'error':'away, home, and date are required'})
+        self.score([query])
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/predict':
+            return self.send_json(404,{'error':'not found'})
+        try:
+            games = json.loads(self.rfile.read(int(self.headers.get('Content-Length',0))))
+        except ValueError:
+            return self.send_json(400,{'error':'body has to be a json list of games'})
+        error = check_games(games)
+        if error is not None:
+            return self.send_json(400,{'error':error})
+        self.score(games)
+
+    #The default logs every request to stderr, which is way too much when
+    #we're load testing
+    def log_message(self,format,*args):
+        pass
+
+"""
+Starting the server, it runs until it's interrupted.
+"""
+def serve(host='127.0.0.1',port=8000,models=MODELS,player_memory=8,team_memory=4,playoffs=True,player_dir='Players',team_dir='Teams'):
+    server = ThreadingHTTPServer((host,port),PredictionHandler)
+    print ('Loading models and features')
+    server.models = load_models(models)
+    server.store = FeatureStore(player_memory,team_memory,playoffs,player_dir,team_dir)
+    print ('Serving on http://%s:%s'%(host,port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+if __name__ == '__main__':
+    freeze_support()
+    serve()
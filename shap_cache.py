@@ -0,0 +1,142 @@
+"""
+Precomputing the SHAP values for the models in the model registry.
+
+The notebook used to run TreeExplainer over the whole test set every time it
+ran, which takes minutes on the full forest. Here the games get split up into
+chunks that are explained across worker processes, and the SHAP values get
+saved under a fingerprint of the model and a fingerprint of the games we
+explained, so the notebook only has to load them after the first time.
+
+Each worker loads the model from the registry itself, and reads its chunk of
+the games from a memory map of the cached copy of them, so neither the model
+nor the games get pickled over to the workers.
+
+Each explanation gets a directory in Model Results/SHAP that holds:
+
+X.npy - the games we explained
+rows.npy - which rows of the data those games were, if we subsampled
+shap_values.npy - the SHAP value of every feature of every game
+meta.json - the model name, feature names, and the expected value
+"""
+import os
+import json
+import shap
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool, cpu_count, freeze_support
+from model_registry import load_model, load_data, load_meta, model_fingerprint, REGISTRY_DIR
+from training_data import data_fingerprint
+
+SHAP_DIR = 'Model Results/SHAP'
+
+"""
+This sets up each worker process with its own explainer. The model runs single
+threaded inside the workers, since the workers are already using all of the
+cores.
+"""
+def init_worker(name,registry_dir,X_path):
+    global worker
+    model = load_model(name,registry_dir)
+    if hasattr(model,'n_jobs'):
+        model.n_jobs = 1
+    worker = {'explainer':shap.TreeExplainer(model),
+              'X':np.load(X_path,mmap_mode='r')}
+
+"""
+This explains a single chunk of games.
+"""
+def explain_chunk(task):
+    start, stop = task
+    explainer = worker['explainer']
+    shap_values = explainer.shap_values(np.asarray(worker['X'][start:stop]))
+    return start, stop, np.asarray(shap_values), float(np.ravel(explainer.expected_value)[0])
+
+"""
+This picks which rows of the data to explain, all of them if sample is None,
+otherwise a random sample of that many of them in their original order.
+"""
+def get_rows(n_rows,sample=None,seed=42):
+    if sample is None or sample >= n_rows:
+        return np.arange(n_rows)
+    rng = np.random.default_rng(seed)
+    return np.sort(rng.choice(n_rows,size=sample,replace=False))
+
+"""
+Loading an explanation we've already computed. The SHAP values and the games
+are memory mapped, so this is quick no matter how many games there are.
+"""
+def load_shap(path):
+    with open(os.path.join(path,'meta.json'),'r') as meta_file:
+        explanation = json.load(meta_file)
+    for array_name in ['X','rows','shap_values']:
+        explanation[array_name] = np.load(os.path.join(path,'%s.npy'%array_name),mmap_mode='r')
+    return explanation
+
+"""
+This acts as our main for the SHAP values. If the model and games have already
+been explained we just load them, otherwise the games are explained in chunks
+across the pool and written into the cache as they come back.
+
+name - the model's name in the model registry, i.e. rf
+X - the games to explain, the model's test set if None
+sample - how many games to explain, all of them if None
+
+Returns the explanation from load_shap.
+"""
+def compute_shap(name,X=None,sample=None,chunk_size=256,gofast=True,seed=42,registry_dir=REGISTRY_DIR,shap_dir=SHAP_DIR):
+    if X is None:
+        X = load_data(name,registry_dir)[1]
+    rows = get_rows(X.shape[0],sample,seed)
+    if len(rows) == 0:
+        raise ValueError('There are no games to explain')
+    X = np.ascontiguousarray(X[rows])
+    path = os.path.join(shap_dir,'%s-%s-%s'%(name,model_fingerprint(name,registry_dir),data_fingerprint(X)))
+    if os.path.exists(os.path.join(path,'meta.json')):
+        print ("Loaded SHAP values for %s from cache"%name)
+        return load_shap(path)
+    os.makedirs(path,exist_ok=True)
+    np.save(os.path.join(path,'X.npy'),X)
+    np.save(os.path.join(path,'rows.npy'),rows)
+    tasks = [(start,min(start + chunk_size,X.shape[0])) for start in range(0,X.shape[0],chunk_size)]
+    if not gofast:
+        cores = int(cpu_count()*.75)
+    else:
+        cores = int(cpu_count()*0.9)
+    cores = max(1,min(cores,len(tasks)))
+    print ("Explaining %s games in %s chunks using %s cores:"%(X.shape[0],len(tasks),cores))
+    #The values go into a partial file, and only get their real name once
+    #every chunk is in, so an interrupted run never looks finished
+    partial_path = os.path.join(path,'shap_values.partial.npy')
+    shap_values = np.lib.format.open_memmap(partial_path,mode='w+',dtype=np.float32,shape=X.shape)
+    with Pool(cores,initializer=init_worker,initargs=(name,registry_dir,os.path.join(path,'X.npy'))) as pool:
+        for start, stop, chunk_values, expected_value in pool.imap_unordered(explain_chunk,tasks):
+            shap_values[start:stop] = chunk_values
+    shap_values.flush()
+    del shap_values
+    os.replace(partial_path,os.path.join(path,'shap_values.npy'))
+    meta = {'name':name,
+            'feature_names':load_meta(name,registry_dir)['feature_names'],
+            'expected_value':expected_value}
+    with open(os.path.join(path,'meta.json'),'w') as meta_file:
+        json.dump(meta,meta_file,indent=1)
+    return load_shap(path)
+
+"""
+This looks up a single game in an explanation, by its row in the data we
+explained, i.e. its row in the test set. Returns each feature's value and SHAP
+value for the game, biggest influence first.
+"""
+def explain_game(explanation,row):
+    position = np.searchsorted(explanation['rows'],row)
+    if position == len(explanation['rows']) or explanation['rows'][position] != row:
+        raise KeyError('Row %s was not in the sample we explained'%row)
+    names = explanation['feature_names']
+    if names is None:
+        names = ['Feature %s'%i for i in range(explanation['X'].shape[1])]
+    game = pd.DataFrame({'value':explanation['X'][position],
+                         'shap':explanation['shap_values'][position]},index=names)
+    return game.reindex(game['shap'].abs().sort_values(ascending=False).index)
+
+if __name__ == '__main__':
+    freeze_support()
+    compute_shap('rf')
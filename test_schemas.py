@@ -0,0 +1,43 @@
+"""
+Checking that the team game stats we couldn't parse stay missing when the team
+sheets get read back in, instead of turning into games with 0 downs.
+"""
+import numpy as np
+import pandas as pd
+from schemas import read_sheets
+from make_team_sheets import parse_team_stats
+
+def write_team_sheet(path):
+    stats = parse_team_stats(pd.DataFrame({'First Downs':['18','21'],
+                                           'Third Down Conv.':['5-12','--'],
+                                           'Fourth Down Conv.':['1-2','0-1'],
+                                           'Fumbles-Lost':['2-1','1-0']}))
+    game_stats = stats.assign(**{'Total Points':[24,17],'Week':[1,2],'Year':[2017,2017],
+                                 'Date':['2017-09-10','2017-09-17']})
+    defense = pd.DataFrame({'DefInt Int':[1,0],
+                            'Third Downs Defended':game_stats['Third Down Att'],
+                            'Third Downs Stopped':game_stats['Third Down Att'] - game_stats['Third Down Cvt'],
+                            'Points Allowed':[10,20],'Week':[1,2],'Year':[2017,2017],
+                            'Date':['2017-09-10','2017-09-17']})
+    with pd.ExcelWriter(path) as writer:
+        game_stats.to_excel(writer,sheet_name='Game Stats',index=False)
+        defense.to_excel(writer,sheet_name='Defense',index=False)
+
+def test_unparseable_downs_stay_missing(tmp_path):
+    path = tmp_path/'Team.xlsx'
+    write_team_sheet(path)
+    sheets = read_sheets(path,team_sheet=True)
+    game_stats, defense = sheets['Game Stats'], sheets['Defense']
+    assert game_stats['Third Down Att'].tolist()[0] == 12
+    assert game_stats['Third Down Cvt'].tolist()[0] == 5
+    assert game_stats[['Third Down Att','Third Down Cvt']].iloc[1].isna().all()
+    assert defense['Third Downs Stopped'].tolist()[0] == 7
+    assert defense[['Third Downs Defended','Third Downs Stopped']].iloc[1].isna().all()
+
+def test_known_counts_stay_numbers(tmp_path):
+    path = tmp_path/'Team.xlsx'
+    write_team_sheet(path)
+    game_stats = read_sheets(path,'Game Stats',team_sheet=True)
+    assert game_stats['Fourth Down Att'].tolist() == [2,1]
+    assert game_stats['Total Points'].dtype == np.int16
+    assert game_stats['Third Down Att'].sum() == 12
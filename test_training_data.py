@@ -0,0 +1,56 @@
+"""
+Checking the vectorized augment against the row by row version it replaced,
+which mirrored each game by swapping the first half of the columns with the 
+second half.
+"""
+import numpy as np
+from training_data import augment
+
+def old_augment(X,Y):
+    augmented_X = None
+    augmented_Y = np.array([])
+    mid = int(X.shape[1]/2)
+    for i in range(X.shape[0]):
+        aug_row = []
+        for j in range(X.shape[1]):
+            if j < mid:
+                aug_row.append(X[i][mid+j])
+            else:
+                aug_row.append(X[i][j-mid])
+        if augmented_X is None:
+            augmented_X = np.array(aug_row)
+        else:
+            augmented_X = np.vstack((augmented_X,np.array(aug_row)))
+        augmented_Y = np.append(augmented_Y,-Y[i])
+    X = np.vstack((X,augmented_X))
+    Y = np.append(Y,augmented_Y)
+    return X,Y
+
+def get_fixture(games=7,seed=0):
+    rng = np.random.default_rng(seed)
+    features = ['Pass Yds','Rush Yds','Points','Sacks']
+    X_names = ['Home ' + name for name in features] + ['Away ' + name for name in features]
+    X = rng.normal(size=(games,len(X_names))).astype(np.float32)
+    Y = rng.integers(-21,21,games).astype(np.float32)
+    baseline = rng.normal(size=games).astype(np.float32)
+    return X, Y, X_names, baseline
+
+def test_augment_matches_old_augment():
+    X, Y, X_names, baseline = get_fixture()
+    old_X, old_Y = old_augment(X,Y)
+    new_X, new_Y = augment(X,Y,X_names)
+    np.testing.assert_array_equal(new_X,old_X)
+    np.testing.assert_array_equal(new_Y,old_Y)
+
+def test_augment_negates_baseline():
+    X, Y, X_names, baseline = get_fixture()
+    new_X, new_Y, new_baseline = augment(X,Y,X_names,baseline)
+    np.testing.assert_array_equal(new_baseline,np.concatenate((baseline,-baseline)))
+    np.testing.assert_array_equal(new_X,old_augment(X,Y)[0])
+
+def test_augment_matches_by_name():
+    #Shuffling the columns shouldn't change which ones get swapped
+    X, Y, X_names, baseline = get_fixture()
+    order = np.random.default_rng(1).permutation(len(X_names))
+    new_X, new_Y = augment(X[:,order],Y,[X_names[i] for i in order])
+    np.testing.assert_array_equal(new_X,old_augment(X,Y)[0][:,order])
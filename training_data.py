@@ -0,0 +1,177 @@
+"""
+This is the format the training data gets saved in, and the loader every model
+script uses to read it back in.
+
+Before this the training data got pickled as a tuple of lists of dicts, and
+dumped to an excel file that every model reread with openpyxl, which for
+thousands of games by ~100 features takes a while every time we start a model.
+
+Each set of training data is now a directory named the same way the excel
+files were, i.e. Training/Player-8,Team-4,Playoffs-True/ that holds:
+
+X.npy - float32 feature matrix, one row per game
+Y.npy - score differential, away minus home
+baseline.npy - the Vegas line for the game
+keys.csv - the game each row came from
+meta.json - the player and team memory, playoffs, and the feature names
+"""
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+"""
+Getting the directory for a set of training data.
+"""
+def get_training_path(player_memory=None,team_memory=10,playoffs=True,training_dir='Training'):
+    if player_memory is None:
+        player_memory = 'All'
+    return os.path.join(training_dir,'Player-%s,Team-%s,Playoffs-%s'%(player_memory,team_memory,playoffs))
+
+"""
+Writing the training data. The missing features get filled with 0 here, the
+same as the models did after reading the excel sheets, so the loader doesn't
+have to make a copy of X to do it.
+"""
+def write_training(X,Y,baseline,keys,feature_names,player_memory=None,team_memory=10,playoffs=True,training_dir='Training'):
+    path = get_training_path(player_memory,team_memory,playoffs,training_dir)
+    os.makedirs(path,exist_ok=True)
+    X = np.asarray(X,dtype=np.float32)
+    X = np.where(np.isnan(X),0,X).astype(np.float32)
+    np.save(os.path.join(path,'X.npy'),X)
+    np.save(os.path.join(path,'Y.npy'),np.asarray(Y,dtype=np.float32))
+    np.save(os.path.join(path,'baseline.npy'),np.asarray(baseline,dtype=np.float32))
+    pd.DataFrame(keys).to_csv(os.path.join(path,'keys.csv'),index=False)
+    meta = {'player_memory':player_memory,
+            'team_memory':team_memory,
+            'playoffs':playoffs,
+            'games':int(X.shape[0]),
+            'feature_names':list(feature_names)}
+    with open(os.path.join(path,'meta.json'),'w') as meta_file:
+        json.dump(meta,meta_file,indent=1)
+    return path
+
+"""
+Reading the metadata for a set of training data.
+"""
+def read_meta(path):
+    with open(os.path.join(path,'meta.json'),'r') as meta_file:
+        return json.load(meta_file)
+
+"""
+Reading the game keys for a set of training data, in the same order as the rows.
+"""
+def read_keys(path):
+    return pd.read_csv(os.path.join(path,'keys.csv'))
+
+"""
+Picking out features by name. If the columns we want are next to each other
+in X, i.e. the whole Home block, this is just a slice, so it's still a view 
+of the memory mapped file. Otherwise numpy has to copy the columns out.
+"""
+def select_columns(X,feature_names,columns):
+    positions = {name:i for i, name in enumerate(feature_names)}
+    index = [positions[col] for col in columns]
+    if index == list(range(index[0],index[0] + len(index))):
+        return X[:,index[0]:index[0] + len(index)], list(columns)
+    return X[:,index], list(columns)
+
+"""
+This is what the model scripts use to get the X,Y, and baseline data as numpy
+arrays, along with the feature names. The arrays are memory mapped read only 
+from the .npy files instead of read into memory, so there's no parsing or 
+copying when a model starts up, and if we've got a few experiments going on 
+the same box they all share the same pages instead of each having their own
+copy. Since they're read only, anything that needs to change them has to make
+its own copy, which is what we'd want anyways.
+
+columns - the feature names to load, or None for all of them
+"""
+def load_arrays(player_memory=None,team_memory=10,playoffs=True,columns=None,training_dir='Training',mmap_mode='r'):
+    path = get_training_path(player_memory,team_memory,playoffs,training_dir)
+    meta = read_meta(path)
+    X = np.load(os.path.join(path,'X.npy'),mmap_mode=mmap_mode)
+    Y = np.load(os.path.join(path,'Y.npy'),mmap_mode=mmap_mode)
+    baseline = np.load(os.path.join(path,'baseline.npy'),mmap_mode=mmap_mode)
+    X_names = meta['feature_names']
+    if columns is not None:
+        X, X_names = select_columns(X,X_names,columns)
+    return X,Y,X_names,baseline
+
+"""
+Same as load_arrays, but for statsmodels where we want X as a dataframe with
+the feature names and Y and baseline as series. These are wrapped around the
+memory mapped arrays without copying them.
+"""
+def load_training(player_memory=None,team_memory=10,playoffs=True,columns=None,training_dir='Training'):
+    X,Y,X_names,baseline = load_arrays(player_memory,team_memory,playoffs,columns,training_dir)
+    X = pd.DataFrame(X,columns=X_names,copy=False)
+    Y = pd.Series(Y,name='Score Differential',copy=False)
+    baseline = pd.Series(baseline,name='Vegas Baseline',copy=False)
+    return X,Y,baseline
+
+"""
+A fingerprint of the contents of some arrays, so anything we work out from the
+data can be cached under it, and regenerating the data with different values
+never reuses the old results.
+"""
+def data_fingerprint(*arrays):
+    fingerprint = hashlib.sha1()
+    for array in arrays:
+        fingerprint.update(np.ascontiguousarray(array).tobytes())
+    return fingerprint.hexdigest()[:12]
+
+"""
+This gets the column each feature swaps with when we mirror a game, i.e. 
+'Home Punt Rate' goes with 'Away Punt Rate'. It's done by name so it doesn't 
+matter where the home and away blocks are in X. Anything that isn't a home or
+away feature stays where it is.
+"""
+def get_mirror_index(X_names):
+    positions = {name:i for i, name in enumerate(X_names)}
+    mirror = []
+    for name in X_names:
+        if name.startswith('Home '):
+            mirror.append(positions['Away ' + name[len('Home '):]])
+        elif name.startswith('Away '):
+            mirror.append(positions['Home ' + name[len('Away '):]])
+        else:
+            mirror.append(positions[name])
+    return np.array(mirror)
+
+"""
+Data Augmentation is a useful technique that allows us to get more meaningful
+data from what we already have. Here we mirror the game results around the 
+teams, i.e. swap the home and away columns and negate the differential, and the
+Vegas line if we pass it in, essentially doubling the size of our data.
+
+The mirrored games are written into the bottom half of one array that's 
+allocated up front, instead of stacking them on one row at a time.
+"""
+def augment(X,Y,X_names,baseline=None):
+    games = X.shape[0]
+    augmented_X = np.empty((2*games,X.shape[1]),dtype=X.dtype)
+    augmented_X[:games] = X
+    np.take(X,get_mirror_index(X_names),axis=1,out=augmented_X[games:])
+    augmented_Y = np.concatenate((Y,-np.asarray(Y)))
+    if baseline is None:
+        return augmented_X,augmented_Y
+    return augmented_X,augmented_Y,np.concatenate((baseline,-np.asarray(baseline)))
+
+"""
+This pairs up the home and away values of each feature for the NN, giving back
+an array of shape (games, features, 2). The pairs are matched by name. If X is
+laid out the way make_training writes it, the home block then the away block 
+in the same order, this is just a reshape and transpose of X, so it's a view 
+and nothing gets copied. Otherwise the two blocks get stacked into a new array.
+"""
+def home_away_stack(X,X_names):
+    positions = {name:i for i, name in enumerate(X_names)}
+    home = [positions[name] for name in X_names if name.startswith('Home ')]
+    away = [positions['Away ' + X_names[i][len('Home '):]] for i in home]
+    features = len(home)
+    if (home == list(range(features)) and away == list(range(features,2*features))
+            and X.shape[1] == 2*features and X.flags.c_contiguous):
+        return X.reshape(X.shape[0],2,features).transpose(0,2,1)
+    return np.stack((X[:,home],X[:,away]),axis=2)